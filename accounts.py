@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+class AccountPool:
+    """The portal accounts a batch is sharded across.
+
+    Workers are assigned to accounts round robin and each logs in with its own
+    account, so records are no longer serialized through one login. All workers
+    still pull from the batch's shared queue: an account whose session has expired
+    or that answers slowly simply takes fewer records, and an account whose login
+    fails is marked down so its workers stop and leave the rest to the others.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = {account['username']: account for account in credentials}
+        self.lock = threading.Lock()
+        self.login_locks = {username: threading.Lock() for username in self.credentials}
+        self.async_login_locks = {}
+        self.workers = {}  # worker id -> username
+        self.stats_by_account = {username: {'status': 'idle', 'workers': 0, 'processed': 0, 'successful': 0,
+                                            'logins': 0, 'started': None}
+                                 for username in self.credentials}
+
+    def assign(self, workers):
+        """Spread worker ids 1..workers over the accounts, round robin"""
+        usernames = list(self.credentials)
+        for worker_id in range(1, workers + 1):
+            username = usernames[(worker_id - 1) % len(usernames)]
+            self.workers[worker_id] = username
+            self.stats_by_account[username]['workers'] += 1
+            self.stats_by_account[username]['status'] = 'starting'
+
+    def account_for(self, worker_id):
+        return self.credentials[self.workers[worker_id]]
+
+    def login_lock(self, account):
+        """Lock held while one of the account's workers logs it in"""
+        return self.login_locks[account['username']]
+
+    def async_login_lock(self, account):
+        """login_lock for the asyncio engine; created on first use inside the running event loop"""
+        return self.async_login_locks.setdefault(account['username'], asyncio.Lock())
+
+    def logged_in(self, account):
+        with self.lock:
+            stats = self.stats_by_account[account['username']]
+            stats['status'] = 'active'
+            stats['logins'] += 1
+            stats['started'] = stats['started'] or time.monotonic()
+
+    def session_reused(self, account):
+        with self.lock:
+            stats = self.stats_by_account[account['username']]
+            stats['status'] = 'active'
+            stats['started'] = stats['started'] or time.monotonic()
+
+    def mark_down(self, account):
+        with self.lock:
+            self.stats_by_account[account['username']]['status'] = 'down'
+
+    def is_down(self, account):
+        return self.stats_by_account[account['username']]['status'] == 'down'
+
+    def record(self, account, success):
+        with self.lock:
+            stats = self.stats_by_account[account['username']]
+            stats['processed'] += 1
+            if success:
+                stats['successful'] += 1
+
+    def stats(self):
+        """Per account status, worker count, logins, records done and records/min since its first login"""
+        with self.lock:
+            report = {}
+            for username, stats in self.stats_by_account.items():
+                if not stats['workers']:
+                    continue
+                minutes = (time.monotonic() - stats['started']) / 60 if stats['started'] else 0
+                report[username] = {key: value for key, value in stats.items() if key != 'started'}
+                report[username]['records_per_minute'] = round(stats['processed'] / minutes, 2) if minutes else 0.0
+            return report
@@ -1,16 +1,34 @@
-from flask import Flask, request, render_template, redirect, url_for, jsonify, flash, session
+from flask import Flask, request, render_template, redirect, url_for, jsonify, flash, session, abort, send_file, Response
 from werkzeug.utils import secure_filename
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError
+from playwright.async_api import async_playwright
+import asyncio
+import contextvars
 import time
 import pandas as pd
 import os
 import threading
 import logging
-import re
 import json
-import uuid
 import random
+import queue
+import types
+from collections import Counter, deque
+from itertools import islice
+import job_store
+import ingest
+import screenshots
+import fetch_results
+import flow
+import timings
+import metrics
+import retries
+from browser_health import BrowserSupervisor, AsyncBrowserSupervisor, SharedBrowser
+from launch_profiles import LAUNCH_PROFILES, resolve_profile, block_resources, block_resources_async, resource_blocker
+from strategy_cache import LearnedValues, StrategyCache
+from captcha_relay import CaptchaRelay
+from accounts import AccountPool
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Required for session and flash messages
@@ -18,15 +36,78 @@ app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'Uploads')
 app.config['SCREENSHOT_FOLDER'] = os.path.join(os.getcwd(), 'screenshots')
 app.config['TEMP_FOLDER'] = os.path.join(os.getcwd(), 'temp')  # New folder for temp files
 app.config['LOG_FILE'] = os.path.join(os.getcwd(), 'process.log')
+app.config['JOB_DB'] = os.path.join(os.getcwd(), 'jobs.db')  # SQLite job store for resumable batches
+# Screenshot capture policy: 'errors', 'sampled' (errors plus a share of debug shots) or 'always'
+app.config['SCREENSHOT_POLICY'] = os.environ.get('SCREENSHOT_POLICY', 'errors')
+app.config['SCREENSHOT_SAMPLE_RATE'] = float(os.environ.get('SCREENSHOT_SAMPLE_RATE', 0.1))
+app.config['SCREENSHOT_FORMAT'] = os.environ.get('SCREENSHOT_FORMAT', 'jpeg')  # 'jpeg', 'png' or 'webp' (needs Pillow)
+app.config['SCREENSHOT_QUALITY'] = int(os.environ.get('SCREENSHOT_QUALITY', 60))
+app.config['SCREENSHOT_QUOTA_MB'] = int(os.environ.get('SCREENSHOT_QUOTA_MB', 500))  # Oldest files are evicted beyond this
+# Loan application steps, re-read at the start of every batch
+app.config['FLOW_FILE'] = os.environ.get('FLOW_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loan_flow.json'))
+app.config['CLICK_STRATEGY_FILE'] = os.path.join(app.config['TEMP_FOLDER'], 'click_strategies.json')  # Learned OK click order
+app.config['LEARNED_URL_FILE'] = os.path.join(app.config['TEMP_FOLDER'], 'learned_urls.json')  # e.g. the loan form's URL
+# Browser launch profile: 'headed', 'headless', 'headless-new' or 'xvfb' (headed on a virtual display)
+app.config['LAUNCH_PROFILE'] = os.environ.get('LAUNCH_PROFILE', 'headed')
+# Skip fonts, media and analytics. Off by default: routing every request through Python turns off
+# Playwright's HTTP cache, so the portal's scripts and styles would reload on every navigation
+app.config['BLOCK_RESOURCES'] = os.environ.get('BLOCK_RESOURCES', '0') == '1'
+# Skip images too; only for flows that never target an image, loan_flow.json clicks one on the loan form
+app.config['BLOCK_IMAGES'] = os.environ.get('BLOCK_IMAGES', '0') == '1'
+# Automation engine: 'sync' runs one thread and browser per worker, 'async' runs every worker as a task
+# with its own context on one shared browser and event loop, which scales to dozens of workers
+app.config['ENGINE'] = os.environ.get('ENGINE', 'sync')
+app.config['SESSION_STATE_FILE'] = os.path.join(app.config['TEMP_FOLDER'], 'portal_session.json')  # Saved Playwright storage state
 
 # Configuration
 SHEET_NAME = "Sheet1"
 FINANCIAL_YEAR = "2024-2025"
+PORTAL_URL = os.environ.get('PORTAL_URL', "https://fasalrin.gov.in")  # Point at mock_portal.py for benchmarks
+LOGIN_URL = f"{PORTAL_URL}/login"
+DASHBOARD_URL = f"{PORTAL_URL}/dashboard"
+FETCH_RECORD_RESPONSE = os.environ.get('FETCH_RECORD_RESPONSE', 'fetch')  # Part of the URL of the portal's fetch record XHR
+LOAN_PAGE_URL = os.environ.get('LOAN_PAGE_URL')  # Direct route to the loan form; learned from the dashboard link when unset
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))  # Upper bound on parallel browser contexts per batch
+ASYNC_MAX_WORKERS = int(os.environ.get('ASYNC_MAX_WORKERS', 32))  # The same bound for the async engine
+LOG_BUFFER_SIZE = int(os.environ.get('LOG_BUFFER_SIZE', 2000))  # Log entries kept in memory for the UI
+SSE_HEARTBEAT = 15  # Seconds between keep-alive comments on idle /events streams
+CAPTCHA_TIMEOUT = int(os.environ.get('CAPTCHA_TIMEOUT', 120))  # Seconds a login waits for its CAPTCHA to be solved
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', 3))  # Attempts per record before a transient failure is final
+RETRY_BASE_DELAY = int(os.environ.get('RETRY_BASE_DELAY', 30))  # Seconds before the first retry, doubled each time
+RETRY_MAX_DELAY = int(os.environ.get('RETRY_MAX_DELAY', 300))
+# Browser health: recycle a worker's context every N records, past a JS heap size or error rate
+RECYCLE_EVERY = int(os.environ.get('RECYCLE_EVERY', 50))
+MAX_JS_HEAP_MB = int(os.environ.get('MAX_JS_HEAP_MB', 512))
+MAX_ERROR_RATE = float(os.environ.get('MAX_ERROR_RATE', 0.5))  # Share of the last 10 records failing for browser reasons
+
+# Pacing profiles: delay_scale multiplies the pre-step delays and fixed pauses,
+# post_delay is the pause after each step and settle_timeout (ms) bounds condition waits.
+# input_strategy picks how text fields are filled: 'fill' (one call), 'sequential'
+# (press_sequentially with type_delay ms between keys) or 'human' (random per-key sleeps)
+PACING_PROFILES = {
+    'fast': {'delay_scale': 0.0, 'post_delay': 0.0, 'settle_timeout': 10000,
+             'input_strategy': 'fill', 'type_delay': 0},
+    'human-like': {'delay_scale': 0.4, 'post_delay': 0.3, 'settle_timeout': 15000,
+                   'input_strategy': 'sequential', 'type_delay': 50},
+    'safe': {'delay_scale': 1.0, 'post_delay': 1.0, 'settle_timeout': 15000,
+             'input_strategy': 'human', 'type_delay': 0}
+}
+DEFAULT_PACING_PROFILE = os.environ.get('PACING_PROFILE', 'safe')
 
 # Create folders
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['SCREENSHOT_FOLDER'], exist_ok=True)
 os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
+job_store.init_db(app.config['JOB_DB'])
+step_timer = timings.TimingRecorder()  # Per-step wall time split, reported per batch
+click_strategies = StrategyCache(app.config['CLICK_STRATEGY_FILE'])
+learned_urls = LearnedValues(app.config['LEARNED_URL_FILE'])
+screenshot_writer = screenshots.ScreenshotWriter(app.config['SCREENSHOT_FOLDER'], app.config['JOB_DB'],
+                                                 policy=app.config['SCREENSHOT_POLICY'],
+                                                 sample_rate=app.config['SCREENSHOT_SAMPLE_RATE'],
+                                                 image_format=app.config['SCREENSHOT_FORMAT'],
+                                                 quality=app.config['SCREENSHOT_QUALITY'],
+                                                 quota_bytes=app.config['SCREENSHOT_QUOTA_MB'] * 1024 * 1024)
 
 # Load credentials from JSON file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -47,120 +128,430 @@ except json.JSONDecodeError:
 processing_state = {
     'is_processing': False,
     'progress': 0,
-    'logs': [],
+    'logs': deque(maxlen=LOG_BUFFER_SIZE),
+    'log_cursor': 0,  # id of the newest log entry, never reset so client cursors stay valid
     'successful_count': 0,
     'total_records': 0,
-    'current_aadhaar': ''
+    'current_aadhaar': '',
+    'processed_count': 0,
+    'workers': {},
+    'pacing_profile': DEFAULT_PACING_PROFILE,
+    'run_metadata': {},
+    'flow_steps': [],
+    'record_queue': None,
+    'retry_queue': None,
+    'launch_profile': 'headed',
+    'account_pool': None,  # Accounts of credentials.json the running batch is sharded across
+    'fetch_response_misses': 0,  # Fetch record responses in a row that could not be read
+    'job_id': None
 }
+state_lock = threading.Lock()  # Guards counters shared between worker threads
+
+class TaskLocal:
+    """Like threading.local, but also separate per asyncio task: attributes live in a context variable"""
+
+    def __init__(self):
+        object.__setattr__(self, 'current', contextvars.ContextVar('task_local'))
+
+    def namespace(self):
+        try:
+            return self.current.get()
+        except LookupError:
+            return self.reset()
+
+    def reset(self):
+        """Start from an empty set of attributes in this thread or task"""
+        namespace = types.SimpleNamespace()
+        self.current.set(namespace)
+        return namespace
+
+    def __getattr__(self, name):
+        return getattr(self.namespace(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.namespace(), name, value)
+
+record_context = TaskLocal()  # Per-worker details of the record being processed
+log_lock = threading.Lock()  # Keeps log ids in order when workers log concurrently
+state_changed = threading.Condition()  # Wakes /events streams when logs or progress change
+
+# Prometheus metrics served at /metrics; counters live for the whole process, gauges are read at scrape time
+metrics_registry = metrics.Registry()
+records_processed = metrics_registry.counter('loan_records_processed_total', 'Records finished, by result')
+records_failed = metrics_registry.counter('loan_records_failed_total', 'Failed records, by failure reason')
+records_retried = metrics_registry.counter('loan_records_retried_total', 'Transient failures deferred for another attempt')
+step_latency = metrics_registry.histogram('loan_step_duration_seconds', 'Wall time of each flow step, including retries')
+record_latency = metrics_registry.histogram('loan_record_duration_seconds', 'Wall time of one record, start to finish',
+                                            buckets=(30, 60, 90, 120, 180, 300, 600))
+# Accounts are labelled by their position in credentials.json: /metrics is scraped without a login and
+# portal usernames are mobile numbers
+account_records = metrics_registry.counter('loan_account_records_total',
+                                           'Records finished, by portal account (credentials.json position) and result')
+browser_launches = metrics_registry.counter('loan_browser_launches_total', 'Chromium instances launched')
+browser_restarts = metrics_registry.counter('loan_browser_restarts_total', 'Browsers relaunched within a batch')
+context_recycles = metrics_registry.counter('loan_context_recycles_total', 'Browser contexts replaced to keep workers healthy')
+metrics_registry.gauge('loan_batch_in_progress', 'Whether a batch is running',
+                       lambda: int(processing_state['is_processing']))
+metrics_registry.gauge('loan_active_workers', 'Workers that have not finished or crashed',
+                       lambda: sum(1 for worker in processing_state['workers'].values()
+                                   if worker['status'] in ('starting', 'logging in', 'processing', 'waiting for retry')))
+metrics_registry.gauge('loan_queue_depth', 'Records waiting in the batch queue',
+                       lambda: processing_state['record_queue'].qsize() if processing_state['record_queue'] else 0)
+metrics_registry.gauge('loan_retry_queue_depth', 'Records waiting for their retry backoff',
+                       lambda: len(processing_state['retry_queue']) if processing_state['retry_queue'] else 0)
+metrics_registry.gauge('loan_screenshot_bytes_written_total', 'Screenshot bytes written to disk',
+                       lambda: screenshot_writer.stats()['bytes_written'], kind='counter')
+metrics_registry.gauge('loan_screenshot_disk_bytes', 'Screenshot bytes currently on disk',
+                       lambda: screenshot_writer.stats()['disk_usage'])
 
 # Setup logging
 logging.basicConfig(filename=app.config['LOG_FILE'], level=logging.INFO, format='%(asctime)s: %(message)s')
 
 def log_message(message, tag="info"):
     formatted_message = f"{message}"
-    processing_state['logs'].append({'message': formatted_message, 'tag': tag})
+    with log_lock:
+        processing_state['log_cursor'] += 1
+        processing_state['logs'].append({'id': processing_state['log_cursor'], 'message': formatted_message, 'tag': tag})
     logging.info(f"[{tag}] {message}")
     print(f"LOG: [{tag}] {message}")  # Debug
+    notify_state_change()
+
+def notify_state_change():
+    with state_changed:
+        state_changed.notify_all()
+
+captcha_relay = CaptchaRelay(on_change=notify_state_change)  # CAPTCHAs waiting for an operator on the processing page
+
+def get_logs_since(cursor):
+    """Return buffered log entries newer than the cursor; ids are consecutive so no scan is needed"""
+    with log_lock:
+        logs = processing_state['logs']
+        if not logs:
+            return []
+        if cursor > processing_state['log_cursor']:
+            cursor = 0  # Cursor from before a server restart
+        start = max(0, cursor - logs[0]['id'] + 1)
+        return list(islice(logs, start, None))
 
 # Automation Helper Functions
 def slow_typing(element, text, delay_range=(0.1, 0.3)):
     """Type text with human-like delay between characters"""
     for char in text:
         element.type(char)
-        time.sleep(random.uniform(*delay_range))
+        step_timer.sleep(random.uniform(*delay_range))
+
+def type_text(element, text):
+    """Enter text using the input strategy of the active pacing profile"""
+    profile = get_pacing_profile()
+    strategy = profile['input_strategy']
+    if strategy == 'fill':
+        element.fill(text)
+    elif strategy == 'sequential':
+        element.press_sequentially(text, delay=profile['type_delay'])
+    else:
+        slow_typing(element, text)
+
+def get_pacing_profile():
+    """Return the pacing profile selected for the current batch"""
+    return PACING_PROFILES.get(processing_state['pacing_profile'], PACING_PROFILES[DEFAULT_PACING_PROFILE])
+
+def pace(seconds):
+    """Sleep for a fixed pause scaled by the active pacing profile"""
+    scaled = seconds * get_pacing_profile()['delay_scale']
+    if scaled > 0:
+        step_timer.sleep(scaled)
+
+def wait_until(condition, description="page to settle", timeout=None):
+    """Wait for a page condition, bounded by the profile's settle timeout; a timeout never fails the step"""
+    timeout = timeout or get_pacing_profile()['settle_timeout']
+    try:
+        with step_timer.measure('portal'):
+            condition(timeout)
+        return True
+    except Exception:
+        log_message(f"⏳ Gave up waiting for {description} after {timeout // 1000}s", "info")
+        return False
+
+# Conditions for slow_action(wait_for=...) and wait_until, each called with a timeout in ms
+def until_network_idle(page):
+    return lambda timeout: page.wait_for_load_state("networkidle", timeout=timeout)
 
-def slow_action(description, action_func, delay=2.5, max_delay=4.0):
-    """Execute an action with visual feedback and random delay"""
+def until_visible(locator):
+    return lambda timeout: locator.wait_for(state="visible", timeout=timeout)
+
+def until_url_changes(page):
+    start_url = page.url
+    return lambda timeout: page.wait_for_url(lambda url: url != start_url, timeout=timeout)
+
+# Bookkeeping around slow_action, shared by both engines
+def action_started(description, delay, max_delay):
+    """Log the start of an action; returns its random pre-action pause in seconds"""
     log_message(f"⏳ {description}...", "info")
-    time.sleep(random.uniform(delay, max_delay))
-    try:
-        result = action_func()
-        log_message(f"✅ {description} completed", "success")
-        time.sleep(1)
-        return True, result
-    except Exception as e:
-        log_message(f"❌ Failed: {description} - {str(e)}", "error")
-        return False, None
+    return random.uniform(delay, max_delay)
+
+def action_completed(description):
+    """Log a completed action; returns the profile's pause after each step"""
+    log_message(f"✅ {description} completed", "success")
+    return get_pacing_profile()['post_delay']
+
+def action_failed(description, error):
+    log_message(f"❌ Failed: {description} - {str(error)}", "error")
+    record_context.last_error = str(error)
+
+def slow_action(description, action_func, delay=2.5, max_delay=4.0, wait_for=None, timeout=None):
+    """Execute an action with visual feedback, a profile-scaled random delay and an optional wait on a page condition"""
+    with step_timer.span(description):
+        pace(action_started(description, delay, max_delay))
+        try:
+            result = action_func()
+            if wait_for:
+                wait_until(wait_for, description, timeout)
+            post_delay = action_completed(description)
+            if post_delay:
+                step_timer.sleep(post_delay)
+            return True, result
+        except Exception as e:
+            action_failed(description, e)
+            return False, None
 
+# Every OK button variant the portal uses for popups, restricted to visible ones, in one selector
+POPUP_OK_SELECTOR = "button:has-text('OK'):visible, [role='button']:has-text('OK'):visible"
+
+@step_timer.timed()
 def handle_popups(page):
-    """Handle any popup dialogs"""
+    """Handle any popup dialogs; when there is none this costs a single count() round trip"""
     try:
-        # Try multiple ways to find OK buttons
-        selectors = [
-            "button:has-text('OK')",
-            "button.btn-primary:has-text('OK')",
-            "button.modal-btn:has-text('OK')",
-            ".modal-footer button:has-text('OK')",
-            "[role='button']:has-text('OK')"
-        ]
-        
-        for selector in selectors:
-            try:
-                ok_button = page.locator(selector).first
-                if ok_button.is_visible(timeout=1000):
-                    ok_button.click(timeout=3000)
-                    log_message("⚠️ Popup handled with selector: " + selector, "info")
-                    time.sleep(1)
-                    return True
-            except:
-                continue
-        
-        # Also try by role as fallback
-        try:
-            role_button = page.get_by_role("button", name="OK").first
-            if role_button.is_visible(timeout=1000):
-                role_button.click(timeout=3000)
-                log_message("⚠️ Popup handled with role selector", "info")
-                time.sleep(1)
-                return True
-        except:
-            pass
-            
-        return False
+        ok_buttons = page.locator(POPUP_OK_SELECTOR)
+        if ok_buttons.count() == 0:
+            return False
+        ok_buttons.first.click(timeout=3000)
+        log_message("⚠️ Popup handled", "info")
+        pace(1)
+        return True
     except:
         return False
 
-def manual_login(page):
-    """Handle login with manual CAPTCHA entry"""
+def manual_login(page, account):
+    """Handle login of one portal account with manual CAPTCHA entry"""
     log_message("\n=== MANUAL LOGIN ===", "info")
     
     def fill_credentials():
         mobile_field = page.get_by_role("textbox", name="Enter Your Mobile No.")
         mobile_field.click()
-        slow_typing(mobile_field, CREDENTIALS[0]['username'])
+        type_text(mobile_field, account['username'])
         
         password_field = page.get_by_role("textbox", name="Password")
         password_field.click()
-        slow_typing(password_field, CREDENTIALS[0]['password'])
+        type_text(password_field, account['password'])
     
     success, _ = slow_action("Entering credentials", fill_credentials)
     if not success:
         return False
 
-    log_message("🧩 PLEASE ENTER CAPTCHA MANUALLY AND CLICK LOGIN...", "info")
+    challenge_id = captcha_requested(account)
     start_time = time.time()
-    while True:
-        try:
-            page.wait_for_selector("span:has-text('Welcome')", timeout=5000)
-            break
-        except:
-            elapsed = int(time.time() - start_time)
-            log_message(f"⏳ Waiting... {elapsed}s", "info")
-            if elapsed > 120:
-                raise TimeoutError("CAPTCHA timeout")
+    next_reminder = 15
+    try:
+        while True:
+            publish_captcha(page, challenge_id)  # The portal may have refreshed it since the last check
+            # Wake up as soon as an operator answers in the web UI
+            answer = captcha_relay.wait_answer(challenge_id, timeout=2)
+            if answer:
+                log_message("🧩 CAPTCHA answer received, logging in...", "info")
+                submit_captcha(page, answer)
+            try:
+                page.wait_for_selector(WELCOME_SELECTOR, timeout=10000 if answer else 1000)
+                break
+            except:
+                next_reminder = captcha_not_accepted(answer, start_time, next_reminder)
+    finally:
+        captcha_relay.close(challenge_id)
     log_message("\n✅ Login successful!", "success")
-    time.sleep(2)
+    wait_until(until_network_idle(page), "dashboard to load")
+    pace(2)
     handle_popups(page)
     return True
 
+# Shown on the dashboard once a login went through
+WELCOME_SELECTOR = "span:has-text('Welcome')"
+
+def captcha_requested(account):
+    """Ask operators to solve the account's CAPTCHA; returns its challenge id in the relay"""
+    log_message(f"🧩 PLEASE ENTER THE CAPTCHA FOR {account['username']} ON THE PROCESSING PAGE OR IN THE BROWSER WINDOW...",
+                "info")
+    return captcha_relay.open(account['username'])
+
+def captcha_not_accepted(answer, start_time, next_reminder):
+    """The dashboard did not appear yet: give up after CAPTCHA_TIMEOUT, otherwise remind every 15s and return
+    the time of the next reminder"""
+    if answer:
+        log_message("❌ CAPTCHA answer was not accepted, please try the new one", "warning")
+    elapsed = int(time.time() - start_time)
+    if elapsed > CAPTCHA_TIMEOUT:
+        raise TimeoutError("CAPTCHA timeout")
+    if elapsed >= next_reminder:
+        log_message(f"⏳ Waiting... {elapsed}s", "info")
+        next_reminder += 15
+    return next_reminder
+
+# CAPTCHA image on the portal login page
+CAPTCHA_SELECTOR = "img[src*='captcha' i], img[alt*='captcha' i], canvas[id*='captcha' i], [id*='captcha' i] img"
+
+# Login form fields for relayed CAPTCHA answers
+CAPTCHA_INPUT_SELECTOR = "input[name*='captcha' i], input[id*='captcha' i], input[placeholder*='captcha' i]"
+LOGIN_BUTTON_SELECTOR = "button[type='submit'], button:has-text('Login'), button:has-text('Sign In')"
+
+def publish_captcha(page, challenge_id):
+    """Screenshot the CAPTCHA so operators can read and answer it in the web UI"""
+    try:
+        image = page.locator(CAPTCHA_SELECTOR).first.screenshot(type='png', timeout=3000)
+    except Exception as e:
+        print(f"DEBUG: Could not capture CAPTCHA: {str(e)}")  # Debug
+        return False
+    captcha_captured(challenge_id, image)
+    return True
+
+def captcha_captured(challenge_id, image):
+    if captcha_relay.update_image(challenge_id, image):
+        log_message("🧩 CAPTCHA shown on the processing page", "info")
+
+def submit_captcha(page, answer):
+    """Type an operator's CAPTCHA answer into the login form and submit it"""
+    try:
+        field = page.locator(CAPTCHA_INPUT_SELECTOR).first
+        field.fill("")
+        type_text(field, answer)
+        page.locator(LOGIN_BUTTON_SELECTOR).first.click(timeout=5000)
+    except Exception as e:
+        log_message(f"❌ Could not submit the CAPTCHA answer: {str(e)}", "error")
+
+def session_state_path(account):
+    """Saved Playwright storage state of one portal account"""
+    root, extension = os.path.splitext(app.config['SESSION_STATE_FILE'])
+    return f"{root}_{secure_filename(account['username'])}{extension}"
+
+def load_session_state(account):
+    """Return the account's saved portal session file if it was written today, otherwise None"""
+    path = session_state_path(account)
+    if not os.path.exists(path):
+        return None
+    saved_on = datetime.fromtimestamp(os.path.getmtime(path)).date()
+    if saved_on != datetime.now().date():
+        log_message("Saved portal session is from a previous day, a fresh login is needed", "info")
+        return None
+    return path
+
+def save_session_state(context, account):
+    """Persist the logged-in storage state so later batches and workers of the account can skip the login"""
+    context.storage_state(path=session_state_path(account))
+    session_saved(account)
+
+def session_saved(account):
+    log_message(f"💾 Portal session of {account['username']} saved for reuse", "info")
+
+def saved_session_cookies(account):
+    """Cookies of the account's session saved today, or None"""
+    state_path = load_session_state(account)
+    if not state_path:
+        return None
+    with open(state_path, 'r') as f:
+        return json.load(f).get('cookies', [])
+
+def login_finished(account, logged_in, error=None):
+    """Update the account pool after a login attempt; an account whose login failed is marked down"""
+    account_pool = processing_state['account_pool']
+    if error is not None:
+        log_message(f"❌ Login of {account['username']} failed: {str(error)}", "error")
+    if not logged_in:
+        account_pool.mark_down(account)
+        log_message(f"⚠️ Account {account['username']} is unavailable, its workers stop and the other "
+                    f"accounts take over its records", "warning")
+        return False
+    account_pool.logged_in(account)
+    return True
+
+def is_login_page(page):
+    return '/login' in page.url
+
+def refresh_session(page, account):
+    """Recover from a redirect to /login, reusing a session saved by another worker of the account when possible.
+    An account whose login fails is marked down for the rest of the batch."""
+    account_pool = processing_state['account_pool']
+    with account_pool.login_lock(account):
+        if account_pool.is_down(account):
+            return False
+        # Another worker may have logged in again while we were waiting for the lock
+        cookies = saved_session_cookies(account)
+        if cookies is not None:
+            page.context.add_cookies(cookies)
+            page.goto(DASHBOARD_URL, timeout=60000)
+            if not is_login_page(page):
+                log_message("♻️ Picked up refreshed portal session", "success")
+                return True
+
+        log_message(f"Portal session of {account['username']} expired or missing, logging in", "info")
+        try:
+            if not is_login_page(page):
+                page.goto(LOGIN_URL, timeout=60000)
+            wait_until(until_network_idle(page), "login page to load")
+            pace(3)
+            logged_in = login_finished(account, manual_login(page, account))
+        except Exception as e:
+            logged_in = login_finished(account, False, e)
+        if logged_in:
+            save_session_state(page.context, account)
+        return logged_in
+
+def screenshot_details():
+    """Record details stored alongside a screenshot"""
+    return {'job_id': getattr(record_context, 'job_id', None),
+            'position': getattr(record_context, 'position', None),
+            'aadhaar': getattr(record_context, 'aadhaar', None)}
+
+def take_screenshot(page, name, full_page=False, kind='error'):
+    """Capture a screenshot if the capture policy allows it; the file is written in the background"""
+    path = screenshot_writer.capture(page, name, kind=kind, full_page=full_page, **screenshot_details())
+    if path:
+        record_context.screenshot_path = path
+    return path
+
+ACCOUNT_DROPDOWN_SELECTOR = "select[name='accountNumbers']"
+
+def fetched_account():
+    """First account listed by the fetch record response, if it listed any"""
+    fetch_result = getattr(record_context, 'fetch_result', None)
+    if fetch_result and fetch_result['outcome'] == 'accounts':
+        return fetch_result['accounts'][0]
+    return None
+
+def fetched_account_not_selected(account, error):
+    log_message(f"Account {account} from the fetch record response could not be selected ({str(error)}), "
+                f"reading the dropdown instead", "warning")
+
+def account_selection_failed(error):
+    """Log a failed account selection; returns the name of its screenshot"""
+    log_message(f"❌ Failed to select account: {str(error)}", "error")
+    return f"account_selection_error_{datetime.now().strftime('%H%M%S')}"
+
+@step_timer.timed()
 def select_account_number(page):
     """Select account number from dropdown with specific HTML structure"""
     try:
+        account_dropdown = page.locator(ACCOUNT_DROPDOWN_SELECTOR)
+        first_account = fetched_account()
+        if first_account:
+            # The fetch record response already listed the accounts, select_option waits for the option itself
+            try:
+                with step_timer.measure('portal'):
+                    account_dropdown.select_option(first_account, timeout=15000)
+                log_message(f"✅ Successfully selected account: {first_account}", "success")
+                return True
+            except Exception as e:
+                fetched_account_not_selected(first_account, e)
+
         # Wait for dropdown to be visible
-        page.wait_for_selector("select[name='accountNumbers']", timeout=15000)
-        
-        # Get the dropdown element
-        account_dropdown = page.locator("select[name='accountNumbers']")
+        with step_timer.measure('portal'):
+            page.wait_for_selector(ACCOUNT_DROPDOWN_SELECTOR, timeout=15000)
         
         # Get all options
         options = account_dropdown.locator("option").all()
@@ -176,165 +567,398 @@ def select_account_number(page):
         return True
         
     except Exception as e:
-        log_message(f"❌ Failed to select account: {str(e)}", "error")
         # Take screenshot for debugging
-        timestamp = datetime.now().strftime("%H%M%S")
-        page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/account_selection_error_{timestamp}.png")
+        take_screenshot(page, account_selection_failed(e))
         return False
 
-def try_different_ok_clicks(page):
-    """Try multiple ways to click the OK button"""
-    methods = [
-        lambda: page.get_by_role("button", name="OK").click(timeout=5000),
-        lambda: page.locator("button:has-text('OK')").click(timeout=5000),
-        lambda: page.locator(".modal-footer button:has-text('OK')").click(timeout=5000),
-        lambda: page.locator("button.btn-primary:has-text('OK')").click(timeout=5000),
-        lambda: page.locator("[role='button']:has-text('OK')").click(timeout=5000),
-        lambda: page.keyboard.press("Enter", timeout=5000)  # Sometimes Enter key works when buttons don't
-    ]
-    
-    for i, method in enumerate(methods):
+def ok_click_methods(page):
+    """Every way of clicking the OK button by strategy name; with the async API each call returns a coroutine"""
+    return {
+        'role': lambda: page.get_by_role("button", name="OK").click(timeout=5000),
+        'text': lambda: page.locator("button:has-text('OK')").click(timeout=5000),
+        'modal_footer': lambda: page.locator(".modal-footer button:has-text('OK')").click(timeout=5000),
+        'btn_primary': lambda: page.locator("button.btn-primary:has-text('OK')").click(timeout=5000),
+        'role_attribute': lambda: page.locator("[role='button']:has-text('OK')").click(timeout=5000),
+        'enter_key': lambda: page.keyboard.press("Enter")  # Sometimes Enter key works when buttons don't
+    }
+
+def ok_click_tried(step, name, error=None):
+    """Record how an OK click strategy did, so the step's next click starts with the one that last worked"""
+    click_strategies.record(step, name, error is None)
+    if error is None:
+        log_message(f"✅ OK click method '{name}' worked!", "success")
+    else:
+        log_message(f"Method '{name}' failed: {error}", "error")
+
+@step_timer.timed()
+def try_different_ok_clicks(page, step="ok"):
+    """Try multiple ways to click the OK button, starting with the one that last worked for this step"""
+    methods = ok_click_methods(page)
+    for name in click_strategies.order(step, list(methods)):
+        log_message(f"Trying OK click method '{name}' for {step}...", "info")
         try:
-            log_message(f"Trying OK click method {i+1}...", "info")
-            method()
-            log_message(f"✅ OK click method {i+1} worked!", "success")
-            time.sleep(2)  # Wait to see the effect
-            return True
+            methods[name]()
         except Exception as e:
-            log_message(f"Method {i+1} failed: {e}", "error")
-            pass
+            ok_click_tried(step, name, e)
+            continue
+        ok_click_tried(step, name)
+        pace(2)  # Wait to see the effect
+        return True
     
     log_message("❌ All OK click methods failed", "error")
     return False
 
-def process_single_application(page, aadhaar):
-    """Process a single Aadhaar application"""
+# Step actions for the flow file, each called as action(page, step, aadhaar);
+# returning False ends the record as failed without treating it as an error
+def flow_value(step, aadhaar):
+    return step['value'].format(aadhaar=aadhaar, financial_year=FINANCIAL_YEAR)
+
+def action_click(page, step, aadhaar):
+    flow.resolve_target(page, step['target']).click(timeout=step['timeout'])
+
+def action_select(page, step, aadhaar):
+    flow.resolve_target(page, step['target']).select_option(flow_value(step, aadhaar), timeout=step['timeout'])
+
+def action_type(page, step, aadhaar):
+    field = flow.resolve_target(page, step['target'])
+    field.click(timeout=step['timeout'])
+    field.fill("")  # Clear the field first
+    type_text(field, flow_value(step, aadhaar))
+
+def step_already_set(page, step, aadhaar):
+    """True when a skip_if_set step's target already holds its value, e.g. the financial year kept from the last record"""
     try:
-        processing_state['current_aadhaar'] = aadhaar
-        
-        # Navigate to loan page
-        success, _ = slow_action("Opening loan page", 
-                               lambda: page.get_by_role("link", name="Loan Application Loan").click(),
-                               3, 4)
-        if not success:
-            raise Exception("Could not open loan page")
-        
-        # Select financial year
-        success, _ = slow_action("Selecting financial year",
-                               lambda: page.get_by_role("combobox").select_option(FINANCIAL_YEAR))
-        if not success:
-            raise Exception("Financial year selection failed")
-        
-        # Enter Aadhaar
-        def fill_aadhaar():
-            field = page.get_by_role("textbox", name="Enter Aadhaar No.")
-            field.click()
-            field.fill("")  # Clear the field first
-            slow_typing(field, aadhaar)
-            
-        success, _ = slow_action("Entering Aadhaar", fill_aadhaar)
-        if not success:
-            raise Exception("Aadhaar entry failed")
-        
-        # Fetch record
-        success, _ = slow_action("Clicking FETCH RECORD",
-                               lambda: page.get_by_role("button", name="FETCH RECORD").click(),
-                               3, 4)
-        if not success:
-            raise Exception("Fetch record failed")
-        
-        # Check for No Records Found or other error messages
+        return flow.resolve_target(page, step['target']).input_value(timeout=1000) == flow_value(step, aadhaar)
+    except Exception:
+        return False
+
+def loan_page_url():
+    return LOAN_PAGE_URL or learned_urls.get('loan_page')
+
+def ensure_logged_in(page):
+    """Log the record's account back in when navigation landed on /login"""
+    if is_login_page(page) and not refresh_session(page, record_context.account):
+        raise Exception("Portal session expired and login failed")
+
+def wait_for_loan_form(page, step):
+    with step_timer.measure('portal'):
+        flow.resolve_target(page, step['wait_target']).wait_for(
+            state="visible", timeout=step['timeout'] or get_pacing_profile()['settle_timeout'])
+
+def loan_page_direct(page, step):
+    """Open the loan form by its URL, skipping the dashboard"""
+    with step_timer.measure('portal'):
+        page.goto(loan_page_url())
+    if is_login_page(page):
+        ensure_logged_in(page)
+        with step_timer.measure('portal'):
+            page.goto(loan_page_url())
+    wait_for_loan_form(page, step)
+
+def loan_page_via_dashboard(page, step):
+    """Open the loan form through the dashboard link, and learn the form's URL for direct navigation"""
+    if not page.url.startswith(DASHBOARD_URL):
+        with step_timer.measure('portal'):
+            page.goto(DASHBOARD_URL)
+        ensure_logged_in(page)
+        wait_until(until_network_idle(page), "dashboard to load")
+        pace(3)
+    flow.resolve_target(page, step['target']).click(timeout=step['timeout'])
+    wait_for_loan_form(page, step)
+    learn_loan_page_url(page.url)
+
+def learn_loan_page_url(url):
+    """Keep the URL the dashboard link led to, for direct navigation to the loan form"""
+    if not LOAN_PAGE_URL and not url.startswith(DASHBOARD_URL):
+        learned_urls.set('loan_page', url)
+
+LOAN_PAGE_PATHS = {'direct': loan_page_direct, 'dashboard': loan_page_via_dashboard}
+
+def loan_page_paths(page):
+    """Paths to try in order: the dashboard link when already on the dashboard, otherwise the fastest learned
+    path first, with direct navigation only once the form's URL is known"""
+    if page.url.startswith(DASHBOARD_URL):
+        return ['dashboard']
+    names = [name for name in LOAN_PAGE_PATHS if name != 'direct' or loan_page_url()]
+    return click_strategies.order_by_speed('loan_page', names)
+
+def loan_page_path_tried(name, seconds, error=None):
+    """Record how a path to the loan form did; seconds is None when it says nothing about the full path"""
+    if error is not None:
+        click_strategies.record('loan_page', name, False)
+        log_message(f"Loan page via {name} failed: {str(error)}", "warning")
+        if name == 'direct' and not LOAN_PAGE_URL:
+            # The learned URL may be stale; the dashboard link learns it again
+            learned_urls.forget('loan_page')
+    else:
+        click_strategies.record('loan_page', name, True, seconds=seconds)
+
+def action_open_loan_page(page, step, aadhaar):
+    """Bring the page to the loan form, falling back to the next path when one fails"""
+    on_dashboard = page.url.startswith(DASHBOARD_URL)
+    error = None
+    for name in loan_page_paths(page):
+        started = time.monotonic()
         try:
-            error_message = page.locator("div.toast-message").text_content(timeout=5000)
-            if "No Records Found" in error_message or "error" in error_message.lower():
-                log_message(f"⚠️ Error for Aadhaar {aadhaar}: {error_message}", "warning")
-                # Take screenshot of the error
-                timestamp = datetime.now().strftime("%H%M%S")
-                page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/no_record_{aadhaar}_{timestamp}.png")
-                return False  # Skip to next Aadhaar
-        except:
-            pass  # No error message found, continue
-        
-        # Select account number
-        if not select_account_number(page):
-            raise Exception("Account selection failed")
-        
-        # Click OK button (using enhanced method)
-        success = try_different_ok_clicks(page)
-        if not success:
-            # Take screenshot for debugging
-            timestamp = datetime.now().strftime("%H%M%S")
-            page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/ok_button_error_{aadhaar}_{timestamp}.png")
-            raise Exception("OK button click failed despite multiple attempts")
-
-        # Take a screenshot at this point to aid debugging
-        timestamp = datetime.now().strftime("%H%M%S")
-        page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/after_ok_click_{aadhaar}_{timestamp}.png")
-        time.sleep(2)  # Extra wait to ensure page loads properly
-
-        # Continue with the loan application process
-        steps = [
-            ("Selecting application type", 
-             lambda: page.locator("select[name='applicationType']").select_option("0")),
-            ("Clicking page content", 
-             lambda: page.locator(".pageMainContent").click()),
-            ("UPDATE & CONTINUE (1st time)", 
-             lambda: page.get_by_role("button", name="UPDATE & CONTINUE").click()),
-            ("UPDATE & CONTINUE (2nd time)", 
-             lambda: page.get_by_role("button", name="UPDATE & CONTINUE").click()),
-            ("Completing financial details (step 1)", 
-             lambda: page.get_by_role("tabpanel", name="Financial Details").get_by_role("img").click()),
-            ("Completing financial details (step 2)", 
-             lambda: page.get_by_role("tabpanel", name="Financial Details").locator("i").nth(1).click()),
-            ("Selecting financial option", 
-             lambda: page.get_by_label("Financial Details").get_by_text("1", exact=True).click()),
-            ("SAVE & CONTINUE (1st time)", 
-             lambda: page.get_by_role("button", name="SAVE & CONTINUE").click()),
-            ("SAVE & CONTINUE (2nd time)", 
-             lambda: page.get_by_role("button", name="SAVE & CONTINUE").click()),
-            ("Clicking Preview", 
-             lambda: page.get_by_role("button", name="Preview").click()),
-            ("Clicking SUBMIT", 
-             lambda: page.get_by_role("button", name="SUBMIT").click()),
-            ("Clicking CONFIRM", 
-             lambda: page.get_by_role("button", name="CONFIRM").click())
-        ]
-
-        for desc, action in steps:
-            success, _ = slow_action(desc, action)
-            if not success:
-                raise Exception(f"Process failed at: {desc}")
-            
+            with step_timer.span(f"loan_page_{name}"):
+                LOAN_PAGE_PATHS[name](page, step)
+        except Exception as e:
+            loan_page_path_tried(name, None, e)
+            error = e
+            continue
+        # Starting on the dashboard skips its page load, so that time says nothing about the full path
+        loan_page_path_tried(name, None if on_dashboard else time.monotonic() - started)
+        return
+    raise error
+
+def is_fetch_record_response(response):
+    return (FETCH_RECORD_RESPONSE.lower() in response.url.lower()
+            and response.request.resource_type in ('xhr', 'fetch'))
+
+def fetch_response_timeout(step):
+    """ms to wait for the fetch record response, or None once it went unread 3 records in a row"""
+    if processing_state['fetch_response_misses'] >= 3:
+        return None
+    return step['timeout'] or get_pacing_profile()['settle_timeout']
+
+def read_fetch_response(status, body):
+    """Classify a fetch record response and keep the result for the record's next steps"""
+    result = fetch_results.classify(status, fetch_results.parse_body(body)) if status is not None else None
+    with state_lock:
+        if result is None or result['outcome'] == 'unknown':
+            processing_state['fetch_response_misses'] += 1
+            given_up = processing_state['fetch_response_misses'] == 3
+        else:
+            processing_state['fetch_response_misses'] = 0
+            given_up = False
+    if given_up:
+        log_message(f"⚠️ No readable fetch record response matching '{FETCH_RECORD_RESPONSE}', checking the page "
+                    f"instead for the rest of the batch", "warning")
+    if result and result['outcome'] != 'unknown':
+        record_context.fetch_result = result
+        print(f"DEBUG: Fetch record response: {result['outcome']} {result['accounts'] or result['message']}")  # Debug
+
+def action_fetch_record(page, step, aadhaar):
+    """Click FETCH RECORD and read whether the Aadhaar has a record, and its accounts, from the portal's response"""
+    record_context.fetch_result = None
+    target = flow.resolve_target(page, step['target'])
+    timeout = fetch_response_timeout(step)
+    if timeout is None:
+        target.click(timeout=step['timeout'])
+        return
+    clicked = False
+    try:
+        with page.expect_response(is_fetch_record_response, timeout=timeout) as response_info:
+            target.click(timeout=step['timeout'])
+            clicked = True
+        response = response_info.value
+        status, body = response.status, response.text()
+    except Exception:
+        if not clicked:
+            raise
+        status, body = None, None  # Left to the page checks of the next steps
+    read_fetch_response(status, body)
+
+def fetched_message():
+    """(True, error message or None) when the fetch record response decided the record, else (False, None)"""
+    fetch_result = getattr(record_context, 'fetch_result', None)
+    if not fetch_result:
+        return False, None
+    return True, fetch_result['message'] if fetch_result['outcome'] != 'accounts' else None
+
+def record_error_shown(aadhaar, message):
+    """Note No Records Found or another error on the record; returns the name of its screenshot, or None
+    when the message is not an error"""
+    if not message or not ("No Records Found" in message or "error" in message.lower()):
+        return None
+    log_message(f"⚠️ Error for Aadhaar {aadhaar}: {message}", "warning")
+    record_context.error = message
+    return f"no_record_{aadhaar}_{datetime.now().strftime('%H%M%S')}"
+
+def action_check_toast(page, step, aadhaar):
+    """Stop the record when the fetch record response or a toast says No Records Found or shows another error"""
+    fetched, message = fetched_message()
+    if not fetched:
+        try:
+            message = flow.resolve_target(page, step['target']).text_content(timeout=step['timeout'])
+        except Exception:
+            return True  # No error message found, continue
+    screenshot = record_error_shown(aadhaar, message)
+    if screenshot:
+        take_screenshot(page, screenshot)
+        return False
+    return True
+
+def action_select_account(page, step, aadhaar):
+    if not select_account_number(page):
+        raise Exception("Account selection failed")
+
+def action_ok_click(page, step, aadhaar):
+    if not try_different_ok_clicks(page, step['strategy_step']):
+        raise Exception("OK button click failed despite multiple attempts")
+
+STEP_ACTIONS = {
+    'open_loan_page': action_open_loan_page,
+    'fetch_record': action_fetch_record,
+    'click': action_click,
+    'select': action_select,
+    'type': action_type,
+    'check_toast': action_check_toast,
+    'select_account': action_select_account,
+    'ok_click': action_ok_click
+}
+
+def step_condition(page, step):
+    """The page condition a step waits for after its action"""
+    if step['wait_for'] == 'network_idle':
+        return until_network_idle(page)
+    if step['wait_for'] == 'visible':
+        return until_visible(flow.resolve_target(page, step['wait_target']))
+    if step['wait_for'] == 'url_change':
+        return until_url_changes(page)
+    return None
+
+def run_step(page, step, aadhaar):
+    """Run one flow step with its retry policy; returns (success, result, attempts)"""
+    action = STEP_ACTIONS[step['action']]
+    attempts = step['retries'] + 1
+    for attempt in range(1, attempts + 1):
+        success, result = slow_action(step['name'], lambda: action(page, step, aadhaar), *step['delay'],
+                                      wait_for=step_condition(page, step), timeout=step['timeout'])
+        if success:
+            return True, result, attempt
+        if attempt < attempts:
+            log_message(f"🔁 Retrying {step['name']} ({attempt}/{step['retries']})", "warning")
             handle_popups(page)
-            time.sleep(1)
-        
-        # Final OK click with enhanced method
-        log_message("Attempting final OK click...", "info")
-        success = try_different_ok_clicks(page)
-        if not success:
-            # Try a different approach as last resort
-            log_message("Trying alternative click methods for final OK...", "info")
-            try:
-                # JavaScript click as last resort
-                page.evaluate("() => { document.querySelector('button:has-text(\"OK\")').click(); }")
-                log_message("✅ JavaScript click worked for final OK!", "success")
-                success = True
-            except:
-                # Take screenshot for debugging
-                timestamp = datetime.now().strftime("%H%M%S_%f")
-                page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/final_ok_error_{aadhaar}_{timestamp}.png")
-                log_message("❌ All methods to click final OK failed", "error")
-        
+            pace(step['retry_delay'])
+    return False, None, attempts
+
+def log_step_timings(aadhaar, timings):
+    if not timings:
+        return
+    total = sum(timing['seconds'] for timing in timings)
+    slowest = max(timings, key=lambda timing: timing['seconds'])
+    log_message(f"⏱️ {aadhaar}: {len(timings)} steps in {total:.1f}s, slowest '{slowest['step']}' "
+                f"{slowest['seconds']:.1f}s", "info")
+
+# Per-record bookkeeping of process_single_application, shared by both engines
+def plan_record(aadhaar):
+    """Split the flow around the record's last confirmed checkpoint, see flow.resume_plan; returns
+    {'replay', 'skipped', 'rest', 'last_step', 'resume_target', 'submitted'}"""
+    record_context.step_timings = []
+    processing_state['current_aadhaar'] = aadhaar
+    job_id = getattr(record_context, 'job_id', None)
+    last_step = job_store.get_last_step(app.config['JOB_DB'], job_id, record_context.position) if job_id else None
+    steps = processing_state['flow_steps']
+    replay, skipped, rest = flow.resume_plan(steps, last_step)
+    return {'replay': replay, 'skipped': skipped, 'rest': rest, 'last_step': last_step,
+            'resume_target': flow.resume_target(steps, last_step) if skipped else None,
+            'submitted': flow.submitted(steps, last_step)}
+
+def already_submitted(aadhaar, plan):
+    """True when the record got past the step that submits it, so replaying the flow would submit it again"""
+    if plan['submitted']:
+        log_message(f"✅ {aadhaar} was already submitted at confirmed step '{plan['last_step']}', "
+                    f"counting it as done", "success")
+    return plan['submitted']
+
+def steps_after_replay(aadhaar, plan, at_checkpoint):
+    """Steps left once the replay brought the browser back to the record: those after the checkpoint when the
+    page is at it, otherwise the skipped ones as well, as for a record that was never started"""
+    if not plan['skipped']:
+        return plan['rest']
+    if at_checkpoint:
+        log_message(f"↪️ Resuming {aadhaar} after confirmed step '{plan['last_step']}'", "info")
+        return plan['rest']
+    log_message(f"↩️ {aadhaar} is no longer at its confirmed step '{plan['last_step']}', starting it over", "warning")
+    return plan['skipped'] + plan['rest']
+
+def step_finished(step, elapsed, success, result, attempts):
+    """Time a step and decide what follows it: 'next' when it went through, 'skip' when an optional step failed,
+    'stop' when it ended the record without an error; a failed required step raises"""
+    record_context.step_timings.append({'step': step['name'], 'seconds': round(elapsed, 2), 'attempts': attempts,
+                                        'success': success})
+    step_latency.observe(elapsed, step=step['name'])
+    print(f"DEBUG: Step '{step['name']}' took {elapsed:.2f}s in {attempts} attempt(s)")  # Debug
+    if not success:
+        if step['required']:
+            raise Exception(f"Process failed at: {step['name']} - {getattr(record_context, 'last_error', '')}")
+        log_message(f"⚠️ Optional step '{step['name']}' failed, continuing", "warning")
+        return 'skip'
+    return 'stop' if result is False else 'next'
+
+def step_confirmed(step, aadhaar):
+    """Store a checkpoint step in the job store; returns the name of the step's debug screenshot, if it takes one"""
+    job_id = getattr(record_context, 'job_id', None)
+    if step['checkpoint'] and job_id:
+        job_store.set_last_step(app.config['JOB_DB'], job_id, record_context.position, step['name'])
+    if step.get('screenshot'):
+        return f"{step['screenshot']}_{aadhaar}_{datetime.now().strftime('%H%M%S')}"
+    return None
+
+def record_crashed(aadhaar, error):
+    """Note why the record failed; returns the name of its full page screenshot"""
+    record_context.error = str(error)
+    log_message(f"❌ Processing failed for {aadhaar}: {error}", "error")
+    return f"error_{aadhaar}_{datetime.now().strftime('%H%M%S_%f')}"
+
+def at_checkpoint(page, target):
+    """Whether the page shows the resume target of the record's checkpoint; a checkpoint without one is trusted"""
+    if not target:
+        return True
+    try:
+        with step_timer.measure('portal'):
+            flow.resolve_target(page, target).first.wait_for(state="visible",
+                                                             timeout=get_pacing_profile()['settle_timeout'])
+        return True
+    except Exception:
+        return False
+
+def run_steps(page, steps, aadhaar):
+    """Run flow steps in order; False when one of them ended the record"""
+    for step in steps:
+        if step['skip_if_set'] and step_already_set(page, step, aadhaar):
+            log_message(f"⏭️ {step['name']}: already set, skipped", "info")
+            continue
+        started = time.monotonic()
+        success, result, attempts = run_step(page, step, aadhaar)
+        outcome = step_finished(step, time.monotonic() - started, success, result, attempts)
+        if outcome == 'stop':
+            return False  # Skip to next Aadhaar
+        if outcome == 'skip':
+            continue
+
+        screenshot = step_confirmed(step, aadhaar)
+        if screenshot:
+            take_screenshot(page, screenshot, kind='debug')
+        if step['popups']:
+            handle_popups(page)
+        pace(step['pause'])
+    return True
+
+def process_single_application(page, aadhaar):
+    """Process a single Aadhaar application by running the loan flow, resuming after its last checkpoint
+    when the page is still at it"""
+    try:
+        plan = plan_record(aadhaar)
+        if already_submitted(aadhaar, plan):
+            return True
+        if not run_steps(page, plan['replay'], aadhaar):
+            return False
+        resumed = bool(plan['skipped']) and at_checkpoint(page, plan['resume_target'])
+        if not run_steps(page, steps_after_replay(aadhaar, plan, resumed), aadhaar):
+            return False
+
         log_message(f"🎉 Application completed for Aadhaar: {aadhaar}", "success")
         return True
 
     except Exception as e:
-        log_message(f"❌ Processing failed for {aadhaar}: {e}", "error")
-        timestamp = datetime.now().strftime("%H%M%S_%f")
-        screenshot_path = os.path.join(app.config['SCREENSHOT_FOLDER'], f"error_{aadhaar}_{timestamp}.png")
-        page.screenshot(path=screenshot_path, full_page=True)
-        log_message(f"📸 Screenshot saved to: {screenshot_path}", "info")
+        screenshot_path = take_screenshot(page, record_crashed(aadhaar, e), full_page=True)
+        if screenshot_path:
+            log_message(f"📸 Screenshot saved to: {screenshot_path}", "info")
         return False
+    finally:
+        log_step_timings(aadhaar, getattr(record_context, 'step_timings', []))
 
 # Routes
 @app.route('/')
@@ -353,16 +977,40 @@ def do_login():
     for cred in CREDENTIALS:
         if username == cred['username'] and password == cred['password']:
             session['logged_in'] = True
+            session['username'] = username  # Store username in session
+            session['mobile'] = cred.get('mobile', '9876543210')  # Store mobile if available
             print(f"LOGIN: Successful login for {username}. Session: {session}")  # Debug
-            return redirect(url_for('upload'))
+            return redirect(url_for('home'))  # Changed to redirect to home
     flash('Invalid username or password', 'error')
-    print(f"LOGIN ERROR: Invalid credentials for {username}")  # Debug
     return redirect(url_for('login'))
 
+
+# Add these new routes
+@app.route('/download')
+def download_file():
+    file_path = request.args.get('file')
+    if not file_path or not os.path.exists(file_path):
+        abort(404)
+    return send_file(file_path, as_attachment=True)
+
+
+
+# # Update logs endpoint to include output file
+# @app.route('/logs')
+# def get_logs():
+#     return jsonify({
+#         'logs': processing_state['logs'],
+#         'progress': processing_state['progress'],
+#         'is_processing': processing_state['is_processing'],
+#         'successful_count': processing_state['successful_count'],
+#         'total_records': processing_state['total_records'],
+#         'output_file': processing_state.get('output_file', ''),
+#         'current_aadhaar': processing_state['current_aadhaar']
+#     })
 @app.route('/logout')
 def logout():
     session.pop('logged_in', None)
-    session.pop('temp_records_file', None)
+    session.pop('job_id', None)
     session.pop('file_path', None)
     print(f"LOGOUT: Session cleared. Session: {session}")  # Debug
     return redirect(url_for('login'))
@@ -372,11 +1020,10 @@ def home():
     if 'logged_in' not in session:
         return redirect(url_for('login'))
     
-    # You'll need to get these from your session or database
-    username = "User"  # Replace with actual username
-    mobile = "9876543210"  # Replace with actual mobile number
+    username = session.get('username', 'User')
+    mobile = session.get('mobile', '9876543210')
     
-    return render_template('home.html', username=username, mobile=mobile)    
+    return render_template('home.html', username=username, mobile=mobile)
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload():
@@ -384,12 +1031,13 @@ def upload():
         print(f"UPLOAD: Redirecting to login - not logged in. Session: {session}")  # Debug
         return redirect(url_for('login'))
     
-     # Get user details
+    # Get user details
     username = "User"  # Replace with actual username
     mobile = "9876543210"  # Replace with actual mobile number
     
-    # Rest of your existing upload function...
-  
+    file_uploaded = False
+    preview = ""
+    total_records = 0
 
     if request.method == 'POST':
         print("UPLOAD: Received POST request")  # Debug
@@ -402,6 +1050,7 @@ def upload():
             flash('No file selected', 'error')
             print("UPLOAD ERROR: Empty filename")  # Debug
             return redirect(url_for('upload'))
+        
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -409,852 +1058,1176 @@ def upload():
             print(f"UPLOAD: File saved to {file_path}")  # Debug
             
             try:
-                print("UPLOAD: Reading Excel file (first 3 rows for validation)")  # Debug
-                df = pd.read_excel(file_path, sheet_name=SHEET_NAME, nrows=3)
-                print(f"UPLOAD: Excel columns: {list(df.columns)}")  # Debug
-                if 'Aadhar No' not in df.columns:
-                    flash("Excel must contain 'Aadhar No' column", 'error')
-                    print("UPLOAD ERROR: 'Aadhar No' column missing")  # Debug
-                    return redirect(url_for('upload'))
-                
-                # Read full file for processing
-                print("UPLOAD: Reading full Excel file")  # Debug
-                df = pd.read_excel(file_path, sheet_name=SHEET_NAME)
-                print(f"UPLOAD: Raw 'Aadhar No' values (first 5): {df['Aadhar No'].head().tolist()}")  # Debug
-                
-                # Clean Aadhaar numbers
-                def clean_aadhar(x):
-                    if pd.isna(x):
-                        return ''
-                    x = str(x)
-                    x = x.split('.')[0]
-                    x = re.sub(r'[^0-9]', '', x)
-                    if len(x) > 12:
-                        x = x[:12]
-                    elif len(x) < 12:
-                        x = x.zfill(12)
-                    return x
-                
-                df['Aadhar No'] = df['Aadhar No'].apply(clean_aadhar)
-                print(f"UPLOAD: Processed 'Aadhar No' values (first 5): {df['Aadhar No'].head().tolist()}")  # Debug
-                
-                print(f"UPLOAD: Total rows after cleaning: {len(df)}")  # Debug
-                df = df[df['Aadhar No'].notna() & (df['Aadhar No'] != '')]
-                print(f"UPLOAD: Rows after removing NA/empty: {len(df)}")  # Debug
+                # Single pass over the sheet: header check, cleaning and validation happen while
+                # rows are read, and valid numbers go straight into the job store
+                print("UPLOAD: Streaming Excel rows into the job store")  # Debug
+                stats = {}
+                already_submitted = job_store.get_submitted_aadhaars(app.config['JOB_DB'], FINANCIAL_YEAR)
+                chunks = ingest.dedupe_chunks(ingest.iter_aadhaar_chunks(file_path, SHEET_NAME, stats),
+                                              already_submitted, stats)
+                job_id = job_store.create_job(app.config['JOB_DB'], file_path, FINANCIAL_YEAR, chunks)
+                print(f"UPLOAD: {stats['rows']} rows read, {stats['valid']} valid, "
+                      f"{stats['empty']} empty, {stats['invalid_count']} invalid")  # Debug
+                print(f"UPLOAD: {stats['new']} new, {stats['duplicates']} duplicates in sheet, "
+                      f"{stats['already_submitted']} already submitted for {FINANCIAL_YEAR}")  # Debug
+                for row_number, value, reason in stats['invalid'][:5]:
+                    print(f"  Row {row_number}: {value} - {reason}")  # Debug
                 
-                # Validate Aadhaar numbers
-                invalid_aadhaars = []
-                for idx, aadhaar in df['Aadhar No'].items():
-                    if not re.match(r'^\d{12}$', aadhaar):
-                        invalid_aadhaars.append((idx, aadhaar, f"Invalid format: {aadhaar}"))
+                # Rejected rows never reach the browser; operators get a per-row reason report instead
+                rejection_report = ''
+                if stats['invalid']:
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    rejection_report = ingest.write_rejection_report(
+                        stats, os.path.join(app.config['UPLOAD_FOLDER'], f"rejected_rows_{timestamp}.xlsx"))
+                    print(f"UPLOAD: Rejection report saved to {rejection_report}")  # Debug
                 
-                if invalid_aadhaars:
-                    print("UPLOAD: Invalid Aadhaar numbers found:")
-                    for idx, aadhaar, reason in invalid_aadhaars[:5]:
-                        print(f"  Row {idx}: {aadhaar} - {reason}")  # Debug
-                    if len(invalid_aadhaars) == len(df):
-                        flash(f"No valid Aadhaar numbers found. Issues: {invalid_aadhaars[0][2]} (and {len(invalid_aadhaars)-1} more)", 'error')
-                        print("UPLOAD ERROR: No valid Aadhaar numbers")  # Debug
-                        return redirect(url_for('upload'))
-                
-                df = df[df['Aadhar No'].str.match(r'^\d{12}$')]
-                print(f"UPLOAD: Valid Aadhaar rows: {len(df)}")  # Debug
-                
-                if len(df) == 0:
-                    flash("No valid Aadhaar numbers found after validation", 'error')
-                    print("UPLOAD ERROR: No valid Aadhaar numbers after validation")  # Debug
+                if job_id is None and stats['valid']:
+                    flash(f"All {stats['valid']} Aadhaar numbers are duplicates or were already submitted "
+                          f"for {FINANCIAL_YEAR}", 'error')
                     return redirect(url_for('upload'))
+                if job_id is None:
+                    flash(f"No valid Aadhaar numbers found after validation "
+                          f"({stats['invalid_count']} rejected, first: {stats['invalid'][0][2] if stats['invalid'] else 'none'})", 'error')
+                    return redirect(url_for('upload'))
+                print(f"UPLOAD: Created job {job_id} with {stats['new']} records")  # Debug
                 
-                # Save records to temporary JSON file
-                records = df.to_dict('records')
-                temp_filename = f"records_{uuid.uuid4().hex}.json"
-                temp_filepath = os.path.join(app.config['TEMP_FOLDER'], temp_filename)
-                with open(temp_filepath, 'w') as f:
-                    json.dump(records, f)
-                print(f"UPLOAD: Records saved to temporary file: {temp_filepath}")  # Debug
-                
-                # Store file paths in session
-                session['temp_records_file'] = temp_filepath
+                # Store job and file path in session
+                session['job_id'] = job_id
                 session['file_path'] = file_path
-                print(f"UPLOAD: Session updated with temp_records_file: {temp_filepath}, file_path: {file_path}. Session: {session}")  # Debug
                 
-                preview = "\n".join(str(r['Aadhar No']) for r in records)
-                log_message(f"Loaded {len(records)} valid Aadhaar numbers", "success")
-                print(f"UPLOAD: Preview generated, {len(records)} records stored in temp file")  # Debug
-                return render_template('upload.html', preview=preview, file_uploaded=True, total_records=len(records))
+                preview = "\n".join(stats['preview'])  # Show first 10 only
+                file_uploaded = True
+                total_records = stats['new']
+                
+                return render_upload(username, mobile, preview, file_uploaded, total_records,
+                                     rejected_count=stats['invalid_count'],
+                                     rejected_reasons=Counter(reason for _, _, reason in stats['invalid']),
+                                     rejection_report=rejection_report,
+                                     duplicate_count=stats['duplicates'],
+                                     already_submitted_count=stats['already_submitted'],
+                                     financial_year=FINANCIAL_YEAR)
+                
+            except ValueError as e:
+                flash(str(e), 'error')
+                print(f"UPLOAD ERROR: {str(e)}")  # Debug
+                return redirect(url_for('upload'))
             except Exception as e:
                 flash(f"Failed to load Excel: {str(e)}", 'error')
-                log_message(f"Failed to load Excel: {str(e)}", "error")
-                print(f"UPLOAD ERROR: Exception - {str(e)}")  # Debug
                 return redirect(url_for('upload'))
     
-    print(f"UPLOAD: Rendering upload page (GET request). Session: {session}")  # Debug
-    from flask import Flask, request, render_template, redirect, url_for, jsonify, flash, session
-from werkzeug.utils import secure_filename
-from datetime import datetime
-from playwright.sync_api import sync_playwright, TimeoutError
-import time
-import pandas as pd
-import os
-import threading
-import logging
-import re
-import json
-import uuid
-import random
+    return render_upload(username, mobile, preview, file_uploaded, total_records)
 
-app = Flask(__name__)
-app.secret_key = "supersecretkey"  # Required for session and flash messages
-app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'Uploads')
-app.config['SCREENSHOT_FOLDER'] = os.path.join(os.getcwd(), 'screenshots')
-app.config['TEMP_FOLDER'] = os.path.join(os.getcwd(), 'temp')  # New folder for temp files
-app.config['LOG_FILE'] = os.path.join(os.getcwd(), 'process.log')
+def render_upload(username, mobile, preview, file_uploaded, total_records, **upload_report):
+    return render_template('upload.html', 
+                         username=username, 
+                         mobile=mobile,
+                         preview=preview,
+                         file_uploaded=file_uploaded,
+                         total_records=total_records,
+                         max_workers=max_workers(),
+                         pacing_profiles=list(PACING_PROFILES),
+                         default_pacing_profile=DEFAULT_PACING_PROFILE,
+                         unfinished_jobs=job_store.get_unfinished_jobs(app.config['JOB_DB']),
+                         is_processing=processing_state['is_processing'],
+                         **upload_report)
 
-# Configuration
-SHEET_NAME = "Sheet1"
-FINANCIAL_YEAR = "2024-2025"
 
-# Create folders
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['SCREENSHOT_FOLDER'], exist_ok=True)
-os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
+@app.route('/start_processing', methods=['POST'])
+def start_processing():
+    print(f"DEBUG: Start processing called. Session: {session}")  # Debug
+    # A job id in the form resumes an earlier batch, otherwise the last upload is processed
+    job_id = request.form.get('job_id') or session.get('job_id')
+    if 'logged_in' not in session or not job_id:
+        flash('Please upload a valid file first', 'error')
+        print(f"START_PROCESSING ERROR: No job or not logged in. Session: {session}")  # Debug
+        return redirect(url_for('upload'))
+    
+    if processing_state['is_processing']:
+        flash('Processing already in progress', 'error')
+        print("START_PROCESSING ERROR: Processing already in progress")  # Debug
+        return redirect(url_for('upload'))
+    
+    job = job_store.get_job(app.config['JOB_DB'], job_id)
+    if job is None:
+        flash('Uploaded batch not found, please upload the file again', 'error')
+        print(f"START_PROCESSING ERROR: Unknown job {job_id}")  # Debug
+        return redirect(url_for('upload'))
+    pending = job_store.get_pending_records(app.config['JOB_DB'], job_id)
+    if not pending:
+        flash('All records of this batch have already been processed', 'error')
+        return redirect(url_for('upload'))
+    print(f"DEBUG: Job {job_id} has {len(pending)} of {job['total_records']} records left")  # Debug
+    
+    processing_state['is_processing'] = True
+    processing_state['progress'] = (job['finished_count'] / job['total_records']) * 100
+    processing_state['logs'].clear()
+    processing_state['successful_count'] = job['success_count']
+    processing_state['total_records'] = job['total_records']
+    processing_state['current_aadhaar'] = ''
+    processing_state['processed_count'] = job['finished_count']
+    processing_state['workers'] = {}
+    processing_state['run_metadata'] = {}
+    processing_state['job_id'] = job_id
+    processing_state['output_file'] = ''
 
-# Load credentials from JSON file
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CREDENTIALS_FILE = os.path.join(BASE_DIR, 'credentials.json')
-print(f"DEBUG: Looking for credentials file at: {CREDENTIALS_FILE}")  # Debug
-try:
-    with open(CREDENTIALS_FILE, 'r') as f:
-        CREDENTIALS = json.load(f)
-    print(f"DEBUG: Loaded credentials: {[cred['username'] for cred in CREDENTIALS]}")  # Debug
-except FileNotFoundError:
-    print(f"ERROR: Credentials file not found at {CREDENTIALS_FILE}")
-    CREDENTIALS = []
-except json.JSONDecodeError:
-    print(f"ERROR: Invalid JSON in {CREDENTIALS_FILE}")
-    CREDENTIALS = []
+    try:
+        workers = int(request.form.get('workers', 1))
+    except ValueError:
+        workers = 1
+    pacing_profile = request.form.get('pacing', DEFAULT_PACING_PROFILE)
+    if pacing_profile not in PACING_PROFILES:
+        pacing_profile = DEFAULT_PACING_PROFILE
+    
+    print(f"START_PROCESSING: Starting thread with {len(pending)} records, {workers} workers, '{pacing_profile}' pacing")  # Debug
+    threading.Thread(target=run_processing, args=(job_id, pending, workers, pacing_profile), daemon=True).start()
+    return redirect(url_for('upload'))
 
-# Global variables for processing state
-processing_state = {
-    'is_processing': False,
-    'progress': 0,
-    'logs': [],
-    'successful_count': 0,
-    'total_records': 0,
-    'current_aadhaar': ''
-}
+def progress_snapshot(logs):
+    """Progress payload shared by /logs and /events"""
+    return {
+        'logs': logs,
+        'cursor': processing_state['log_cursor'],
+        'progress': processing_state['progress'],
+        'is_processing': processing_state['is_processing'],
+        'successful_count': processing_state['successful_count'],
+        'total_records': processing_state['total_records'],
+        'current_aadhaar': processing_state['current_aadhaar'],
+        'workers': processing_state['workers'],
+        'run_metadata': processing_state['run_metadata'],
+        'job_id': processing_state['job_id'],
+        'output_file': processing_state.get('output_file', ''),
+        'captchas': captcha_relay.pending(),
+        'accounts': processing_state['account_pool'].stats() if processing_state['account_pool'] else {}
+    }
 
-# Setup logging
-logging.basicConfig(filename=app.config['LOG_FILE'], level=logging.INFO, format='%(asctime)s: %(message)s')
+@app.route('/logs')
+def get_logs():
+    # Clients pass back the returned cursor as ?since= to receive only new entries
+    since = request.args.get('since', 0, type=int)
+    logs = get_logs_since(since)
+    print(f"DEBUG: Fetching logs since {since}: {len(logs)} new entries")  # Debug
+    return jsonify(progress_snapshot(logs))
+
+@app.route('/events')
+def events():
+    """Server-Sent Events stream pushing new log lines and progress as they change"""
+    # EventSource sends Last-Event-ID when it reconnects, so no entries are lost or repeated
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('since', 0, type=int)
+
+    def stream(cursor):
+        last_sent = None
+        while True:
+            # Check for changes under the condition lock so a notify between the check and the wait is not lost
+            with state_changed:
+                logs = get_logs_since(cursor)
+                snapshot = progress_snapshot([])
+                state = json.dumps(snapshot, sort_keys=True)
+                changed = bool(logs) or state != last_sent
+                timed_out = not changed and not state_changed.wait(timeout=SSE_HEARTBEAT)
+            if timed_out:
+                yield ": keep-alive\n\n"
+            elif changed:
+                last_sent = state
+                if logs:
+                    cursor = logs[-1]['id']
+                snapshot['logs'] = logs
+                snapshot['cursor'] = cursor
+                yield f"id: {cursor}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return Response(stream(cursor), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/screenshots/<job_id>')
+def list_screenshots(job_id):
+    """Screenshots kept on disk for a job, optionally for one record (?position=N)"""
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    position = request.args.get('position', type=int)
+    return jsonify({
+        'screenshots': job_store.get_screenshots(app.config['JOB_DB'], job_id, position),
+        'stats': screenshot_writer.stats()
+    })
 
-def log_message(message, tag="info"):
-    formatted_message = f"{message}"
-    processing_state['logs'].append({'message': formatted_message, 'tag': tag})
-    logging.info(f"[{tag}] {message}")
-    print(f"LOG: [{tag}] {message}")  # Debug
+@app.route('/captcha/<challenge_id>')
+def captcha_image(challenge_id):
+    """Image of a CAPTCHA waiting for an operator, 404 once its login has finished"""
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    image = captcha_relay.image(challenge_id)
+    if image is None:
+        abort(404)
+    return Response(image, mimetype='image/png', headers={'Cache-Control': 'no-store'})
 
-# Automation Helper Functions
-def slow_typing(element, text, delay_range=(0.1, 0.3)):
-    """Type text with human-like delay between characters"""
-    for char in text:
-        element.type(char)
-        time.sleep(random.uniform(*delay_range))
+@app.route('/captcha/<challenge_id>', methods=['POST'])
+def answer_captcha(challenge_id):
+    """Relay an operator's CAPTCHA answer to the waiting login"""
+    if 'logged_in' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    answer = request.form.get('answer', '').strip()
+    if not answer:
+        return jsonify({'error': 'Please enter the CAPTCHA'}), 400
+    if not captcha_relay.answer(challenge_id, answer):
+        return jsonify({'error': 'This CAPTCHA is no longer waiting for an answer'}), 404
+    print(f"DEBUG: CAPTCHA answer relayed for challenge {challenge_id}")  # Debug
+    return jsonify({'status': 'submitted'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Batch throughput, latency and resource metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/timing/<job_id>')
+def timing_report(job_id):
+    """Per-step timing report of a batch as an HTML page, or JSON with ?format=json"""
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    json_path, html_path = timing_report_paths(job_id)
+    path = json_path if request.args.get('format') == 'json' else html_path
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path)
 
-def slow_action(description, action_func, delay=2.5, max_delay=4.0):
-    """Execute an action with visual feedback and random delay"""
-    log_message(f"⏳ {description}...", "info")
-    time.sleep(random.uniform(delay, max_delay))
-    try:
-        result = action_func()
-        log_message(f"✅ {description} completed", "success")
-        time.sleep(1)
-        return True, result
-    except Exception as e:
-        log_message(f"❌ Failed: {description} - {str(e)}", "error")
-        return False, None
+def max_workers():
+    return ASYNC_MAX_WORKERS if app.config['ENGINE'] == 'async' else MAX_WORKERS
 
-def handle_popups(page):
-    """Handle any popup dialogs"""
-    try:
-        # Try multiple ways to find OK buttons
-        selectors = [
-            "button:has-text('OK')",
-            "button.btn-primary:has-text('OK')",
-            "button.modal-btn:has-text('OK')",
-            ".modal-footer button:has-text('OK')",
-            "[role='button']:has-text('OK')"
-        ]
-        
-        for selector in selectors:
-            try:
-                ok_button = page.locator(selector).first
-                if ok_button.is_visible(timeout=1000):
-                    ok_button.click(timeout=3000)
-                    log_message("⚠️ Popup handled with selector: " + selector, "info")
-                    time.sleep(1)
-                    return True
-            except:
-                continue
-        
-        # Also try by role as fallback
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls'}
+
+def launch_options():
+    """Chromium launch arguments of the batch's launch profile; every call counts as a launch"""
+    browser_launches.inc()
+    profile = LAUNCH_PROFILES[processing_state['launch_profile']]
+    return {'headless': profile['headless'], 'slow_mo': 0, 'args': profile['args']}
+
+CONTEXT_OPTIONS = {'viewport': {"width": 1366, "height": 768}, 'ignore_https_errors': True}
+
+def launch_browser(p):
+    """Launch the Chromium instance used by the automation with the batch's launch profile"""
+    return p.chromium.launch(**launch_options())
+
+def new_browser_context(browser, storage_state=None):
+    """Create a browser context, optionally reusing a logged-in storage state"""
+    context = browser.new_context(storage_state=storage_state, **CONTEXT_OPTIONS)
+    if app.config['BLOCK_RESOURCES']:
+        context.route("**/*", resource_blocker(block_resources, app.config['BLOCK_IMAGES']))
+    return context
+
+# Failure classes: permanent ones are final, transient ones are retried with backoff
+PERMANENT_FAILURES = {'no_record', 'invalid'}
+TRANSIENT_FAILURES = {'timeout', 'navigation', 'popup', 'session', 'portal_error'}
+
+def failure_reason(error):
+    """Short, low-cardinality label for why a record failed"""
+    if not error:
+        return 'unknown'
+    text = error.lower()
+    if 'no records found' in text:
+        return 'no_record'
+    if 'invalid' in text:
+        return 'invalid'
+    if 'intercepts pointer events' in text or 'ok button click failed' in text:
+        return 'popup'  # A dialog was covering the element
+    # select_account_number swallows its dropdown timeout, leaving only "Account selection failed"
+    if 'timeout' in text or 'account selection failed' in text:
+        return 'timeout'
+    if 'net::' in text or 'navigation' in text or 'target closed' in text or 'has been closed' in text:
+        return 'navigation'
+    if 'session' in text or 'login' in text:
+        return 'session'
+    if 'error' in text and 'process failed at' not in text:
+        return 'portal_error'  # An error toast other than No Records Found
+    return 'other'
+
+def schedule_retry(job_id, position, aadhaar, attempts, worker_id):
+    """Defer a transiently failed record with backoff; returns False when the failure is final"""
+    reason = failure_reason(record_context.error)
+    if reason not in TRANSIENT_FAILURES or attempts >= MAX_ATTEMPTS:
+        return False
+    delay = processing_state['retry_queue'].push((position, aadhaar), attempts)
+    job_store.mark_record_retry(app.config['JOB_DB'], job_id, position, record_context.error,
+                                screenshot_path=record_context.screenshot_path)
+    records_retried.inc(reason=reason)
+    log_message(f"[W{worker_id}] 🔁 {aadhaar} failed ({reason}), retrying in {delay}s "
+                f"(attempt {attempts + 1}/{MAX_ATTEMPTS})", "warning")
+    return True
+
+def queued_record(worker, record_queue):
+    """Next (position, aadhaar, False) from the main queue, or None once only deferred retries are left"""
+    try:
+        position, aadhaar = record_queue.get_nowait()
+        return position, aadhaar, False
+    except queue.Empty:
+        worker['status'] = 'waiting for retry'
+        worker['current_aadhaar'] = ''
+        return None
+
+def next_record(worker, record_queue):
+    """Next (position, aadhaar, is_retry): the main queue first, then retries once their backoff has passed"""
+    record = queued_record(worker, record_queue)
+    if record:
+        return record
+    record = processing_state['retry_queue'].pop()
+    return (record[0], record[1], True) if record else None
+
+def account_label(account):
+    """1-based position of an account in credentials.json, used instead of its username in metrics"""
+    return str([cred['username'] for cred in CREDENTIALS].index(account['username']) + 1)
+
+def record_result(job_id, position, success, worker_id):
+    """Store the outcome of one record in the job store and update the shared counters"""
+    job_store.mark_record_finished(app.config['JOB_DB'], job_id, position, success,
+                                   screenshot_path=record_context.screenshot_path,
+                                   error=record_context.error)
+    account = processing_state['account_pool'].account_for(worker_id)
+    processing_state['account_pool'].record(account, success)
+    account_records.inc(account=account_label(account), result='success' if success else 'failure')
+    with state_lock:
+        worker = processing_state['workers'][worker_id]
+        worker['processed'] += 1
+        processing_state['processed_count'] += 1
+        if success:
+            worker['successful'] += 1
+            processing_state['successful_count'] += 1
+        processing_state['progress'] = (processing_state['processed_count'] / processing_state['total_records']) * 100
+    if success:
+        records_processed.inc(result='success')
+    else:
+        records_processed.inc(result='failure')
+        records_failed.inc(reason=failure_reason(record_context.error))
+        log_message(f"[W{worker_id}] Failure for record {position + 1} is final ({failure_reason(record_context.error)})",
+                    "info")
+    notify_state_change()
+
+def skip_if_submitted(worker_id, job_id, position, aadhaar):
+    """Skip a record that another batch may have submitted since the upload was checked; True if skipped"""
+    if not job_store.is_submitted(app.config['JOB_DB'], FINANCIAL_YEAR, aadhaar):
+        return False
+    log_message(f"[W{worker_id}] Skipping {aadhaar}: already submitted for {FINANCIAL_YEAR}", "warning")
+    job_store.mark_record_skipped(app.config['JOB_DB'], job_id, position,
+                                  f"Already submitted for {FINANCIAL_YEAR}")
+    with state_lock:
+        processing_state['processed_count'] += 1
+        processing_state['progress'] = (processing_state['processed_count'] / processing_state['total_records']) * 100
+    records_processed.inc(result='skipped')
+    return True
+
+def start_record(worker, worker_id, job_id, position, aadhaar, is_retry):
+    """Mark a record as started for the UI and record_context; the job store is marked by the caller, so the
+    async engine can do that on a thread without losing record_context"""
+    total = processing_state['total_records']
+    worker['status'] = 'processing'
+    worker['current_aadhaar'] = aadhaar
+    processing_state['current_aadhaar'] = aadhaar
+    record_context.reset()
+    record_context.job_id = job_id
+    record_context.position = position
+    record_context.aadhaar = aadhaar
+    record_context.screenshot_path = None
+    record_context.error = None
+    record_context.account = processing_state['account_pool'].account_for(worker_id)
+    log_message(f"[W{worker_id}] {'Retrying' if is_retry else 'Processing'} {aadhaar} ({position+1}/{total})", "info")
+    print(f"DEBUG: Worker {worker_id} processing Aadhaar {aadhaar} ({position+1}/{total})")  # Debug
+
+def finish_record(job_id, position, aadhaar, attempts, success, worker_id):
+    """Defer a transient failure for another attempt, otherwise store the record's final outcome"""
+    if success or not schedule_retry(job_id, position, aadhaar, attempts, worker_id):
+        record_result(job_id, position, success, worker_id)
+
+# Per-worker bookkeeping of process_queue, shared by both engines
+def browser_relaunched(supervisor, worker, restarts):
+    """Count the relaunches since the supervisor had `restarts` of them"""
+    browser_restarts.inc(supervisor.restarts - restarts)
+    worker['restarts'] = supervisor.restarts
+
+def record_processed(worker_id, aadhaar, success, started):
+    record_latency.observe(time.monotonic() - started)
+    if success:
+        log_message(f"[W{worker_id}] Success: {aadhaar}", "success")
+        print(f"DEBUG: Success for Aadhaar {aadhaar}")  # Debug
+    else:
+        log_message(f"[W{worker_id}] Failed: {aadhaar}", "error")
+        print(f"DEBUG: Failed for Aadhaar {aadhaar}")  # Debug
+
+def record_errored(worker_id, aadhaar, error):
+    record_context.error = str(error)
+    log_message(f"[W{worker_id}] Error: {aadhaar} - {str(error)}", "error")
+    print(f"DEBUG: Error for Aadhaar {aadhaar}: {str(error)}")  # Debug
+
+def record_was_healthy(success):
+    """Whether the record counts as healthy for the browser: it went through or failed for a permanent reason"""
+    return success or failure_reason(record_context.error) in PERMANENT_FAILURES
+
+def worker_stopped(worker_id, account):
+    worker = processing_state['workers'][worker_id]
+    if processing_state['account_pool'].is_down(account):
+        log_message(f"[W{worker_id}] Stopping, account {account['username']} is unavailable", "warning")
+        worker['status'] = 'account down'
+    else:
+        worker['status'] = 'done'
+    worker['current_aadhaar'] = ''
+
+def process_queue(supervisor, worker_id, job_id, record_queue):
+    """Pull records from the shared queue and process them on the supervisor's page, then take deferred retries
+    until none are left or the worker's account becomes unavailable"""
+    worker = processing_state['workers'][worker_id]
+    account = processing_state['account_pool'].account_for(worker_id)
+    while not processing_state['account_pool'].is_down(account):
+        record = next_record(worker, record_queue)
+        if record is None:
+            break
+        position, aadhaar, is_retry = record
+        if skip_if_submitted(worker_id, job_id, position, aadhaar):
+            if not is_retry:
+                record_queue.task_done()
+            continue
+        start_record(worker, worker_id, job_id, position, aadhaar, is_retry)
+        attempts = job_store.mark_record_started(app.config['JOB_DB'], job_id, position)
+
+        success = False
         try:
-            role_button = page.get_by_role("button", name="OK").first
-            if role_button.is_visible(timeout=1000):
-                role_button.click(timeout=3000)
-                log_message("⚠️ Popup handled with role selector", "info")
-                time.sleep(1)
-                return True
-        except:
-            pass
-            
+            # A crashed browser or page is replaced here instead of failing every remaining record
+            if not supervisor.is_alive():
+                restarts = supervisor.restarts
+                supervisor.relaunch("browser or page stopped responding")
+                browser_relaunched(supervisor, worker, restarts)
+            # The flow's first step brings the page to the loan form, whichever page it is on
+            page = supervisor.page
+            started = time.monotonic()
+            with step_timer.span('record'):
+                success = process_single_application(page, aadhaar)
+            record_processed(worker_id, aadhaar, success, started)
+            pace(2)
+        except Exception as e:
+            record_errored(worker_id, aadhaar, e)
+            try:
+                take_screenshot(supervisor.page, f"error_{aadhaar}")
+            except Exception:
+                pass
+        finally:
+            finish_record(job_id, position, aadhaar, attempts, success, worker_id)
+            if not is_retry:
+                record_queue.task_done()
+
+        try:
+            check_browser_health(supervisor, worker, record_was_healthy(success))
+        except Exception as e:
+            log_message(f"[W{worker_id}] Could not replace the browser: {str(e)}", "error")
+
+    worker_stopped(worker_id, account)
+
+def supervisor_options(worker_id):
+    return {'name': f"W{worker_id}", 'recycle_every': RECYCLE_EVERY, 'max_heap_mb': MAX_JS_HEAP_MB,
+            'max_error_rate': MAX_ERROR_RATE}
+
+def new_supervisor(p, worker_id, account):
+    """Browser supervisor for one worker, restoring the account's saved portal session when it replaces a context"""
+    return BrowserSupervisor(p, launch_browser, new_browser_context, lambda: load_session_state(account), log_message,
+                             **supervisor_options(worker_id))
+
+def heap_checked(supervisor, worker):
+    worker['heap_mb'] = round(supervisor.heap_mb) if supervisor.heap_mb is not None else None
+
+def context_recycled(supervisor, worker, restarts):
+    context_recycles.inc()
+    browser_restarts.inc(supervisor.restarts - restarts)  # Recycling falls back to a relaunch if it has to
+    worker['recycles'] = supervisor.recycles
+    worker['restarts'] = supervisor.restarts
+
+def check_browser_health(supervisor, worker, healthy):
+    """After a record: recycle the context when the supervisor asks for it; True if the page was replaced"""
+    reason = supervisor.record_finished(healthy)
+    heap_checked(supervisor, worker)
+    if not reason:
         return False
-    except:
+    restarts = supervisor.restarts
+    supervisor.recycle(reason)
+    context_recycled(supervisor, worker, restarts)
+    return True
+
+def portal_opening(worker_id, account):
+    processing_state['workers'][worker_id]['status'] = 'logging in'
+    print(f"DEBUG: Worker {worker_id} navigating to {DASHBOARD_URL} as {account['username']}")  # Debug
+
+def portal_session_reused(worker_id, account):
+    log_message(f"[W{worker_id}] ♻️ Reusing saved portal session of {account['username']}, skipping login", "success")
+    processing_state['account_pool'].session_reused(account)
+
+def open_portal(supervisor, worker_id, account):
+    """Bring a new worker to the dashboard, logging its account in unless its saved session is still valid"""
+    page = supervisor.page
+    portal_opening(worker_id, account)
+    page.goto(DASHBOARD_URL, timeout=60000)
+    # The portal only redirects to /login when the saved session is missing or expired
+    if is_login_page(page):
+        return refresh_session(page, account)
+    portal_session_reused(worker_id, account)
+    wait_until(until_network_idle(page), "dashboard to load")
+    pace(3)
+    return True
+
+def worker_crashed(worker_id, error):
+    processing_state['workers'][worker_id]['status'] = 'crashed'
+    log_message(f"[W{worker_id}] Worker stopped: {str(error)}", "error")
+    print(f"DEBUG: Worker {worker_id} crashed: {str(error)}")  # Debug
+
+def run_worker(worker_id, job_id, record_queue):
+    """Worker thread: own Playwright instance and browser, logged in with the worker's portal account"""
+    account = processing_state['account_pool'].account_for(worker_id)
+    try:
+        with sync_playwright() as p:
+            supervisor = new_supervisor(p, worker_id, account)
+            supervisor.start(load_session_state(account))
+            if open_portal(supervisor, worker_id, account):
+                process_queue(supervisor, worker_id, job_id, record_queue)
+            else:
+                processing_state['workers'][worker_id]['status'] = 'account down'
+            supervisor.close()
+    except Exception as e:
+        worker_crashed(worker_id, e)
+
+def save_job_results(job_id):
+    """Write the final status of every record in the job to an Excel file"""
+    status_labels = {'success': 'Success', 'failure': 'Failure', 'skipped': 'Skipped'}
+    output_df = pd.DataFrame([
+        {"Aadhar No": record['aadhaar'], "Status": status_labels.get(record['status'], 'Pending')}
+        for record in job_store.get_job_results(app.config['JOB_DB'], job_id)
+    ])
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_path = os.path.join(app.config['UPLOAD_FOLDER'], f"processing_results_{timestamp}.xlsx")
+    output_df.to_excel(output_path, index=False)
+    return output_path
+
+def timing_report_paths(job_id):
+    base = os.path.join(app.config['UPLOAD_FOLDER'], f"timing_{secure_filename(job_id)}")
+    return base + '.json', base + '.html'
+
+def save_timing_report(job_id):
+    """Write the batch's per-step p50/p95/p99 and time split to JSON and HTML, and log the costliest step"""
+    steps = step_timer.summary()
+    if not steps:
+        return
+    json_path, html_path = step_timer.write_report(*timing_report_paths(job_id),
+                                                   metadata=processing_state['run_metadata'])
+    processing_state['run_metadata']['timing_report'] = f"/timing/{job_id}"
+    # 'record' spans every step of a record, so the costliest individual step is the next one
+    top = next((step for step in steps if step['step'] != 'record'), steps[0])
+    log_message(f"⏱️ Timing report saved to: {html_path} (costliest step: '{top['step']}', "
+                f"{top['total']:.0f}s total, p95 {top['p95']:.1f}s)", "info")
+    print(f"DEBUG: Timing report saved to: {json_path} and {html_path}")  # Debug
+
+def workers_starting(workers):
+    log_message(f"Starting {workers} workers on {len(processing_state['account_pool'].stats())} portal account(s)", "info")
+
+def run_workers(job_id, record_queue, workers):
+    """Process the queue with one thread and browser per worker; workers of the same account share its login,
+    so each account needs at most one CAPTCHA"""
+    workers_starting(workers)
+    threads = []
+    for worker_id in range(2, workers + 1):
+        thread = threading.Thread(target=run_worker, args=(worker_id, job_id, record_queue), daemon=True)
+        thread.start()
+        threads.append(thread)
+    run_worker(1, job_id, record_queue)
+    for thread in threads:
+        thread.join()
+
+# Async engine: the same flow on playwright.async_api. Every worker is a task with its own context on one
+# shared browser, so a single thread and event loop drive all sessions. Only the Playwright calls live here;
+# the decisions, bookkeeping and logging around them are the helpers the sync engine above uses too. Helpers
+# that write to the job store, the strategy cache or other files run on a thread via asyncio.to_thread, so
+# they never stall the other workers; the thread sees the task's record_context.
+
+async def slow_typing_async(element, text, delay_range=(0.1, 0.3)):
+    for char in text:
+        await element.type(char)
+        await step_timer.sleep_async(random.uniform(*delay_range))
+
+async def type_text_async(element, text):
+    profile = get_pacing_profile()
+    strategy = profile['input_strategy']
+    if strategy == 'fill':
+        await element.fill(text)
+    elif strategy == 'sequential':
+        await element.press_sequentially(text, delay=profile['type_delay'])
+    else:
+        await slow_typing_async(element, text)
+
+async def pace_async(seconds):
+    scaled = seconds * get_pacing_profile()['delay_scale']
+    if scaled > 0:
+        await step_timer.sleep_async(scaled)
+
+async def wait_until_async(condition, description="page to settle", timeout=None):
+    """wait_until for the until_* conditions of async pages"""
+    timeout = timeout or get_pacing_profile()['settle_timeout']
+    try:
+        with step_timer.measure('portal'):
+            await condition(timeout)
+        return True
+    except Exception:
+        log_message(f"⏳ Gave up waiting for {description} after {timeout // 1000}s", "info")
+        return False
+
+async def slow_action_async(description, action_func, delay=2.5, max_delay=4.0, wait_for=None, timeout=None):
+    """slow_action for actions that return a coroutine"""
+    with step_timer.span(description):
+        await pace_async(action_started(description, delay, max_delay))
+        try:
+            result = await action_func()
+            if wait_for:
+                await wait_until_async(wait_for, description, timeout)
+            post_delay = action_completed(description)
+            if post_delay:
+                await step_timer.sleep_async(post_delay)
+            return True, result
+        except Exception as e:
+            action_failed(description, e)
+            return False, None
+
+@step_timer.timed('handle_popups')
+async def handle_popups_async(page):
+    try:
+        ok_buttons = page.locator(POPUP_OK_SELECTOR)
+        if await ok_buttons.count() == 0:
+            return False
+        await ok_buttons.first.click(timeout=3000)
+        log_message("⚠️ Popup handled", "info")
+        await pace_async(1)
+        return True
+    except Exception:
         return False
 
-def manual_login(page):
-    """Handle login with manual CAPTCHA entry"""
+async def manual_login_async(page, account):
     log_message("\n=== MANUAL LOGIN ===", "info")
-    
-    def fill_credentials():
+
+    async def fill_credentials():
         mobile_field = page.get_by_role("textbox", name="Enter Your Mobile No.")
-        mobile_field.click()
-        slow_typing(mobile_field, CREDENTIALS[0]['username'])
-        
+        await mobile_field.click()
+        await type_text_async(mobile_field, account['username'])
+
         password_field = page.get_by_role("textbox", name="Password")
-        password_field.click()
-        slow_typing(password_field, CREDENTIALS[0]['password'])
-    
-    success, _ = slow_action("Entering credentials", fill_credentials)
+        await password_field.click()
+        await type_text_async(password_field, account['password'])
+
+    success, _ = await slow_action_async("Entering credentials", fill_credentials)
     if not success:
         return False
 
-    log_message("🧩 PLEASE ENTER CAPTCHA MANUALLY AND CLICK LOGIN...", "info")
+    challenge_id = captcha_requested(account)
     start_time = time.time()
-    while True:
-        try:
-            page.wait_for_selector("span:has-text('Welcome')", timeout=5000)
-            break
-        except:
-            elapsed = int(time.time() - start_time)
-            log_message(f"⏳ Waiting... {elapsed}s", "info")
-            if elapsed > 120:
-                raise TimeoutError("CAPTCHA timeout")
+    next_reminder = 15
+    try:
+        while True:
+            await publish_captcha_async(page, challenge_id)
+            # wait_answer blocks, so it waits on a thread while the other workers keep going
+            answer = await asyncio.to_thread(captcha_relay.wait_answer, challenge_id, 2)
+            if answer:
+                log_message("🧩 CAPTCHA answer received, logging in...", "info")
+                await submit_captcha_async(page, answer)
+            try:
+                await page.wait_for_selector(WELCOME_SELECTOR, timeout=10000 if answer else 1000)
+                break
+            except Exception:
+                next_reminder = captcha_not_accepted(answer, start_time, next_reminder)
+    finally:
+        captcha_relay.close(challenge_id)
     log_message("\n✅ Login successful!", "success")
-    time.sleep(2)
-    handle_popups(page)
+    await wait_until_async(until_network_idle(page), "dashboard to load")
+    await pace_async(2)
+    await handle_popups_async(page)
     return True
 
-def select_account_number(page):
-    """Select account number from dropdown with specific HTML structure"""
+async def publish_captcha_async(page, challenge_id):
     try:
-        # Wait for dropdown to be visible
-        page.wait_for_selector("select[name='accountNumbers']", timeout=15000)
-        
-        # Get the dropdown element
-        account_dropdown = page.locator("select[name='accountNumbers']")
-        
-        # Get all options
-        options = account_dropdown.locator("option").all()
-        
+        image = await page.locator(CAPTCHA_SELECTOR).first.screenshot(type='png', timeout=3000)
+    except Exception as e:
+        print(f"DEBUG: Could not capture CAPTCHA: {str(e)}")  # Debug
+        return False
+    captcha_captured(challenge_id, image)
+    return True
+
+async def submit_captcha_async(page, answer):
+    try:
+        field = page.locator(CAPTCHA_INPUT_SELECTOR).first
+        await field.fill("")
+        await type_text_async(field, answer)
+        await page.locator(LOGIN_BUTTON_SELECTOR).first.click(timeout=5000)
+    except Exception as e:
+        log_message(f"❌ Could not submit the CAPTCHA answer: {str(e)}", "error")
+
+async def refresh_session_async(page, account):
+    """refresh_session for async pages; the account's workers wait on an asyncio lock instead of a thread lock"""
+    account_pool = processing_state['account_pool']
+    async with account_pool.async_login_lock(account):
+        if account_pool.is_down(account):
+            return False
+        cookies = await asyncio.to_thread(saved_session_cookies, account)
+        if cookies is not None:
+            await page.context.add_cookies(cookies)
+            await page.goto(DASHBOARD_URL, timeout=60000)
+            if not is_login_page(page):
+                log_message("♻️ Picked up refreshed portal session", "success")
+                return True
+
+        log_message(f"Portal session of {account['username']} expired or missing, logging in", "info")
+        try:
+            if not is_login_page(page):
+                await page.goto(LOGIN_URL, timeout=60000)
+            await wait_until_async(until_network_idle(page), "login page to load")
+            await pace_async(3)
+            logged_in = login_finished(account, await manual_login_async(page, account))
+        except Exception as e:
+            logged_in = login_finished(account, False, e)
+        if logged_in:
+            await page.context.storage_state(path=session_state_path(account))
+            session_saved(account)
+        return logged_in
+
+async def take_screenshot_async(page, name, full_page=False, kind='error'):
+    path = await screenshot_writer.capture_async(page, name, kind=kind, full_page=full_page, **screenshot_details())
+    if path:
+        record_context.screenshot_path = path
+    return path
+
+@step_timer.timed('select_account_number')
+async def select_account_number_async(page):
+    try:
+        account_dropdown = page.locator(ACCOUNT_DROPDOWN_SELECTOR)
+        first_account = fetched_account()
+        if first_account:
+            try:
+                with step_timer.measure('portal'):
+                    await account_dropdown.select_option(first_account, timeout=15000)
+                log_message(f"✅ Successfully selected account: {first_account}", "success")
+                return True
+            except Exception as e:
+                fetched_account_not_selected(first_account, e)
+        with step_timer.measure('portal'):
+            await page.wait_for_selector(ACCOUNT_DROPDOWN_SELECTOR, timeout=15000)
+        options = await account_dropdown.locator("option").all()
         if len(options) < 2:
             raise Exception("No account options found in dropdown")
-        
-        # Select the first actual account (skip the disabled option)
-        first_account = options[1].get_attribute("value")
-        account_dropdown.select_option(first_account)
-        
+        first_account = await options[1].get_attribute("value")
+        await account_dropdown.select_option(first_account)
         log_message(f"✅ Successfully selected account: {first_account}", "success")
         return True
-        
     except Exception as e:
-        log_message(f"❌ Failed to select account: {str(e)}", "error")
-        # Take screenshot for debugging
-        timestamp = datetime.now().strftime("%H%M%S")
-        page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/account_selection_error_{timestamp}.png")
+        await take_screenshot_async(page, account_selection_failed(e))
         return False
 
-def try_different_ok_clicks(page):
-    """Try multiple ways to click the OK button"""
-    methods = [
-        lambda: page.get_by_role("button", name="OK").click(timeout=5000),
-        lambda: page.locator("button:has-text('OK')").click(timeout=5000),
-        lambda: page.locator(".modal-footer button:has-text('OK')").click(timeout=5000),
-        lambda: page.locator("button.btn-primary:has-text('OK')").click(timeout=5000),
-        lambda: page.locator("[role='button']:has-text('OK')").click(timeout=5000),
-        lambda: page.keyboard.press("Enter", timeout=5000)  # Sometimes Enter key works when buttons don't
-    ]
-    
-    for i, method in enumerate(methods):
+@step_timer.timed('try_different_ok_clicks')
+async def try_different_ok_clicks_async(page, step="ok"):
+    methods = ok_click_methods(page)
+    for name in click_strategies.order(step, list(methods)):
+        log_message(f"Trying OK click method '{name}' for {step}...", "info")
         try:
-            log_message(f"Trying OK click method {i+1}...", "info")
-            method()
-            log_message(f"✅ OK click method {i+1} worked!", "success")
-            time.sleep(2)  # Wait to see the effect
-            return True
+            await methods[name]()
         except Exception as e:
-            log_message(f"Method {i+1} failed: {e}", "error")
-            pass
-    
+            await asyncio.to_thread(ok_click_tried, step, name, e)
+            continue
+        await asyncio.to_thread(ok_click_tried, step, name)
+        await pace_async(2)
+        return True
     log_message("❌ All OK click methods failed", "error")
     return False
 
-def process_single_application(page, aadhaar):
-    """Process a single Aadhaar application"""
-    try:
-        processing_state['current_aadhaar'] = aadhaar
-        
-        # Navigate to loan page
-        success, _ = slow_action("Opening loan page", 
-                               lambda: page.get_by_role("link", name="Loan Application Loan").click(),
-                               3, 4)
-        if not success:
-            raise Exception("Could not open loan page")
-        
-        # Select financial year
-        success, _ = slow_action("Selecting financial year",
-                               lambda: page.get_by_role("combobox").select_option(FINANCIAL_YEAR))
-        if not success:
-            raise Exception("Financial year selection failed")
-        
-        # Enter Aadhaar
-        def fill_aadhaar():
-            field = page.get_by_role("textbox", name="Enter Aadhaar No.")
-            field.click()
-            field.fill("")  # Clear the field first
-            slow_typing(field, aadhaar)
-            
-        success, _ = slow_action("Entering Aadhaar", fill_aadhaar)
-        if not success:
-            raise Exception("Aadhaar entry failed")
-        
-        # Fetch record
-        success, _ = slow_action("Clicking FETCH RECORD",
-                               lambda: page.get_by_role("button", name="FETCH RECORD").click(),
-                               3, 4)
-        if not success:
-            raise Exception("Fetch record failed")
-        
-        # Check for No Records Found or other error messages
-        try:
-            error_message = page.locator("div.toast-message").text_content(timeout=5000)
-            if "No Records Found" in error_message or "error" in error_message.lower():
-                log_message(f"⚠️ Error for Aadhaar {aadhaar}: {error_message}", "warning")
-                # Take screenshot of the error
-                timestamp = datetime.now().strftime("%H%M%S")
-                page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/no_record_{aadhaar}_{timestamp}.png")
-                return False  # Skip to next Aadhaar
-        except:
-            pass  # No error message found, continue
-        
-        # Select account number
-        if not select_account_number(page):
-            raise Exception("Account selection failed")
-        
-        # Click OK button (using enhanced method)
-        success = try_different_ok_clicks(page)
-        if not success:
-            # Take screenshot for debugging
-            timestamp = datetime.now().strftime("%H%M%S")
-            page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/ok_button_error_{aadhaar}_{timestamp}.png")
-            raise Exception("OK button click failed despite multiple attempts")
-
-        # Take a screenshot at this point to aid debugging
-        timestamp = datetime.now().strftime("%H%M%S")
-        page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/after_ok_click_{aadhaar}_{timestamp}.png")
-        time.sleep(2)  # Extra wait to ensure page loads properly
-
-        # Continue with the loan application process
-        steps = [
-            ("Selecting application type", 
-             lambda: page.locator("select[name='applicationType']").select_option("0")),
-            ("Clicking page content", 
-             lambda: page.locator(".pageMainContent").click()),
-            ("UPDATE & CONTINUE (1st time)", 
-             lambda: page.get_by_role("button", name="UPDATE & CONTINUE").click()),
-            ("UPDATE & CONTINUE (2nd time)", 
-             lambda: page.get_by_role("button", name="UPDATE & CONTINUE").click()),
-            ("Completing financial details (step 1)", 
-             lambda: page.get_by_role("tabpanel", name="Financial Details").get_by_role("img").click()),
-            ("Completing financial details (step 2)", 
-             lambda: page.get_by_role("tabpanel", name="Financial Details").locator("i").nth(1).click()),
-            ("Selecting financial option", 
-             lambda: page.get_by_label("Financial Details").get_by_text("1", exact=True).click()),
-            ("SAVE & CONTINUE (1st time)", 
-             lambda: page.get_by_role("button", name="SAVE & CONTINUE").click()),
-            ("SAVE & CONTINUE (2nd time)", 
-             lambda: page.get_by_role("button", name="SAVE & CONTINUE").click()),
-            ("Clicking Preview", 
-             lambda: page.get_by_role("button", name="Preview").click()),
-            ("Clicking SUBMIT", 
-             lambda: page.get_by_role("button", name="SUBMIT").click()),
-            ("Clicking CONFIRM", 
-             lambda: page.get_by_role("button", name="CONFIRM").click())
-        ]
-
-        for desc, action in steps:
-            success, _ = slow_action(desc, action)
-            if not success:
-                raise Exception(f"Process failed at: {desc}")
-            
-            handle_popups(page)
-            time.sleep(1)
-        
-        # Final OK click with enhanced method
-        log_message("Attempting final OK click...", "info")
-        success = try_different_ok_clicks(page)
-        if not success:
-            # Try a different approach as last resort
-            log_message("Trying alternative click methods for final OK...", "info")
-            try:
-                # JavaScript click as last resort
-                page.evaluate("() => { document.querySelector('button:has-text(\"OK\")').click(); }")
-                log_message("✅ JavaScript click worked for final OK!", "success")
-                success = True
-            except:
-                # Take screenshot for debugging
-                timestamp = datetime.now().strftime("%H%M%S_%f")
-                page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/final_ok_error_{aadhaar}_{timestamp}.png")
-                log_message("❌ All methods to click final OK failed", "error")
-        
-        log_message(f"🎉 Application completed for Aadhaar: {aadhaar}", "success")
-        return True
+async def action_click_async(page, step, aadhaar):
+    await flow.resolve_target(page, step['target']).click(timeout=step['timeout'])
 
-    except Exception as e:
-        log_message(f"❌ Processing failed for {aadhaar}: {e}", "error")
-        timestamp = datetime.now().strftime("%H%M%S_%f")
-        screenshot_path = os.path.join(app.config['SCREENSHOT_FOLDER'], f"error_{aadhaar}_{timestamp}.png")
-        page.screenshot(path=screenshot_path, full_page=True)
-        log_message(f"📸 Screenshot saved to: {screenshot_path}", "info")
-        return False
-
-# Routes
-@app.route('/')
-def login():
-    if 'logged_in' in session:
-        print(f"DEBUG: User is logged in, redirecting to upload. Session: {session}")  # Debug
-        return redirect(url_for('upload'))
-    print("DEBUG: User not logged in, rendering login page")  # Debug
-    return render_template('login.html')
-
-@app.route('/login', methods=['POST'])
-def do_login():
-    username = request.form['username']
-    password = request.form['password']
-    print(f"DEBUG: Attempting login with username: {username}")  # Debug
-    for cred in CREDENTIALS:
-        if username == cred['username'] and password == cred['password']:
-            session['logged_in'] = True
-            session['username'] = username  # Store username in session
-            session['mobile'] = cred.get('mobile', '9876543210')  # Store mobile if available
-            print(f"LOGIN: Successful login for {username}. Session: {session}")  # Debug
-            return redirect(url_for('home'))  # Changed to redirect to home
-    flash('Invalid username or password', 'error')
-    return redirect(url_for('login'))
+async def action_select_async(page, step, aadhaar):
+    await flow.resolve_target(page, step['target']).select_option(flow_value(step, aadhaar), timeout=step['timeout'])
 
+async def action_type_async(page, step, aadhaar):
+    field = flow.resolve_target(page, step['target'])
+    await field.click(timeout=step['timeout'])
+    await field.fill("")
+    await type_text_async(field, flow_value(step, aadhaar))
 
-# Add these new routes
-@app.route('/download')
-def download_file():
-    file_path = request.args.get('file')
-    if not file_path or not os.path.exists(file_path):
-        abort(404)
-    return send_file(file_path, as_attachment=True)
+async def step_already_set_async(page, step, aadhaar):
+    try:
+        return await flow.resolve_target(page, step['target']).input_value(timeout=1000) == flow_value(step, aadhaar)
+    except Exception:
+        return False
 
+async def ensure_logged_in_async(page):
+    if is_login_page(page) and not await refresh_session_async(page, record_context.account):
+        raise Exception("Portal session expired and login failed")
+
+async def wait_for_loan_form_async(page, step):
+    with step_timer.measure('portal'):
+        await flow.resolve_target(page, step['wait_target']).wait_for(
+            state="visible", timeout=step['timeout'] or get_pacing_profile()['settle_timeout'])
+
+async def loan_page_direct_async(page, step):
+    with step_timer.measure('portal'):
+        await page.goto(loan_page_url())
+    if is_login_page(page):
+        await ensure_logged_in_async(page)
+        with step_timer.measure('portal'):
+            await page.goto(loan_page_url())
+    await wait_for_loan_form_async(page, step)
+
+async def loan_page_via_dashboard_async(page, step):
+    if not page.url.startswith(DASHBOARD_URL):
+        with step_timer.measure('portal'):
+            await page.goto(DASHBOARD_URL)
+        await ensure_logged_in_async(page)
+        await wait_until_async(until_network_idle(page), "dashboard to load")
+        await pace_async(3)
+    await flow.resolve_target(page, step['target']).click(timeout=step['timeout'])
+    await wait_for_loan_form_async(page, step)
+    await asyncio.to_thread(learn_loan_page_url, page.url)
+
+ASYNC_LOAN_PAGE_PATHS = {'direct': loan_page_direct_async, 'dashboard': loan_page_via_dashboard_async}
+
+async def action_open_loan_page_async(page, step, aadhaar):
+    on_dashboard = page.url.startswith(DASHBOARD_URL)
+    error = None
+    for name in loan_page_paths(page):
+        started = time.monotonic()
+        try:
+            with step_timer.span(f"loan_page_{name}"):
+                await ASYNC_LOAN_PAGE_PATHS[name](page, step)
+        except Exception as e:
+            await asyncio.to_thread(loan_page_path_tried, name, None, e)
+            error = e
+            continue
+        await asyncio.to_thread(loan_page_path_tried, name, None if on_dashboard else time.monotonic() - started)
+        return
+    raise error
+
+async def action_fetch_record_async(page, step, aadhaar):
+    record_context.fetch_result = None
+    target = flow.resolve_target(page, step['target'])
+    timeout = fetch_response_timeout(step)
+    if timeout is None:
+        await target.click(timeout=step['timeout'])
+        return
+    clicked = False
+    try:
+        async with page.expect_response(is_fetch_record_response, timeout=timeout) as response_info:
+            await target.click(timeout=step['timeout'])
+            clicked = True
+        response = await response_info.value
+        status, body = response.status, await response.text()
+    except Exception:
+        if not clicked:
+            raise
+        status, body = None, None
+    read_fetch_response(status, body)
+
+async def action_check_toast_async(page, step, aadhaar):
+    fetched, message = fetched_message()
+    if not fetched:
+        try:
+            message = await flow.resolve_target(page, step['target']).text_content(timeout=step['timeout'])
+        except Exception:
+            return True
+    screenshot = record_error_shown(aadhaar, message)
+    if screenshot:
+        await take_screenshot_async(page, screenshot)
+        return False
+    return True
 
+async def action_select_account_async(page, step, aadhaar):
+    if not await select_account_number_async(page):
+        raise Exception("Account selection failed")
+
+async def action_ok_click_async(page, step, aadhaar):
+    if not await try_different_ok_clicks_async(page, step['strategy_step']):
+        raise Exception("OK button click failed despite multiple attempts")
+
+# STEP_ACTIONS for the async engine; the flow file is validated against STEP_ACTIONS, so the names must match
+ASYNC_STEP_ACTIONS = {
+    'open_loan_page': action_open_loan_page_async,
+    'fetch_record': action_fetch_record_async,
+    'click': action_click_async,
+    'select': action_select_async,
+    'type': action_type_async,
+    'check_toast': action_check_toast_async,
+    'select_account': action_select_account_async,
+    'ok_click': action_ok_click_async
+}
 
-# Update the processing function to return output file
-def run_processing(records):
+async def run_step_async(page, step, aadhaar):
+    action = ASYNC_STEP_ACTIONS[step['action']]
+    attempts = step['retries'] + 1
+    for attempt in range(1, attempts + 1):
+        success, result = await slow_action_async(step['name'], lambda: action(page, step, aadhaar), *step['delay'],
+                                                  wait_for=step_condition(page, step), timeout=step['timeout'])
+        if success:
+            return True, result, attempt
+        if attempt < attempts:
+            log_message(f"🔁 Retrying {step['name']} ({attempt}/{step['retries']})", "warning")
+            await handle_popups_async(page)
+            await pace_async(step['retry_delay'])
+    return False, None, attempts
+
+async def at_checkpoint_async(page, target):
+    if not target:
+        return True
     try:
-        output_filename = f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        
-        # ... existing processing code ...
-        
-        # After processing completes
-        output_df = pd.DataFrame([{
-            'Aadhar No': r['Aadhar No'],
-            'Status': 'Success' if r['Aadhar No'] in successful_aadhaars else 'Failure'
-        } for r in records])
-        
-        output_df.to_excel(output_path, index=False)
-        
-        processing_state['output_file'] = output_path
-        processing_state['is_processing'] = False
-        
-    except Exception as e:
-        log_message(f"Fatal error: {str(e)}", "error")
-        processing_state['is_processing'] = False
+        with step_timer.measure('portal'):
+            await flow.resolve_target(page, target).first.wait_for(state="visible",
+                                                                   timeout=get_pacing_profile()['settle_timeout'])
+        return True
+    except Exception:
+        return False
 
-# # Update logs endpoint to include output file
-# @app.route('/logs')
-# def get_logs():
-#     return jsonify({
-#         'logs': processing_state['logs'],
-#         'progress': processing_state['progress'],
-#         'is_processing': processing_state['is_processing'],
-#         'successful_count': processing_state['successful_count'],
-#         'total_records': processing_state['total_records'],
-#         'output_file': processing_state.get('output_file', ''),
-#         'current_aadhaar': processing_state['current_aadhaar']
-#     })
-@app.route('/logout')
-def logout():
-    session.pop('logged_in', None)
-    session.pop('temp_records_file', None)
-    session.pop('file_path', None)
-    print(f"LOGOUT: Session cleared. Session: {session}")  # Debug
-    return redirect(url_for('login'))
+async def run_steps_async(page, steps, aadhaar):
+    for step in steps:
+        if step['skip_if_set'] and await step_already_set_async(page, step, aadhaar):
+            log_message(f"⏭️ {step['name']}: already set, skipped", "info")
+            continue
+        started = time.monotonic()
+        success, result, attempts = await run_step_async(page, step, aadhaar)
+        outcome = step_finished(step, time.monotonic() - started, success, result, attempts)
+        if outcome == 'stop':
+            return False
+        if outcome == 'skip':
+            continue
+
+        screenshot = await asyncio.to_thread(step_confirmed, step, aadhaar)
+        if screenshot:
+            await take_screenshot_async(page, screenshot, kind='debug')
+        if step['popups']:
+            await handle_popups_async(page)
+        await pace_async(step['pause'])
+    return True
 
-@app.route('/home')
-def home():
-    if 'logged_in' not in session:
-        return redirect(url_for('login'))
-    
-    username = session.get('username', 'User')
-    mobile = session.get('mobile', '9876543210')
-    
-    return render_template('home.html', username=username, mobile=mobile)
+async def process_single_application_async(page, aadhaar):
+    """process_single_application on an async page"""
+    try:
+        plan = await asyncio.to_thread(plan_record, aadhaar)
+        if already_submitted(aadhaar, plan):
+            return True
+        if not await run_steps_async(page, plan['replay'], aadhaar):
+            return False
+        resumed = bool(plan['skipped']) and await at_checkpoint_async(page, plan['resume_target'])
+        if not await run_steps_async(page, steps_after_replay(aadhaar, plan, resumed), aadhaar):
+            return False
 
-@app.route('/upload', methods=['GET', 'POST'])
-def upload():
-    if 'logged_in' not in session:
-        print(f"UPLOAD: Redirecting to login - not logged in. Session: {session}")  # Debug
-        return redirect(url_for('login'))
-    
-    # Get user details
-    username = "User"  # Replace with actual username
-    mobile = "9876543210"  # Replace with actual mobile number
-    
-    file_uploaded = False
-    preview = ""
-    total_records = 0
+        log_message(f"🎉 Application completed for Aadhaar: {aadhaar}", "success")
+        return True
 
-    if request.method == 'POST':
-        print("UPLOAD: Received POST request")  # Debug
-        if 'file' not in request.files:
-            flash('No file selected', 'error')
-            print("UPLOAD ERROR: No file selected")  # Debug
-            return redirect(url_for('upload'))
-        file = request.files['file']
-        if file.filename == '':
-            flash('No file selected', 'error')
-            print("UPLOAD ERROR: Empty filename")  # Debug
-            return redirect(url_for('upload'))
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            print(f"UPLOAD: File saved to {file_path}")  # Debug
-            
+    except Exception as e:
+        screenshot_path = await take_screenshot_async(page, record_crashed(aadhaar, e), full_page=True)
+        if screenshot_path:
+            log_message(f"📸 Screenshot saved to: {screenshot_path}", "info")
+        return False
+    finally:
+        log_step_timings(aadhaar, getattr(record_context, 'step_timings', []))
+
+async def next_record_async(worker, record_queue):
+    record = queued_record(worker, record_queue)
+    if record:
+        return record
+    record = await processing_state['retry_queue'].pop_async()
+    return (record[0], record[1], True) if record else None
+
+async def process_queue_async(supervisor, worker_id, job_id, record_queue):
+    """process_queue for one worker task of the async engine"""
+    worker = processing_state['workers'][worker_id]
+    account = processing_state['account_pool'].account_for(worker_id)
+    while not processing_state['account_pool'].is_down(account):
+        record = await next_record_async(worker, record_queue)
+        if record is None:
+            break
+        position, aadhaar, is_retry = record
+        if await asyncio.to_thread(skip_if_submitted, worker_id, job_id, position, aadhaar):
+            if not is_retry:
+                record_queue.task_done()
+            continue
+        start_record(worker, worker_id, job_id, position, aadhaar, is_retry)
+        attempts = await asyncio.to_thread(job_store.mark_record_started, app.config['JOB_DB'], job_id, position)
+
+        success = False
+        try:
+            if not await supervisor.is_alive():
+                restarts = supervisor.restarts
+                await supervisor.relaunch("browser or page stopped responding")
+                browser_relaunched(supervisor, worker, restarts)
+            # The flow's first step brings the page to the loan form, whichever page it is on
+            page = supervisor.page
+            started = time.monotonic()
+            with step_timer.span('record'):
+                success = await process_single_application_async(page, aadhaar)
+            record_processed(worker_id, aadhaar, success, started)
+            await pace_async(2)
+        except Exception as e:
+            record_errored(worker_id, aadhaar, e)
             try:
-                print("UPLOAD: Reading Excel file (first 3 rows for validation)")  # Debug
-                df = pd.read_excel(file_path, sheet_name=SHEET_NAME, nrows=3)
-                print(f"UPLOAD: Excel columns: {list(df.columns)}")  # Debug
-                if 'Aadhar No' not in df.columns:
-                    flash("Excel must contain 'Aadhar No' column", 'error')
-                    print("UPLOAD ERROR: 'Aadhar No' column missing")  # Debug
-                    return redirect(url_for('upload'))
-                
-                # Read full file for processing
-                print("UPLOAD: Reading full Excel file")  # Debug
-                df = pd.read_excel(file_path, sheet_name=SHEET_NAME)
-                
-                # Clean Aadhaar numbers
-                def clean_aadhar(x):
-                    if pd.isna(x):
-                        return ''
-                    x = str(x)
-                    x = x.split('.')[0]
-                    x = re.sub(r'[^0-9]', '', x)
-                    if len(x) > 12:
-                        x = x[:12]
-                    elif len(x) < 12:
-                        x = x.zfill(12)
-                    return x
-                
-                df['Aadhar No'] = df['Aadhar No'].apply(clean_aadhar)
-                df = df[df['Aadhar No'].notna() & (df['Aadhar No'] != '')]
-                df = df[df['Aadhar No'].str.match(r'^\d{12}$')]
-                
-                if len(df) == 0:
-                    flash("No valid Aadhaar numbers found after validation", 'error')
-                    return redirect(url_for('upload'))
-                
-                # Save records to temporary JSON file
-                records = df.to_dict('records')
-                temp_filename = f"records_{uuid.uuid4().hex}.json"
-                temp_filepath = os.path.join(app.config['TEMP_FOLDER'], temp_filename)
-                with open(temp_filepath, 'w') as f:
-                    json.dump(records, f)
-                
-                # Store file paths in session
-                session['temp_records_file'] = temp_filepath
-                session['file_path'] = file_path
-                
-                preview = "\n".join(str(r['Aadhar No']) for r in records[:10])  # Show first 10 only
-                file_uploaded = True
-                total_records = len(records)
-                
-                return render_template('upload.html', 
-                         username=username, 
-                         mobile=mobile,
-                         preview=preview,
-                         file_uploaded=file_uploaded,
-                         total_records=total_records)
-                
-            except Exception as e:
-                flash(f"Failed to load Excel: {str(e)}", 'error')
-                return redirect(url_for('upload'))
-    
-    return render_template('upload.html', 
-                         username=username, 
-                         mobile=mobile,
-                         preview=preview,
-                         file_uploaded=file_uploaded,
-                         total_records=total_records)
+                await take_screenshot_async(supervisor.page, f"error_{aadhaar}")
+            except Exception:
+                pass
+        finally:
+            await asyncio.to_thread(finish_record, job_id, position, aadhaar, attempts, success, worker_id)
+            if not is_retry:
+                record_queue.task_done()
 
+        try:
+            await check_browser_health_async(supervisor, worker, record_was_healthy(success))
+        except Exception as e:
+            log_message(f"[W{worker_id}] Could not replace the browser: {str(e)}", "error")
 
-@app.route('/start_processing', methods=['POST'])
-def start_processing():
-    print(f"DEBUG: Start processing called. Session: {session}")  # Debug
-    if 'logged_in' not in session or 'temp_records_file' not in session:
-        flash('Please upload a valid file first', 'error')
-        print(f"START_PROCESSING ERROR: No records or not logged in. Session: {session}")  # Debug
-        return redirect(url_for('upload'))
-    
-    if processing_state['is_processing']:
-        flash('Processing already in progress', 'error')
-        print("START_PROCESSING ERROR: Processing already in progress")  # Debug
-        return redirect(url_for('upload'))
-    
-    # Load records from temporary file
-    temp_filepath = session['temp_records_file']
-    print(f"DEBUG: Loading records from temp file: {temp_filepath}")  # Debug
-    try:
-        with open(temp_filepath, 'r') as f:
-            records = json.load(f)
-        print(f"DEBUG: Loaded {len(records)} records from temp file")  # Debug
-    except Exception as e:
-        flash(f"Failed to load records: {str(e)}", 'error')
-        print(f"START_PROCESSING ERROR: Failed to load records from {temp_filepath} - {str(e)}")  # Debug
-        return redirect(url_for('upload'))
-    
-    processing_state['is_processing'] = True
-    processing_state['progress'] = 0
-    processing_state['logs'] = []
-    processing_state['successful_count'] = 0
-    processing_state['total_records'] = len(records)
-    processing_state['current_aadhaar'] = ''
-    
-    print(f"START_PROCESSING: Starting thread with {len(records)} records")  # Debug
-    threading.Thread(target=run_processing, args=(records,), daemon=True).start()
-    return redirect(url_for('upload'))
+    worker_stopped(worker_id, account)
 
-@app.route('/logs')
-def get_logs():
-    print(f"DEBUG: Fetching logs. Processing state: {processing_state}")  # Debug
-    return jsonify({
-        'logs': processing_state['logs'],
-        'progress': processing_state['progress'],
-        'is_processing': processing_state['is_processing'],
-        'successful_count': processing_state['successful_count'],
-        'total_records': processing_state['total_records'],
-        'current_aadhaar': processing_state['current_aadhaar']
-    })
+async def launch_browser_async(p):
+    return await p.chromium.launch(**launch_options())
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls'}
+async def new_browser_context_async(browser, storage_state=None):
+    context = await browser.new_context(storage_state=storage_state, **CONTEXT_OPTIONS)
+    if app.config['BLOCK_RESOURCES']:
+        await context.route("**/*", resource_blocker(block_resources_async, app.config['BLOCK_IMAGES']))
+    return context
 
-def run_processing(records):
-    try:
-        log_message("Starting Playwright processing", "info")
-        # Track Aadhaar status for Excel output
-        aadhaar_status = []
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=False, slow_mo=0, args=["--start-maximized"])
-            context = browser.new_context(viewport={"width": 1366, "height": 768}, ignore_https_errors=True)
-            page = context.new_page()
-
-            log_message("Opening website...", "info")
-            print("DEBUG: Navigating to https://fasalrin.gov.in/login")  # Debug
-            page.goto('https://fasalrin.gov.in/login', timeout=60000)
-            time.sleep(3)
-
-            print("DEBUG: Waiting for manual login")  # Debug
-            if not manual_login(page):
-                raise Exception("Login failed")
-
-            successful_count = 0
-            for i, record in enumerate(records):
-                aadhaar = record['Aadhar No']
-                processing_state['current_aadhaar'] = aadhaar
-                log_message(f"Processing {aadhaar} ({i+1}/{len(records)})", "info")
-                print(f"DEBUG: Processing Aadhaar {aadhaar} ({i+1}/{len(records)})")  # Debug
-                processing_state['progress'] = ((i + 1) / len(records)) * 100
-
-                try:
-                    if i > 0:
-                        print("DEBUG: Navigating to dashboard")  # Debug
-                        page.goto('https://fasalrin.gov.in/dashboard')
-                        time.sleep(3)
-
-                    success = process_single_application(page, aadhaar)
-                    status = "Success" if success else "Failure"
-                    aadhaar_status.append({"Aadhar No": aadhaar, "Status": status})
-                    if success:
-                        successful_count += 1
-                        processing_state['successful_count'] = successful_count
-                        log_message(f"Success: {aadhaar}", "success")
-                        print(f"DEBUG: Success for Aadhaar {aadhaar}")  # Debug
-                    else:
-                        log_message(f"Failed: {aadhaar}", "error")
-                        print(f"DEBUG: Failed for Aadhaar {aadhaar}")  # Debug
-                    time.sleep(2)
-                except Exception as e:
-                    log_message(f"Error: {aadhaar} - {str(e)}", "error")
-                    print(f"DEBUG: Error for Aadhaar {aadhaar}: {str(e)}")  # Debug
-                    page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/error_{aadhaar}.png")
-            
-            # Save Aadhaar status to Excel
-            output_df = pd.DataFrame(aadhaar_status)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], f"processing_results_{timestamp}.xlsx")
-            output_df.to_excel(output_path, index=False)
-            log_message(f"📊 Excel output saved to: {output_path}", "success")
-            print(f"DEBUG: Excel output saved to: {output_path}")  # Debug
-            
-            log_message(f"Completed: Processed {successful_count}/{len(records)} Aadhaar numbers", "success")
-            print(f"DEBUG: Processing completed. {successful_count}/{len(records)} successful")  # Debug
-            processing_state['is_processing'] = False
-            browser.close()
-    except Exception as e:
-        log_message(f"Fatal error: {str(e)}", "error")
-        print(f"DEBUG: Fatal error in processing: {str(e)}")  # Debug
-        processing_state['is_processing'] = False
+def new_async_supervisor(p, shared_browser, worker_id, account):
+    return AsyncBrowserSupervisor(p, shared_browser.get, new_browser_context_async, lambda: load_session_state(account),
+                                  log_message, **supervisor_options(worker_id))
 
-if __name__ == '__main__':
-    print("DEBUG: Starting Flask app")  # Debug
-    app.run(debug=True, host='0.0.0.0', port=5000)
+async def check_browser_health_async(supervisor, worker, healthy):
+    reason = await supervisor.record_finished(healthy)
+    heap_checked(supervisor, worker)
+    if not reason:
+        return False
+    restarts = supervisor.restarts
+    await supervisor.recycle(reason)
+    context_recycled(supervisor, worker, restarts)
+    return True
 
-@app.route('/start_processing', methods=['POST'])
-def start_processing():
-    print(f"DEBUG: Start processing called. Session: {session}")  # Debug
-    if 'logged_in' not in session or 'temp_records_file' not in session:
-        flash('Please upload a valid file first', 'error')
-        print(f"START_PROCESSING ERROR: No records or not logged in. Session: {session}")  # Debug
-        return redirect(url_for('upload'))
-    
-    if processing_state['is_processing']:
-        flash('Processing already in progress', 'error')
-        print("START_PROCESSING ERROR: Processing already in progress")  # Debug
-        return redirect(url_for('upload'))
-    
-    # Load records from temporary file
-    temp_filepath = session['temp_records_file']
-    print(f"DEBUG: Loading records from temp file: {temp_filepath}")  # Debug
+async def open_portal_async(supervisor, worker_id, account):
+    page = supervisor.page
+    portal_opening(worker_id, account)
+    await page.goto(DASHBOARD_URL, timeout=60000)
+    if is_login_page(page):
+        return await refresh_session_async(page, account)
+    portal_session_reused(worker_id, account)
+    await wait_until_async(until_network_idle(page), "dashboard to load")
+    await pace_async(3)
+    return True
+
+async def run_worker_async(p, shared_browser, worker_id, job_id, record_queue):
+    """Worker task: its own context on the shared browser, logged in with the worker's portal account"""
+    account = processing_state['account_pool'].account_for(worker_id)
     try:
-        with open(temp_filepath, 'r') as f:
-            records = json.load(f)
-        print(f"DEBUG: Loaded {len(records)} records from temp file")  # Debug
+        supervisor = new_async_supervisor(p, shared_browser, worker_id, account)
+        await supervisor.start(load_session_state(account))
+        if await open_portal_async(supervisor, worker_id, account):
+            await process_queue_async(supervisor, worker_id, job_id, record_queue)
+        else:
+            processing_state['workers'][worker_id]['status'] = 'account down'
+        await supervisor.close()
     except Exception as e:
-        flash(f"Failed to load records: {str(e)}", 'error')
-        print(f"START_PROCESSING ERROR: Failed to load records from {temp_filepath} - {str(e)}")  # Debug
-        return redirect(url_for('upload'))
-    
-    processing_state['is_processing'] = True
-    processing_state['progress'] = 0
-    processing_state['logs'] = []
-    processing_state['successful_count'] = 0
-    processing_state['total_records'] = len(records)
-    processing_state['current_aadhaar'] = ''
-    
-    print(f"START_PROCESSING: Starting thread with {len(records)} records")  # Debug
-    threading.Thread(target=run_processing, args=(records,), daemon=True).start()
-    return redirect(url_for('upload'))
-
-@app.route('/logs')
-def get_logs():
-    print(f"DEBUG: Fetching logs. Processing state: {processing_state}")  # Debug
-    return jsonify({
-        'logs': processing_state['logs'],
-        'progress': processing_state['progress'],
-        'is_processing': processing_state['is_processing'],
-        'successful_count': processing_state['successful_count'],
-        'total_records': processing_state['total_records'],
-        'current_aadhaar': processing_state['current_aadhaar']
-    })
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls'}
-
-def run_processing(records):
+        worker_crashed(worker_id, e)
+
+async def run_workers_async(job_id, record_queue, workers):
+    """run_workers on one event loop: every worker is a task with its own context on one shared browser"""
+    workers_starting(workers)
+    async with async_playwright() as p:
+        shared_browser = SharedBrowser(launch_browser_async)
+        await asyncio.gather(*(run_worker_async(p, shared_browser, worker_id, job_id, record_queue)
+                               for worker_id in range(1, workers + 1)))
+        await shared_browser.close()
+
+def run_processing(job_id, records, workers=1, pacing_profile=DEFAULT_PACING_PROFILE):
+    """Process the unfinished (position, aadhaar) records of a job"""
     try:
-        log_message("Starting Playwright processing", "info")
-        # Track Aadhaar status for Excel output
-        aadhaar_status = []
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=False, slow_mo=0, args=["--start-maximized"])
-            context = browser.new_context(viewport={"width": 1366, "height": 768}, ignore_https_errors=True)
-            page = context.new_page()
-
-            log_message("Opening website...", "info")
-            print("DEBUG: Navigating to https://fasalrin.gov.in/login")  # Debug
-            page.goto('https://fasalrin.gov.in/login', timeout=60000)
-            time.sleep(3)
-
-            print("DEBUG: Waiting for manual login")  # Debug
-            if not manual_login(page):
-                raise Exception("Login failed")
-
-            successful_count = 0
-            for i, record in enumerate(records):
-                aadhaar = record['Aadhar No']
-                processing_state['current_aadhaar'] = aadhaar
-                log_message(f"Processing {aadhaar} ({i+1}/{len(records)})", "info")
-                print(f"DEBUG: Processing Aadhaar {aadhaar} ({i+1}/{len(records)})")  # Debug
-                processing_state['progress'] = ((i + 1) / len(records)) * 100
-
-                try:
-                    if i > 0:
-                        print("DEBUG: Navigating to dashboard")  # Debug
-                        page.goto('https://fasalrin.gov.in/dashboard')
-                        time.sleep(3)
-
-                    success = process_single_application(page, aadhaar)
-                    status = "Success" if success else "Failure"
-                    aadhaar_status.append({"Aadhar No": aadhaar, "Status": status})
-                    if success:
-                        successful_count += 1
-                        processing_state['successful_count'] = successful_count
-                        log_message(f"Success: {aadhaar}", "success")
-                        print(f"DEBUG: Success for Aadhaar {aadhaar}")  # Debug
-                    else:
-                        log_message(f"Failed: {aadhaar}", "error")
-                        print(f"DEBUG: Failed for Aadhaar {aadhaar}")  # Debug
-                    time.sleep(2)
-                except Exception as e:
-                    log_message(f"Error: {aadhaar} - {str(e)}", "error")
-                    print(f"DEBUG: Error for Aadhaar {aadhaar}: {str(e)}")  # Debug
-                    page.screenshot(path=f"{app.config['SCREENSHOT_FOLDER']}/error_{aadhaar}.png")
-            
-            # Save Aadhaar status to Excel
-            output_df = pd.DataFrame(aadhaar_status)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], f"processing_results_{timestamp}.xlsx")
-            output_df.to_excel(output_path, index=False)
-            log_message(f"📊 Excel output saved to: {output_path}", "success")
-            print(f"DEBUG: Excel output saved to: {output_path}")  # Debug
-            
-            log_message(f"Completed: Processed {successful_count}/{len(records)} Aadhaar numbers", "success")
-            print(f"DEBUG: Processing completed. {successful_count}/{len(records)} successful")  # Debug
-            processing_state['is_processing'] = False
-            browser.close()
+        processing_state['pacing_profile'] = pacing_profile
+        processing_state['flow_steps'] = flow.load_flow(app.config['FLOW_FILE'], STEP_ACTIONS)
+        processing_state['launch_profile'] = resolve_profile(app.config['LAUNCH_PROFILE'], log_message)
+        step_timer.reset()
+        processing_state['fetch_response_misses'] = 0
+        if not CREDENTIALS:
+            raise Exception(f"No portal accounts found in {CREDENTIALS_FILE}")
+        # Ask for at least one worker per account so the batch is sharded across all of them; the worker
+        # cap and the number of records can still leave some accounts without one
+        workers = max(1, min(max(int(workers), len(CREDENTIALS)), max_workers(), len(records)))
+        if workers < len(CREDENTIALS):
+            unused = [account['username'] for account in CREDENTIALS[workers:]]
+            log_message(f"⚠️ Only {workers} worker(s) for {len(CREDENTIALS)} accounts, not using "
+                        f"{', '.join(unused)} for this batch", "warning")
+        account_pool = AccountPool(CREDENTIALS)
+        account_pool.assign(workers)
+        processing_state['account_pool'] = account_pool
+        processing_state['run_metadata'] = {
+            'job_id': job_id,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'workers': workers,
+            'pacing_profile': pacing_profile,
+            'input_strategy': get_pacing_profile()['input_strategy'],
+            'flow': os.path.basename(app.config['FLOW_FILE']),
+            'flow_steps': len(processing_state['flow_steps']),
+            'launch_profile': processing_state['launch_profile'],
+            'engine': app.config['ENGINE'],
+            'accounts': len(account_pool.stats())
+        }
+        log_message(f"Starting Playwright processing ({workers} {app.config['ENGINE']} workers, "
+                    f"'{processing_state['launch_profile']}' browser, "
+                    f"'{pacing_profile}' pacing, "
+                    f"'{processing_state['run_metadata']['input_strategy']}' input)", "info")
+        if processing_state['processed_count']:
+            log_message(f"Resuming job from record {records[0][0] + 1}, "
+                        f"{processing_state['processed_count']} records already done", "info")
+        job_store.set_job_status(app.config['JOB_DB'], job_id, 'running')
+
+        record_queue = queue.Queue()
+        for position, aadhaar in records:
+            record_queue.put((position, aadhaar))
+        processing_state['record_queue'] = record_queue
+        processing_state['retry_queue'] = retries.RetryQueue(RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+
+        processing_state['workers'] = {
+            worker_id: {'status': 'starting', 'current_aadhaar': '', 'processed': 0, 'successful': 0,
+                        'heap_mb': None, 'recycles': 0, 'restarts': 0,
+                        'account': account_pool.account_for(worker_id)['username']}
+            for worker_id in range(1, workers + 1)
+        }
+
+        if app.config['ENGINE'] == 'async':
+            asyncio.run(run_workers_async(job_id, record_queue, workers))
+        else:
+            run_workers(job_id, record_queue, workers)
+
+        # Records left behind by a crashed worker stay pending and can be resumed later
+        remaining = len(job_store.get_pending_records(app.config['JOB_DB'], job_id))
+        job_store.set_job_status(app.config['JOB_DB'], job_id, 'interrupted' if remaining else 'completed')
+
+        for username, account_stats in account_pool.stats().items():
+            log_message(f"👤 {username}: {account_stats['processed']} records ({account_stats['successful']} ok) "
+                        f"by {account_stats['workers']} worker(s), {account_stats['records_per_minute']} records/min, "
+                        f"{account_stats['status']}", "info")
+        processing_state['run_metadata']['account_throughput'] = account_pool.stats()
+
+        # Save Aadhaar status to Excel
+        output_path = save_job_results(job_id)
+        processing_state['output_file'] = output_path
+        log_message(f"📊 Excel output saved to: {output_path}", "success")
+        print(f"DEBUG: Excel output saved to: {output_path}")  # Debug
+        save_timing_report(job_id)
+
+        successful_count = processing_state['successful_count']
+        total = processing_state['total_records']
+        log_message(f"Completed: Processed {successful_count}/{total} Aadhaar numbers", "success")
+        if remaining:
+            log_message(f"{remaining} records were not processed, resume the job to finish them", "warning")
+        print(f"DEBUG: Processing completed. {successful_count}/{total} successful")  # Debug
+        for name, path_stats in click_strategies.stats().get('loan_page', {}).get('strategies', {}).items():
+            log_message(f"🧭 Loan page via {name}: {path_stats['hits']} ok, {path_stats['misses']} failed, "
+                        f"average {path_stats.get('mean_seconds')}s", "info")
+        for step, step_stats in click_strategies.stats().items():
+            print(f"DEBUG: OK click strategy for {step}: preferred={step_stats['preferred']} "
+                  f"stats={step_stats['strategies']}")  # Debug
+        processing_state['is_processing'] = False
+        notify_state_change()
     except Exception as e:
         log_message(f"Fatal error: {str(e)}", "error")
         print(f"DEBUG: Fatal error in processing: {str(e)}")  # Debug
+        job_store.set_job_status(app.config['JOB_DB'], job_id, 'interrupted')
         processing_state['is_processing'] = False
+        notify_state_change()
 
 if __name__ == '__main__':
     print("DEBUG: Starting Flask app")  # Debug
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
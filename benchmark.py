@@ -0,0 +1,174 @@
+"""End-to-end throughput benchmark of the automation against the local mock portal.
+
+Starts mock_portal.py on a background thread, points the app at it and, for each
+worker count, uploads a fresh sheet of valid Aadhaar numbers, starts processing
+through the app's own routes and answers the login CAPTCHA through the relay. The
+report covers records/min, per-step p50/p95 from the timing report and, when psutil
+is installed, CPU and memory of each worker's browser.
+
+    python benchmark.py --records 30 --workers 1,2,4 --pacing fast --latency 0.3
+    python benchmark.py --records 200 --workers 8,16,32 --engine async
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import pandas as pd
+import ingest
+import mock_portal
+
+try:
+    import psutil  # Optional, only needed for CPU and memory per worker
+except ImportError:
+    psutil = None
+
+BENCHMARK_CAPTCHA = 'BENCH'
+
+def make_aadhaars(count, rng):
+    """Random 12-digit numbers that pass the upload's prefix and Verhoeff checks"""
+    aadhaars = []
+    while len(aadhaars) < count:
+        base = str(rng.randint(2, 9)) + ''.join(str(rng.randint(0, 9)) for _ in range(10))
+        candidates = [base + str(digit) for digit in range(10)]
+        valid = ingest.verhoeff_valid(candidates)
+        aadhaars.append(candidates[int(valid.argmax())])
+    return aadhaars
+
+class ResourceSampler:
+    """Samples CPU and RSS of every Playwright driver started by this process, one driver per worker"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.samples = {}  # driver pid -> list of (cpu percent, rss MB) for its process tree
+        self.processes = {}
+        self.stopped = threading.Event()
+
+    def tree(self, root):
+        processes = [root] + root.children(recursive=True)
+        for process in processes:
+            self.processes.setdefault(process.pid, process)
+        return [self.processes[process.pid] for process in processes]
+
+    def sample(self):
+        for driver in psutil.Process().children():
+            cpu, rss = 0.0, 0
+            try:
+                for process in self.tree(driver):
+                    cpu += process.cpu_percent(None)
+                    rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+            self.samples.setdefault(driver.pid, []).append((cpu, rss / (1024 * 1024)))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if psutil is not None:
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        """Per worker mean CPU % and peak RSS MB, in start order"""
+        self.stopped.set()
+        return [{'mean_cpu_percent': round(sum(cpu for cpu, _ in values) / len(values), 1),
+                 'peak_rss_mb': round(max(rss for _, rss in values), 1)}
+                for _, values in sorted(self.samples.items())]
+
+def run_benchmark(app, client, records, workers, pacing, seed):
+    """Process one fresh batch and return its throughput figures"""
+    sheet = os.path.join(app.app.config['TEMP_FOLDER'], f"benchmark_{workers}w.xlsx")
+    pd.DataFrame({'Aadhar No': make_aadhaars(records, random.Random(seed))}).to_excel(sheet, index=False)
+    with open(sheet, 'rb') as f:
+        client.post('/upload', data={'file': (f, os.path.basename(sheet))}, content_type='multipart/form-data')
+
+    sampler = ResourceSampler()
+    sampler.start()
+    started = time.monotonic()
+    client.post('/start_processing', data={'workers': workers, 'pacing': pacing})
+    while True:
+        data = client.get('/logs').get_json()
+        for captcha in data['captchas']:
+            client.post(f"/captcha/{captcha['id']}", data={'answer': BENCHMARK_CAPTCHA})
+        if not data['is_processing']:
+            break
+        time.sleep(1)
+    elapsed = time.monotonic() - started
+    resources = sampler.stop()
+
+    job_id = data['job_id']
+    job = app.job_store.get_job(app.app.config['JOB_DB'], job_id)
+    timing = client.get(f"/timing/{job_id}?format=json").get_json() or {'steps': []}
+    flow_steps = {step['name'] for step in app.processing_state['flow_steps']}
+    return {
+        'workers': workers,
+        'records': records,
+        'succeeded': job['success_count'],
+        'failed': job['failure_count'],
+        'seconds': round(elapsed, 1),
+        'records_per_minute': round(job['finished_count'] / elapsed * 60, 2),
+        'steps': [{key: step[key] for key in ('step', 'count', 'p50', 'p95', 'p99')}
+                  for step in timing['steps'] if step['step'] in flow_steps],
+        'resources': resources
+    }
+
+def print_report(results):
+    print(f"\n{'Workers':>8} {'Records':>8} {'OK':>5} {'Failed':>7} {'Seconds':>9} {'Rec/min':>9}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['records']:>8} {result['succeeded']:>5} {result['failed']:>7} "
+              f"{result['seconds']:>9} {result['records_per_minute']:>9}")
+    for result in results:
+        print(f"\nSlowest steps with {result['workers']} worker(s) (p50 / p95 seconds):")
+        for step in sorted(result['steps'], key=lambda step: step['p50'], reverse=True)[:5]:
+            print(f"  {step['step']:<40} {step['p50']:>6.2f} {step['p95']:>6.2f}")
+        for worker, usage in enumerate(result['resources'], start=1):
+            print(f"  Worker {worker}: {usage['mean_cpu_percent']}% CPU, {usage['peak_rss_mb']} MB peak RSS")
+    if psutil is None:
+        print("\nInstall psutil to measure CPU and memory per worker")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the automation against the mock portal")
+    parser.add_argument('--records', type=int, default=20)
+    parser.add_argument('--workers', default='1', help="Comma separated worker counts to compare, e.g. 1,2,4")
+    parser.add_argument('--pacing', default='fast')
+    parser.add_argument('--launch-profile', default='headless')
+    parser.add_argument('--engine', default='sync', choices=['sync', 'async'])
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency', type=float, default=mock_portal.DEFAULT_CONFIG['latency'])
+    parser.add_argument('--fail-rate', type=float, default=mock_portal.DEFAULT_CONFIG['fail_rate'])
+    parser.add_argument('--no-record-rate', type=float, default=mock_portal.DEFAULT_CONFIG['no_record_rate'])
+    parser.add_argument('--popup-rate', type=float, default=mock_portal.DEFAULT_CONFIG['popup_rate'])
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    server = mock_portal.serve({'latency': args.latency, 'fail_rate': args.fail_rate,
+                                'no_record_rate': args.no_record_rate, 'popup_rate': args.popup_rate,
+                                'captcha': BENCHMARK_CAPTCHA}, port=args.port)
+    # The app reads its portal, launch profile, engine and data folders at import, so set them up first
+    os.environ['PORTAL_URL'] = f"http://127.0.0.1:{args.port}"
+    os.environ['LAUNCH_PROFILE'] = args.launch_profile
+    os.environ['ENGINE'] = args.engine
+    os.chdir(tempfile.mkdtemp(prefix='benchmark_'))
+    import app
+
+    client = app.app.test_client()
+    credentials = app.CREDENTIALS[0] if app.CREDENTIALS else {'username': '', 'password': ''}
+    client.post('/login', data={'username': credentials['username'], 'password': credentials['password']})
+
+    results = []
+    for seed, workers in enumerate(int(count) for count in args.workers.split(',')):
+        print(f"DEBUG: Benchmarking {args.records} records with {workers} worker(s)")  # Debug
+        results.append(run_benchmark(app, client, args.records, workers, args.pacing, seed))
+    server.shutdown()
+
+    print_report(results)
+    with open(output, 'w') as f:
+        json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import asyncio
+from collections import deque
+
+class BrowserSupervisor:
+    """Owns one worker's browser, context and page and replaces them when they go bad.
+
+    After every record the worker reports whether it went well; the context is
+    recycled every recycle_every records, when the page's JS heap grows past
+    max_heap_mb or when too many of the last error_window records failed. A browser
+    that stops responding is relaunched. Either way the new context starts from the
+    current cookies, or the saved portal session when the old context is gone.
+    """
+
+    def __init__(self, playwright, launch, new_context, saved_state, log, name='',
+                 recycle_every=50, max_heap_mb=512, error_window=10, max_error_rate=0.5):
+        self.playwright = playwright
+        self.launch = launch
+        self.new_context = new_context
+        self.saved_state = saved_state
+        self.log = log
+        self.name = name
+        self.recycle_every = recycle_every
+        self.max_heap_mb = max_heap_mb
+        self.max_error_rate = max_error_rate
+        self.outcomes = deque(maxlen=error_window)
+        self.records_since_recycle = 0
+        self.recycles = 0
+        self.restarts = 0
+        self.heap_mb = None
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.cdp = None
+
+    def start(self, storage_state=None):
+        self.browser = self.launch(self.playwright)
+        self.open_page(storage_state)
+
+    def open_page(self, storage_state):
+        self.context = self.new_context(self.browser, storage_state=storage_state)
+        self.page = self.context.new_page()
+        self.cdp = None
+        self.records_since_recycle = 0
+        self.outcomes.clear()
+
+    def is_alive(self):
+        """True when the browser is connected and the page still answers a trivial script"""
+        try:
+            return self.browser.is_connected() and not self.page.is_closed() and self.page.evaluate("1") == 1
+        except Exception:
+            return False
+
+    def measure_heap(self):
+        """Used JS heap of the page in MB through the DevTools protocol, or None when unavailable"""
+        try:
+            if self.cdp is None:
+                self.cdp = self.context.new_cdp_session(self.page)
+                self.cdp.send("Performance.enable")
+            metrics = {metric['name']: metric['value'] for metric in self.cdp.send("Performance.getMetrics")['metrics']}
+            self.heap_mb = metrics['JSHeapUsedSize'] / (1024 * 1024)
+        except Exception:
+            self.heap_mb = None
+        return self.heap_mb
+
+    def record_finished(self, healthy):
+        """Count a finished record; returns why the context should be recycled, or None"""
+        reason = self.count_record(healthy)
+        if reason:
+            return reason
+        self.measure_heap()
+        return self.health_reason()
+
+    def count_record(self, healthy):
+        """Count a finished record; returns a reason when the context is due for its periodic recycle"""
+        self.records_since_recycle += 1
+        self.outcomes.append(healthy)
+        if self.recycle_every and self.records_since_recycle >= self.recycle_every:
+            return f"{self.records_since_recycle} records since the last recycle"
+        return None
+
+    def health_reason(self):
+        """Why the context should be recycled given the last heap measurement and outcomes, or None"""
+        if self.heap_mb is not None and self.heap_mb > self.max_heap_mb:
+            return f"JS heap at {self.heap_mb:.0f} MB"
+        if len(self.outcomes) == self.outcomes.maxlen:
+            error_rate = self.outcomes.count(False) / len(self.outcomes)
+            if error_rate >= self.max_error_rate:
+                return f"{error_rate:.0%} of the last {len(self.outcomes)} records failed"
+        return None
+
+    def current_state(self):
+        """Storage state to carry over: the live context's cookies, else the saved session file"""
+        try:
+            return self.context.storage_state()
+        except Exception:
+            return self.saved_state()
+
+    def recycle(self, reason):
+        """Replace the context and page, keeping the browser"""
+        self.log(f"[{self.name}] ♻️ Recycling browser context: {reason}", "info")
+        storage_state = self.current_state()
+        try:
+            self.context.close()
+        except Exception:
+            pass
+        try:
+            self.open_page(storage_state)
+            self.recycles += 1
+        except Exception as e:
+            self.relaunch(f"context could not be recreated ({e})")
+
+    def relaunch(self, reason):
+        """Replace the whole browser, e.g. after it crashed"""
+        self.log(f"[{self.name}] 🔄 Relaunching browser: {reason}", "warning")
+        storage_state = self.current_state()
+        try:
+            self.browser.close()
+        except Exception:
+            pass
+        self.browser = self.launch(self.playwright)
+        self.open_page(storage_state)
+        self.restarts += 1
+
+    def close(self):
+        try:
+            self.browser.close()
+        except Exception:
+            pass
+
+class SharedBrowser:
+    """The one browser every task of the asyncio engine opens its context on.
+
+    get() launches it on first use and again only when it has disconnected, so
+    several workers noticing the same crash cause a single relaunch, and says
+    whether that call was the one that launched it.
+    """
+
+    def __init__(self, launch):
+        self.launch = launch
+        self.browser = None
+        self.lock = asyncio.Lock()
+
+    async def get(self, playwright):
+        """(browser, launched): the shared browser, and True when this call launched it"""
+        async with self.lock:
+            if self.browser is not None and self.browser.is_connected():
+                return self.browser, False
+            await self.close()
+            self.browser = await self.launch(playwright)
+            return self.browser, True
+
+    async def close(self):
+        try:
+            await self.browser.close()
+        except Exception:
+            pass
+
+class AsyncBrowserSupervisor(BrowserSupervisor):
+    """BrowserSupervisor for playwright.async_api, owning one context and page on a SharedBrowser.
+
+    launch is the shared browser's get(), so relaunch() replaces this worker's context
+    and only replaces the browser itself when it is gone; restarts counts only the
+    relaunches that did launch a new browser. close() leaves the browser to the
+    other workers.
+    """
+
+    async def start(self, storage_state=None):
+        self.browser, _ = await self.launch(self.playwright)
+        await self.open_page(storage_state)
+
+    async def open_page(self, storage_state):
+        self.context = await self.new_context(self.browser, storage_state=storage_state)
+        self.page = await self.context.new_page()
+        self.cdp = None
+        self.records_since_recycle = 0
+        self.outcomes.clear()
+
+    async def is_alive(self):
+        try:
+            return self.browser.is_connected() and not self.page.is_closed() and await self.page.evaluate("1") == 1
+        except Exception:
+            return False
+
+    async def measure_heap(self):
+        try:
+            if self.cdp is None:
+                self.cdp = await self.context.new_cdp_session(self.page)
+                await self.cdp.send("Performance.enable")
+            metrics = {metric['name']: metric['value']
+                       for metric in (await self.cdp.send("Performance.getMetrics"))['metrics']}
+            self.heap_mb = metrics['JSHeapUsedSize'] / (1024 * 1024)
+        except Exception:
+            self.heap_mb = None
+        return self.heap_mb
+
+    async def record_finished(self, healthy):
+        reason = self.count_record(healthy)
+        if reason:
+            return reason
+        await self.measure_heap()
+        return self.health_reason()
+
+    async def current_state(self):
+        try:
+            return await self.context.storage_state()
+        except Exception:
+            return self.saved_state()
+
+    async def close_context(self):
+        try:
+            await self.context.close()
+        except Exception:
+            pass
+
+    async def recycle(self, reason):
+        self.log(f"[{self.name}] ♻️ Recycling browser context: {reason}", "info")
+        storage_state = await self.current_state()
+        await self.close_context()
+        try:
+            await self.open_page(storage_state)
+            self.recycles += 1
+        except Exception as e:
+            await self.relaunch(f"context could not be recreated ({e})")
+
+    async def relaunch(self, reason):
+        self.log(f"[{self.name}] 🔄 Relaunching browser: {reason}", "warning")
+        storage_state = await self.current_state()
+        await self.close_context()
+        self.browser, launched = await self.launch(self.playwright)
+        await self.open_page(storage_state)
+        if launched:
+            self.restarts += 1
+
+    async def close(self):
+        await self.close_context()
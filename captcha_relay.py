@@ -0,0 +1,79 @@
+import itertools
+import threading
+from datetime import datetime
+
+class CaptchaRelay:
+    """Passes CAPTCHA images from waiting logins to the web UI and the operator's answers back.
+
+    Each login opens a challenge, keeps its image up to date and blocks in
+    wait_answer() until an operator submits an answer, so several logins can
+    be unblocked from one page. on_change is called whenever the list of
+    pending challenges or their images change.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.challenges = {}
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def open(self, label):
+        challenge_id = str(next(self.ids))
+        with self.lock:
+            self.challenges[challenge_id] = {'label': label, 'image': None, 'updated': None,
+                                             'answer': None, 'answered': threading.Event()}
+        return challenge_id
+
+    def update_image(self, challenge_id, image):
+        """Store a new screenshot; returns True when it differs from the one shown"""
+        with self.lock:
+            challenge = self.challenges.get(challenge_id)
+            if challenge is None or challenge['image'] == image:
+                return False
+            challenge['image'] = image
+            challenge['updated'] = datetime.now().isoformat(timespec='milliseconds')
+        self.changed()
+        return True
+
+    def pending(self):
+        """Challenges with an image the operator can answer, oldest first"""
+        with self.lock:
+            return [{'id': challenge_id, 'label': challenge['label'], 'updated': challenge['updated']}
+                    for challenge_id, challenge in self.challenges.items() if challenge['image'] is not None]
+
+    def image(self, challenge_id):
+        with self.lock:
+            challenge = self.challenges.get(challenge_id)
+            return challenge['image'] if challenge else None
+
+    def answer(self, challenge_id, text):
+        """Hand an operator's answer to the waiting login; False if it is no longer waiting"""
+        with self.lock:
+            challenge = self.challenges.get(challenge_id)
+            if challenge is None:
+                return False
+            challenge['answer'] = text
+            challenge['answered'].set()
+        return True
+
+    def wait_answer(self, challenge_id, timeout):
+        """Block until an answer arrives or timeout seconds pass; returns the answer once, or None"""
+        with self.lock:
+            challenge = self.challenges.get(challenge_id)
+        if challenge is None or not challenge['answered'].wait(timeout):
+            return None
+        with self.lock:
+            answer = challenge['answer']
+            challenge['answer'] = None
+            challenge['answered'].clear()
+        return answer
+
+    def close(self, challenge_id):
+        with self.lock:
+            removed = self.challenges.pop(challenge_id, None)
+        if removed is not None:
+            self.changed()
@@ -0,0 +1,106 @@
+import json
+
+# Payload wording the portal uses for an Aadhaar without a record
+NO_RECORD_MARKERS = ('no record', 'not found', 'not_found', 'no data')
+ERROR_STATUSES = ('error', 'failed', 'failure', 'fail')
+MESSAGE_KEYS = ('message', 'msg', 'errormessage', 'error', 'statusmessage', 'description')
+# Keys of an account entry that hold the number when accounts come as objects, most specific first;
+# the generic 'value' and 'id' only count when none of the others is there
+ACCOUNT_NUMBER_KEYS = ('accountnumber', 'accountno', 'account_number', 'accno', 'account', 'value', 'id')
+# Keys of the list of accounts, most specific first; other keys mentioning 'account' are tried after
+# these, except ones describing the accounts rather than listing them, like accountTypes
+ACCOUNT_LIST_KEYS = ('accountnumbers', 'accountnos', 'account_numbers', 'accounts', 'accountlist', 'accountdetails')
+NOT_ACCOUNT_LIST_WORDS = ('type', 'status', 'name', 'holder', 'branch', 'ifsc')
+
+def keyed_values(payload, keys):
+    """Values of a dict under keys (case-insensitive), in the order of keys rather than of the dict"""
+    by_key = {key.lower(): value for key, value in payload.items() if isinstance(key, str)}
+    return [by_key[key] for key in keys if key in by_key]
+
+def find_value(payload, keys, accept, depth=4):
+    """First value under one of keys (case-insensitive, earlier keys first) that accept() likes, searching
+    nested dicts and lists"""
+    if depth < 0:
+        return None
+    if isinstance(payload, dict):
+        for value in keyed_values(payload, keys):
+            if accept(value):
+                return value
+        children = payload.values()
+    elif isinstance(payload, list):
+        children = payload
+    else:
+        return None
+    for child in children:
+        found = find_value(child, keys, accept, depth - 1)
+        if found is not None:
+            return found
+    return None
+
+def account_list_keys(payload):
+    """Keys of a dict that may hold the list of accounts, the ACCOUNT_LIST_KEYS first"""
+    keys = [key.lower() for key in payload if isinstance(key, str)]
+    others = [key for key in keys if 'account' in key and key not in ACCOUNT_LIST_KEYS
+              and not any(word in key for word in NOT_ACCOUNT_LIST_WORDS)]
+    return list(ACCOUNT_LIST_KEYS) + others
+
+def find_accounts(payload, depth=4):
+    """Account numbers from the first non-empty list of accounts, searching nested dicts and lists"""
+    if depth < 0:
+        return []
+    if isinstance(payload, dict):
+        for value in keyed_values(payload, account_list_keys(payload)):
+            if isinstance(value, list):
+                accounts = [number for number in map(account_number, value) if number]
+                if accounts:
+                    return accounts
+        children = payload.values()
+    elif isinstance(payload, list):
+        children = payload
+    else:
+        return []
+    for child in children:
+        accounts = find_accounts(child, depth - 1)
+        if accounts:
+            return accounts
+    return []
+
+def account_number(entry):
+    if isinstance(entry, (str, int)):
+        return str(entry)
+    if isinstance(entry, dict):
+        number = find_value(entry, ACCOUNT_NUMBER_KEYS, lambda value: isinstance(value, (str, int)), depth=0)
+        return str(number) if number is not None else None
+    return None
+
+def classify(status, payload):
+    """Outcome of FETCH RECORD from the portal's response.
+
+    Returns {'outcome': 'accounts' | 'no_record' | 'error' | 'unknown', 'message', 'accounts'};
+    'unknown' means the payload did not say, so the page itself has to be checked.
+    """
+    message = find_value(payload, MESSAGE_KEYS, lambda value: isinstance(value, str) and value.strip())
+    state = find_value(payload, ('status', 'result'), lambda value: isinstance(value, str))
+    words = f"{message or ''} {state or ''}".lower()
+    if status >= 400:
+        return {'outcome': 'error', 'message': f"Portal error {status}: {message or 'fetch record failed'}",
+                'accounts': []}
+    accounts = find_accounts(payload)
+    if accounts:
+        return {'outcome': 'accounts', 'message': message, 'accounts': accounts}
+    if any(marker in words for marker in NO_RECORD_MARKERS):
+        # Worded like the portal's toast, so the failure is classified the same way
+        if not message or 'no records found' not in message.lower():
+            message = f"No Records Found ({message})" if message else "No Records Found"
+        return {'outcome': 'no_record', 'message': message, 'accounts': []}
+    # Only the status field decides on an error; messages like "No error" would match a substring test
+    if (state or '').strip().lower() in ERROR_STATUSES:
+        return {'outcome': 'error', 'message': f"Portal error: {message or state}", 'accounts': []}
+    return {'outcome': 'unknown', 'message': message, 'accounts': []}
+
+def parse_body(text):
+    """JSON body of a response, or None when it is not JSON"""
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return None
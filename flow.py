@@ -0,0 +1,99 @@
+import json
+
+# Defaults for every step in a flow file; a step only lists what it changes
+STEP_DEFAULTS = {
+    'delay': [2.5, 4.0],      # Random pause before the action, scaled by the pacing profile
+    'wait_for': None,         # Page condition after the action: 'visible' (wait_target), 'url_change', 'network_idle' or null
+    'timeout': None,          # ms for the action and its wait; null uses the pacing profile's settle timeout
+    'retries': 0,             # Extra attempts before the step fails
+    'retry_delay': 2,         # Seconds between attempts
+    'popups': False,          # Dismiss popup dialogs after the step
+    'pause': 0,               # Seconds to pause after the step, scaled by the pacing profile
+    'required': True,         # A failed optional step is logged and the flow carries on
+    'always': False,          # Replayed on resume, e.g. navigation back to the record
+    'skip_if_set': False,     # Skipped when the target already holds the value, e.g. a select kept across records
+    'checkpoint': False,      # Completion is stored so a resumed record can skip past it
+    'submits': False,         # Completing this checkpoint submits the application; a record past it is done
+    'resume_target': None     # Only on the page once the checkpoint was reached; null uses the next step's target
+}
+
+def load_flow(path, actions):
+    """Read a flow file and return its steps with defaults filled in.
+
+    actions is the set of action names the caller can execute; unknown actions,
+    missing names and duplicate names raise ValueError before any record is touched.
+    """
+    with open(path, 'r') as f:
+        definition = json.load(f)
+    steps = []
+    names = set()
+    for index, raw in enumerate(definition.get('steps', []), start=1):
+        if 'name' not in raw or 'action' not in raw:
+            raise ValueError(f"Step {index} in {path} needs a 'name' and an 'action'")
+        if raw['action'] not in actions:
+            raise ValueError(f"Step '{raw['name']}' in {path} uses unknown action '{raw['action']}'")
+        if raw['name'] in names:
+            raise ValueError(f"Step name '{raw['name']}' appears twice in {path}")
+        if raw.get('wait_for') == 'visible' and 'wait_target' not in raw:
+            raise ValueError(f"Step '{raw['name']}' in {path} waits for 'visible' but has no 'wait_target'")
+        names.add(raw['name'])
+        steps.append({**STEP_DEFAULTS, **raw})
+    if not steps:
+        raise ValueError(f"Flow file {path} has no steps")
+    return steps
+
+def resume_plan(steps, last_step):
+    """Split the flow for a record whose last confirmed step is last_step into (replay, skipped, rest).
+
+    replay holds the 'always' steps before that checkpoint, which bring the browser
+    back to the record, skipped the other steps up to the checkpoint and rest the
+    steps after it. The skipped steps only stay skipped when the page is found at
+    the checkpoint after the replay, otherwise they run before rest as for a new
+    record, so 'always' steps belong at the start of the flow. Without a known
+    checkpoint this is ([], [], steps).
+    """
+    names = [step['name'] for step in steps]
+    if not last_step or last_step not in names:
+        return [], [], steps
+    resume_at = names.index(last_step) + 1
+    replay = [step for step in steps[:resume_at] if step['always']]
+    skipped = [step for step in steps[:resume_at] if not step['always']]
+    return replay, skipped, steps[resume_at:]
+
+def submitted(steps, last_step):
+    """True when the last confirmed step is a 'submits' step or comes after one, so nothing is left to redo"""
+    names = [step['name'] for step in steps]
+    if not last_step or last_step not in names:
+        return False
+    return any(step['submits'] for step in steps[:names.index(last_step) + 1])
+
+def resume_target(steps, last_step):
+    """Target showing that the page is past the checkpoint last_step: its resume_target, else the target of
+    the step after it; None when neither exists"""
+    names = [step['name'] for step in steps]
+    index = names.index(last_step)
+    if steps[index]['resume_target']:
+        return steps[index]['resume_target']
+    return steps[index + 1].get('target') if index + 1 < len(steps) else None
+
+def resolve_target(page, target):
+    """Turn a flow file target into a Playwright locator.
+
+    A target is {"role": ..., "name": ...}, {"selector": ...}, {"label": ...} or
+    {"text": ...}, optionally with "within" (a parent target), "exact" and "nth".
+    """
+    scope = resolve_target(page, target['within']) if 'within' in target else page
+    exact = target.get('exact')
+    if 'role' in target:
+        locator = scope.get_by_role(target['role'], name=target.get('name'), exact=exact)
+    elif 'selector' in target:
+        locator = scope.locator(target['selector'])
+    elif 'label' in target:
+        locator = scope.get_by_label(target['label'], exact=exact)
+    elif 'text' in target:
+        locator = scope.get_by_text(target['text'], exact=exact)
+    else:
+        raise ValueError(f"Target {target} needs a role, selector, label or text")
+    if 'nth' in target:
+        locator = locator.nth(target['nth'])
+    return locator
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+AADHAAR_COLUMN = 'Aadhar No'
+CHUNK_SIZE = 5000  # Valid numbers handed to the job store per insert
+MAX_REPORTED_INVALID = 10000  # Rejected rows kept for the upload report
+
+# Verhoeff checksum tables (multiplication, permutation) used by UIDAI for the 12th digit
+VERHOEFF_D = np.array([
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8],
+    [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2],
+    [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
+], dtype=np.uint8)
+VERHOEFF_P = np.array([
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0],
+    [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5],
+    [7, 0, 4, 6, 9, 1, 3, 2, 5, 8]
+], dtype=np.uint8)
+
+def verhoeff_valid(aadhaars):
+    """Boolean array telling which 12-digit strings carry a correct Verhoeff check digit"""
+    if len(aadhaars) == 0:
+        return np.zeros(0, dtype=bool)
+    digits = (np.frombuffer(''.join(aadhaars).encode('ascii'), dtype=np.uint8) - ord('0')).reshape(-1, 12)
+    check = np.zeros(len(digits), dtype=np.uint8)
+    # Walk the digits right to left, one position for all numbers at once
+    for i in range(12):
+        check = VERHOEFF_D[check, VERHOEFF_P[i % 8, digits[:, 11 - i]]]
+    return check == 0
+
+def normalize_block(values):
+    """Clean and validate a block of raw cells at once.
+
+    Returns (aadhaars, reasons): the normalized 12-digit strings and, per row, '' when
+    valid, None when the cell was empty, or the reason the row was rejected.
+    """
+    raw = pd.Series(values, dtype=object)
+    text = raw.astype(str).str.strip()
+    empty = raw.isna() | (text == '')
+    # Drop decimals, keep digits only, then truncate or zero-pad to 12 digits
+    digits = text.str.split('.', n=1).str[0].str.replace(r'[^0-9]', '', regex=True)
+    aadhaars = digits.str[:12].str.zfill(12)
+
+    reasons = pd.Series('', index=raw.index, dtype=object)
+    no_digits = ~empty & (digits == '')
+    reasons[no_digits] = "No digits found"
+    bad_prefix = ~empty & ~no_digits & aadhaars.str[0].isin(['0', '1'])
+    reasons[bad_prefix] = "Aadhaar numbers never start with 0 or 1"
+    candidates = ~empty & ~no_digits & ~bad_prefix
+    checksum_ok = verhoeff_valid(aadhaars[candidates].tolist())
+    reasons[candidates[candidates].index[~checksum_ok]] = "Checksum mismatch (Verhoeff)"
+    reasons[empty] = None
+    return aadhaars.tolist(), reasons.tolist()
+
+def iter_column(file_path, sheet_name, column):
+    """Yield (row_number, value) for one column, reading the workbook row by row"""
+    if file_path.lower().endswith('.xls'):
+        # openpyxl cannot read legacy .xls files, load just the one column through pandas
+        header = pd.read_excel(file_path, sheet_name=sheet_name, nrows=0).columns
+        if column not in header:
+            raise ValueError(f"Excel must contain '{column}' column")
+        values = pd.read_excel(file_path, sheet_name=sheet_name, usecols=[column], dtype=object)[column]
+        for row_number, value in enumerate(values, start=2):
+            yield row_number, None if pd.isna(value) else value
+        return
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        if column not in header:
+            raise ValueError(f"Excel must contain '{column}' column")
+        index = header.index(column)
+        for row_number, row in enumerate(rows, start=2):
+            yield row_number, row[index] if index < len(row) else None
+    finally:
+        workbook.close()
+
+def iter_aadhaar_chunks(file_path, sheet_name, stats, column=AADHAAR_COLUMN, chunk_size=CHUNK_SIZE):
+    """Yield lists of normalized, valid Aadhaar numbers while the sheet is being read.
+
+    Rows are validated chunk_size at a time. stats is filled in as rows are consumed:
+    total/valid/empty row counts and up to MAX_REPORTED_INVALID rejected rows as
+    (row number, value, reason).
+    """
+    stats.update({'rows': 0, 'valid': 0, 'empty': 0, 'invalid': [], 'invalid_count': 0})
+
+    def validate(row_numbers, values):
+        aadhaars, reasons = normalize_block(values)
+        valid = []
+        for row_number, value, aadhaar, reason in zip(row_numbers, values, aadhaars, reasons):
+            if reason is None:
+                stats['empty'] += 1
+            elif reason:
+                stats['invalid_count'] += 1
+                if len(stats['invalid']) < MAX_REPORTED_INVALID:
+                    stats['invalid'].append((row_number, str(value), reason))
+            else:
+                valid.append(aadhaar)
+        stats['valid'] += len(valid)
+        return valid
+
+    row_numbers, values = [], []
+    for row_number, value in iter_column(file_path, sheet_name, column):
+        stats['rows'] += 1
+        row_numbers.append(row_number)
+        values.append(value)
+        if len(values) >= chunk_size:
+            valid = validate(row_numbers, values)
+            row_numbers, values = [], []
+            if valid:
+                yield valid
+    if values:
+        valid = validate(row_numbers, values)
+        if valid:
+            yield valid
+
+def dedupe_chunks(chunks, already_submitted, stats):
+    """Drop numbers repeated within the sheet or already submitted in an earlier batch.
+
+    already_submitted is a set, so each lookup is O(1); stats gets 'new', 'duplicates'
+    and 'already_submitted' counts plus the first new numbers for the preview.
+    """
+    stats.update({'new': 0, 'duplicates': 0, 'already_submitted': 0, 'preview': []})
+    seen = set()
+    for chunk in chunks:
+        fresh = []
+        for aadhaar in chunk:
+            if aadhaar in seen:
+                stats['duplicates'] += 1
+            elif aadhaar in already_submitted:
+                stats['already_submitted'] += 1
+            else:
+                fresh.append(aadhaar)
+            seen.add(aadhaar)
+        stats['new'] += len(fresh)
+        stats['preview'].extend(fresh[:10 - len(stats['preview'])])
+        if fresh:
+            yield fresh
+
+def write_rejection_report(stats, output_path):
+    """Save the rejected rows with their reasons to an Excel file"""
+    pd.DataFrame(stats['invalid'], columns=['Row', 'Aadhar No', 'Reason']).to_excel(output_path, index=False)
+    return output_path
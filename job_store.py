@@ -0,0 +1,239 @@
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Record statuses: 'pending' -> 'processing' -> 'success' / 'failure', or 'skipped' when
+# another batch submitted the same Aadhaar in the meantime; a transient failure goes back
+# to 'pending' until its retry. Records of an upload still being read are 'staging'.
+FINISHED_STATUSES = ('success', 'failure', 'skipped')
+STAGING = 'staging'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    file_path TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    financial_year TEXT,
+    total_records INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS records (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    position INTEGER NOT NULL,
+    aadhaar TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at TEXT,
+    finished_at TEXT,
+    screenshot_path TEXT,
+    error TEXT,
+    last_step TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_records_status ON records(job_id, status);
+-- Aadhaar numbers already submitted successfully, per financial year, across all batches
+CREATE TABLE IF NOT EXISTS submitted (
+    financial_year TEXT NOT NULL,
+    aadhaar TEXT NOT NULL,
+    job_id TEXT,
+    submitted_at TEXT NOT NULL,
+    PRIMARY KEY (financial_year, aadhaar)
+);
+CREATE TABLE IF NOT EXISTS screenshots (
+    path TEXT PRIMARY KEY,
+    job_id TEXT,
+    position INTEGER,
+    aadhaar TEXT,
+    kind TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_screenshots_record ON screenshots(job_id, position);
+"""
+
+def now():
+    return datetime.now().isoformat(timespec='seconds')
+
+@contextmanager
+def connect(db_path):
+    """Open a connection for one transaction; every call gets its own so worker threads never share one"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def init_db(db_path):
+    """Create the job tables if they do not exist yet"""
+    with connect(db_path) as conn:
+        conn.executescript(SCHEMA)
+        # Job stores created before the dedup index lack the financial year column
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if 'financial_year' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN financial_year TEXT")
+        # ...and records created before the step engine lack the last confirmed step
+        columns = [row['name'] for row in conn.execute("PRAGMA table_info(records)")]
+        if 'last_step' not in columns:
+            conn.execute("ALTER TABLE records ADD COLUMN last_step TEXT")
+        # Uploads cut off by a restart while their sheet was being read are never completed
+        conn.execute("DELETE FROM records WHERE status = ?", (STAGING,))
+        conn.execute("DELETE FROM jobs WHERE status = ?", (STAGING,))
+
+def create_job(db_path, file_path, financial_year, aadhaar_chunks):
+    """Store a new batch from an iterable of Aadhaar lists.
+
+    Each chunk is committed on its own under the staging status, so the write lock is
+    not held while the next chunk is read from the sheet and a running batch can keep
+    saving its records. The batch only becomes visible once every chunk is stored.
+    Returns the job id, or None (and stores nothing) when the chunks held no records.
+    """
+    job_id = uuid.uuid4().hex
+    with connect(db_path) as conn:
+        conn.execute("INSERT INTO jobs (id, file_path, status, financial_year, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (job_id, file_path, STAGING, financial_year, now()))
+    total = 0
+    try:
+        for chunk in aadhaar_chunks:
+            with connect(db_path) as conn:
+                conn.executemany("INSERT INTO records (job_id, position, aadhaar, status) VALUES (?, ?, ?, ?)",
+                                 ((job_id, total + offset, aadhaar, STAGING) for offset, aadhaar in enumerate(chunk)))
+            total += len(chunk)
+    except Exception:
+        delete_job(db_path, job_id)
+        raise
+    if total == 0:
+        delete_job(db_path, job_id)
+        return None
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET status = 'pending' WHERE job_id = ?", (job_id,))
+        conn.execute("UPDATE jobs SET status = 'pending', total_records = ? WHERE id = ?", (total, job_id))
+    return job_id
+
+def delete_job(db_path, job_id):
+    with connect(db_path) as conn:
+        conn.execute("DELETE FROM records WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+def get_job(db_path, job_id):
+    """Return a job row with its record counters, or None if it does not exist"""
+    with connect(db_path) as conn:
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM records WHERE job_id = ? GROUP BY status",
+                                   (job_id,)).fetchall())
+    job = dict(job)
+    job['success_count'] = counts.get('success', 0)
+    job['failure_count'] = counts.get('failure', 0)
+    job['skipped_count'] = counts.get('skipped', 0)
+    job['finished_count'] = job['success_count'] + job['failure_count'] + job['skipped_count']
+    return job
+
+def get_unfinished_jobs(db_path):
+    """Jobs that still have records to process, newest first"""
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT job_id FROM records WHERE status NOT IN (?, ?, ?, ?)",
+            (*FINISHED_STATUSES, STAGING)).fetchall()
+    jobs = [get_job(db_path, row['job_id']) for row in rows]
+    return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+def get_pending_records(db_path, job_id):
+    """(position, aadhaar) pairs not yet finished, starting from the first unfinished record"""
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT position, aadhaar FROM records WHERE job_id = ? AND status NOT IN (?, ?, ?, ?) ORDER BY position",
+            (job_id, *FINISHED_STATUSES, STAGING)).fetchall()
+    return [(row['position'], row['aadhaar']) for row in rows]
+
+def get_job_results(db_path, job_id):
+    """All records of a job in upload order"""
+    with connect(db_path) as conn:
+        rows = conn.execute("SELECT * FROM records WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+def set_job_status(db_path, job_id, status):
+    """Update a job's status, stamping the start or finish time"""
+    column = 'started_at' if status == 'running' else 'finished_at'
+    with connect(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET status = ?, {column} = ? WHERE id = ?", (status, now(), job_id))
+
+def mark_record_started(db_path, job_id, position):
+    """Flag a record as in progress and return how many attempts it has had, this one included"""
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET status = 'processing', attempts = attempts + 1, started_at = ? "
+                     "WHERE job_id = ? AND position = ?", (now(), job_id, position))
+        return conn.execute("SELECT attempts FROM records WHERE job_id = ? AND position = ?",
+                            (job_id, position)).fetchone()['attempts']
+
+def mark_record_finished(db_path, job_id, position, success, screenshot_path=None, error=None):
+    """Record the outcome of a record; successes also go into the submitted index"""
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET status = ?, finished_at = ?, screenshot_path = ?, error = ? "
+                     "WHERE job_id = ? AND position = ?",
+                     ('success' if success else 'failure', now(), screenshot_path, error, job_id, position))
+        if success:
+            conn.execute("INSERT OR IGNORE INTO submitted (financial_year, aadhaar, job_id, submitted_at) "
+                         "SELECT jobs.financial_year, records.aadhaar, jobs.id, ? FROM records "
+                         "JOIN jobs ON jobs.id = records.job_id "
+                         "WHERE records.job_id = ? AND records.position = ? AND jobs.financial_year IS NOT NULL",
+                         (now(), job_id, position))
+
+def mark_record_retry(db_path, job_id, position, error, screenshot_path=None):
+    """Put a transiently failed record back to pending so a crash before its retry still resumes it"""
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET status = 'pending', error = ?, screenshot_path = ? "
+                     "WHERE job_id = ? AND position = ?", (error, screenshot_path, job_id, position))
+
+def mark_record_skipped(db_path, job_id, position, reason):
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET status = 'skipped', finished_at = ?, error = ? "
+                     "WHERE job_id = ? AND position = ?", (now(), reason, job_id, position))
+
+def set_last_step(db_path, job_id, position, step):
+    """Remember the last checkpoint step a record got through"""
+    with connect(db_path) as conn:
+        conn.execute("UPDATE records SET last_step = ? WHERE job_id = ? AND position = ?", (step, job_id, position))
+
+def get_last_step(db_path, job_id, position):
+    with connect(db_path) as conn:
+        row = conn.execute("SELECT last_step FROM records WHERE job_id = ? AND position = ?",
+                           (job_id, position)).fetchone()
+    return row['last_step'] if row else None
+
+def get_submitted_aadhaars(db_path, financial_year):
+    """Set of Aadhaar numbers already submitted successfully for the financial year"""
+    with connect(db_path) as conn:
+        rows = conn.execute("SELECT aadhaar FROM submitted WHERE financial_year = ?", (financial_year,))
+        return {row['aadhaar'] for row in rows}
+
+def is_submitted(db_path, financial_year, aadhaar):
+    with connect(db_path) as conn:
+        return conn.execute("SELECT 1 FROM submitted WHERE financial_year = ? AND aadhaar = ?",
+                            (financial_year, aadhaar)).fetchone() is not None
+
+def add_screenshot(db_path, job_id, position, aadhaar, kind, path, size):
+    with connect(db_path) as conn:
+        conn.execute("INSERT OR REPLACE INTO screenshots (path, job_id, position, aadhaar, kind, bytes, created_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)", (path, job_id, position, aadhaar, kind, size, now()))
+
+def remove_screenshots(db_path, paths):
+    """Drop index entries for screenshots evicted from disk"""
+    with connect(db_path) as conn:
+        conn.executemany("DELETE FROM screenshots WHERE path = ?", ((path,) for path in paths))
+
+def get_screenshots(db_path, job_id, position=None):
+    """Screenshots still on disk for a job, or for one of its records"""
+    query = "SELECT * FROM screenshots WHERE job_id = ?"
+    params = [job_id]
+    if position is not None:
+        query += " AND position = ?"
+        params.append(position)
+    with connect(db_path) as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY created_at", params)]
@@ -0,0 +1,109 @@
+import functools
+import os
+import select
+import shutil
+import subprocess
+import sys
+
+# headless: old headless mode; headless-new: Chromium's new headless mode, which renders like
+# a headed browser; xvfb: headed Chromium on a virtual display. --disable-dev-shm-usage keeps
+# many workers from exhausting the small /dev/shm of containers.
+LAUNCH_PROFILES = {
+    'headed': {'headless': False, 'args': ["--start-maximized"]},
+    'headless': {'headless': True, 'args': ["--disable-dev-shm-usage"]},
+    'headless-new': {'headless': False, 'args': ["--headless=new", "--disable-dev-shm-usage"]},
+    'xvfb': {'headless': False, 'args': ["--start-maximized", "--disable-dev-shm-usage"]}
+}
+
+# Requests dropped when resource blocking is on. Images are only dropped on request: the loan flow
+# clicks images on the form (the Financial Details expander), and CAPTCHA images are always let through.
+BLOCKED_RESOURCE_TYPES = {'font', 'media'}
+ANALYTICS_HOSTS = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'hotjar.com',
+                   'clarity.ms', 'facebook.net')
+
+XVFB_DISPLAY = ':99'
+XVFB_START_TIMEOUT = 10  # Seconds Xvfb gets to accept connections
+virtual_display = None  # Xvfb process shared by every worker of this server
+
+def start_virtual_display():
+    """Start Xvfb once and point DISPLAY at it once it accepts connections; returns False when Xvfb is not
+    installed, exited (e.g. the display is taken) or did not come up in time"""
+    global virtual_display
+    if virtual_display is None or virtual_display.poll() is not None:
+        if not shutil.which('Xvfb'):
+            return False
+        # -displayfd makes Xvfb write the display number to the pipe once it is ready
+        ready_read, ready_write = os.pipe()
+        try:
+            virtual_display = subprocess.Popen(['Xvfb', XVFB_DISPLAY, '-screen', '0', '1920x1080x24', '-nolisten', 'tcp',
+                                                '-displayfd', str(ready_write)],
+                                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                               pass_fds=(ready_write,))
+        finally:
+            os.close(ready_write)
+        try:
+            ready = wait_for_display(virtual_display, ready_read, XVFB_START_TIMEOUT)
+        finally:
+            os.close(ready_read)
+        if not ready:
+            virtual_display.terminate()
+            virtual_display = None
+            return False
+    os.environ['DISPLAY'] = XVFB_DISPLAY
+    return True
+
+def wait_for_display(process, ready_read, timeout):
+    """True once Xvfb reported its display on the pipe; False when it exited first or timed out"""
+    readable, _, _ = select.select([ready_read], [], [], timeout)
+    # An exited Xvfb closes the pipe, which reads as empty
+    return bool(readable) and bool(os.read(ready_read, 16).strip()) and process.poll() is None
+
+def resolve_profile(name, log):
+    """The launch profile that can actually run here.
+
+    A headed browser on a Linux server without DISPLAY moves to Xvfb, and Xvfb falls
+    back to new headless when it is not installed.
+    """
+    if name not in LAUNCH_PROFILES:
+        log(f"Unknown launch profile '{name}', using 'headed'", "warning")
+        name = 'headed'
+    if name == 'headed' and sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        log("No display available for a headed browser, trying a virtual display", "info")
+        name = 'xvfb'
+    if name == 'xvfb' and not start_virtual_display():
+        log("Xvfb is not installed or could not start, running Chromium in new headless mode instead", "warning")
+        name = 'headless-new'
+    return name
+
+def is_captcha_request(request):
+    if 'captcha' in request.url.lower():
+        return True
+    try:
+        return '/login' in request.frame.url  # Everything on the login page may belong to the CAPTCHA
+    except Exception:
+        return False
+
+def should_block(request, block_images=False):
+    if any(host in request.url for host in ANALYTICS_HOSTS):
+        return True
+    if request.resource_type == 'image':
+        return block_images and not is_captcha_request(request)
+    return request.resource_type in BLOCKED_RESOURCE_TYPES
+
+def block_resources(route, block_images=False):
+    """Route handler that drops fonts, media, analytics and, with block_images, images outside the login page"""
+    if should_block(route.request, block_images):
+        route.abort()
+    else:
+        route.continue_()
+
+async def block_resources_async(route, block_images=False):
+    """block_resources for contexts of playwright.async_api"""
+    if should_block(route.request, block_images):
+        await route.abort()
+    else:
+        await route.continue_()
+
+def resource_blocker(handler, block_images):
+    """The route handler with block_images bound, as context.route() passes only the route"""
+    return functools.partial(handler, block_images=block_images)
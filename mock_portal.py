@@ -0,0 +1,346 @@
+"""Local stand-in for the FasalRin portal, for benchmarking and testing the automation safely.
+
+Copies only what process_single_application touches: login with a CAPTCHA, the
+dashboard, the loan application page with FETCH RECORD, the account modal and the
+application form up to CONFIRM. Every API call can be slowed down, made to fail, or
+followed by a popup that has to be dismissed. Like the portal, it saves an
+application's progress when a section is completed (the second UPDATE & CONTINUE
+and SAVE & CONTINUE) and reopens the form there on the next FETCH RECORD, unless
+--forget-progress is given.
+
+    python mock_portal.py --port 5050 --latency 0.5 --fail-rate 0.02 --no-record-rate 0.1
+    PORTAL_URL=http://127.0.0.1:5050 python app.py
+"""
+import argparse
+import random
+import threading
+import time
+from flask import Flask, request, render_template_string, redirect, url_for, jsonify, session, Response
+
+DEFAULT_CONFIG = {
+    'latency': 0.3,          # Mean seconds added to every API call, +/- 50%
+    'page_latency': 0.2,     # Mean seconds added to every page load
+    'fail_rate': 0.0,        # Share of form API calls that fail with a server error toast
+    'no_record_rate': 0.1,   # Share of Aadhaar numbers for which FETCH RECORD finds nothing
+    'popup_rate': 0.0,       # Share of form steps followed by a modal with an OK button
+    'captcha': None,         # Fixed CAPTCHA answer; a random one per login page when None
+    'accounts': 2,           # Bank accounts offered for every record
+    'keep_progress': True    # Save completed sections of an application for the next FETCH RECORD
+}
+
+FORM_STEPS = ('application_type', 'update_1', 'update_2', 'financial_1', 'financial_2', 'financial_option',
+              'save_1', 'save_2', 'preview', 'submit', 'confirm')
+# Form steps that complete a section, and the section the form reopens at afterwards
+SAVED_SECTIONS = {'update_2': 'financial', 'save_2': 'preview'}
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>FasalRin (mock) - Login</title></head>
+<body>
+<h2>Login</h2>
+{% if error %}<div class="toast-message">{{ error }}</div>{% endif %}
+<form method="post" action="{{ url_for('login') }}">
+    <input type="text" name="mobile" aria-label="Enter Your Mobile No." placeholder="Enter Your Mobile No.">
+    <input type="password" name="password" aria-label="Password" placeholder="Password">
+    <img src="{{ url_for('captcha_image', n=nonce) }}" alt="captcha">
+    <input type="text" name="captcha" aria-label="Captcha" placeholder="Enter Captcha">
+    <button type="submit">Login</button>
+</form>
+</body></html>"""
+
+DASHBOARD_PAGE = """<!DOCTYPE html>
+<html><head><title>FasalRin (mock) - Dashboard</title></head>
+<body>
+<span>Welcome {{ mobile }}</span>
+<nav><a href="{{ url_for('loan_application') }}">Loan Application Loan</a></nav>
+</body></html>"""
+
+LOAN_PAGE = """<!DOCTYPE html>
+<html><head><title>FasalRin (mock) - Loan Application</title>
+<style>
+    .modal { position: fixed; inset: 0; background: rgba(0, 0, 0, 0.4); display: flex; align-items: center; justify-content: center; }
+    .modal[hidden] { display: none; }
+    .modal-content { background: white; padding: 20px; }
+    .step { margin: 8px 0; }
+</style>
+</head>
+<body>
+<div id="toast-container"></div>
+<select id="financial-year">
+    <option value="">Select Financial Year</option>
+    <option value="2024-2025">2024-2025</option>
+    <option value="2023-2024">2023-2024</option>
+</select>
+<input type="text" aria-label="Enter Aadhaar No." placeholder="Enter Aadhaar No.">
+<button id="fetch-record">FETCH RECORD</button>
+
+<div id="application" hidden>
+    <div class="pageMainContent">Application details</div>
+    <select name="applicationType" class="step">
+        <option value="">Select Application Type</option>
+        <option value="0">Fresh</option>
+        <option value="1">Renewal</option>
+    </select>
+    <button id="update" class="step" hidden>UPDATE &amp; CONTINUE</button>
+    <div role="tabpanel" aria-label="Financial Details" id="financial" hidden>
+        <img alt="Expand financial details" src="data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='16' height='16'/%3E" width="16" height="16">
+        <i>+</i> <i>&#10003;</i>
+        <span class="option">1</span> <span class="option">2</span>
+    </div>
+    <button id="save" class="step" hidden>SAVE &amp; CONTINUE</button>
+    <button id="preview" class="step" hidden>Preview</button>
+    <button id="submit" class="step" hidden>SUBMIT</button>
+    <button id="confirm" class="step" hidden>CONFIRM</button>
+</div>
+
+<div class="modal" id="account-modal" hidden><div class="modal-content">
+    <div class="modal-body">
+        <select name="accountNumbers"><option disabled selected>Select Account</option></select>
+    </div>
+    <div class="modal-footer"><button class="btn btn-primary" id="account-ok">OK</button></div>
+</div></div>
+<div class="modal" id="message-modal" hidden><div class="modal-content">
+    <div class="modal-body" id="message-text"></div>
+    <div class="modal-footer"><button class="btn btn-primary" id="message-ok">OK</button></div>
+</div></div>
+
+<script>
+    const $ = selector => document.querySelector(selector);
+    let aadhaar = '';
+    let updates = 0, saves = 0;
+
+    // Reopen the form at the section the server saved for this application
+    function restore(section) {
+        updates = 0;
+        saves = 0;
+        if (section === 'financial' || section === 'preview') {
+            updates = 2;
+            $('#financial').hidden = false;
+        }
+        if (section === 'preview') {
+            saves = 2;
+            $('#preview').hidden = false;
+        }
+    }
+
+    // The selected financial year is kept for the session, so returning to this page does not reset it
+    $('#financial-year').value = sessionStorage.getItem('financialYear') || '';
+    $('#financial-year').addEventListener('change', event => sessionStorage.setItem('financialYear', event.target.value));
+
+    function toast(message) {
+        const element = document.createElement('div');
+        element.className = 'toast-message';
+        element.textContent = message;
+        $('#toast-container').appendChild(element);
+        setTimeout(() => element.remove(), 4000);
+    }
+
+    // Messages are shown one at a time, each closed with its own OK click
+    const messages = [];
+    function showMessage(text) {
+        messages.push(text);
+        if (messages.length === 1) {
+            $('#message-text').textContent = text;
+            $('#message-modal').hidden = false;
+        }
+    }
+
+    // Runs one form step on the server; the next control only appears once it succeeded
+    async function step(name, next) {
+        const response = await fetch(`/api/step/${name}?aadhaar=${aadhaar}`, { method: 'POST' });
+        const data = await response.json();
+        if (!response.ok) {
+            toast(data.message);
+            return;
+        }
+        if (data.popup) {
+            showMessage(data.popup);
+        }
+        next();
+    }
+
+    $('#fetch-record').addEventListener('click', async () => {
+        aadhaar = document.querySelector('input[aria-label="Enter Aadhaar No."]').value;
+        const year = $('#financial-year').value;
+        const response = await fetch(`/api/fetch-record?aadhaar=${aadhaar}&year=${year}`);
+        const data = await response.json();
+        if (data.status !== 'ok') {
+            toast(data.message);
+            return;
+        }
+        const select = document.querySelector("select[name='accountNumbers']");
+        data.accounts.forEach(account => select.add(new Option(account, account)));
+        restore(data.section);
+        $('#account-modal').hidden = false;
+    });
+    $('#account-ok').addEventListener('click', () => {
+        if (document.querySelector("select[name='accountNumbers']").selectedIndex < 1) {
+            return;
+        }
+        $('#account-modal').hidden = true;
+        $('#application').hidden = false;
+    });
+    $('#message-ok').addEventListener('click', () => {
+        messages.shift();
+        if (messages.length) {
+            $('#message-text').textContent = messages[0];
+        } else {
+            $('#message-modal').hidden = true;
+        }
+    });
+    document.querySelector("select[name='applicationType']").addEventListener('change',
+        () => step('application_type', () => { $('#update').hidden = false; }));
+    $('#update').addEventListener('click', () => step(`update_${updates + 1}`, () => {
+        updates += 1;
+        if (updates === 2) { $('#update').hidden = true; $('#financial').hidden = false; }
+    }));
+    document.querySelector('#financial img').addEventListener('click', () => step('financial_1', () => {}));
+    document.querySelectorAll('#financial i')[1].addEventListener('click', () => step('financial_2', () => {}));
+    document.querySelectorAll('#financial .option')[0].addEventListener('click',
+        () => step('financial_option', () => { $('#save').hidden = false; }));
+    $('#save').addEventListener('click', () => step(`save_${saves + 1}`, () => {
+        saves += 1;
+        if (saves === 2) { $('#save').hidden = true; $('#preview').hidden = false; }
+    }));
+    $('#preview').addEventListener('click', () => step('preview', () => { $('#submit').hidden = false; }));
+    $('#submit').addEventListener('click', () => step('submit', () => { $('#confirm').hidden = false; }));
+    $('#confirm').addEventListener('click', () => step('confirm', () => {
+        $('#confirm').hidden = true;
+        showMessage('Application submitted successfully');
+        showMessage(`Loan application saved for Aadhaar ${aadhaar}`);
+    }));
+</script>
+</body></html>"""
+
+CAPTCHA_SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="120" height="40">
+<rect width="120" height="40" fill="#eee"/>
+<text x="12" y="28" font-family="monospace" font-size="22" fill="#333">{code}</text>
+</svg>"""
+
+def create_app(config=None):
+    """Build the mock portal; config overrides DEFAULT_CONFIG and can be changed while it runs"""
+    portal = Flask(__name__)
+    portal.secret_key = "mock-portal"
+    portal.config['MOCK'] = {**DEFAULT_CONFIG, **(config or {})}
+    stats = {'logins': 0, 'fetches': 0, 'not_found': 0, 'failures': 0, 'popups': 0, 'submitted': 0}
+    submitted = set()
+    sections = {}  # Aadhaar -> section its application was saved at
+    lock = threading.Lock()
+
+    def mock(key):
+        return portal.config['MOCK'][key]
+
+    def delay(mean):
+        if mean > 0:
+            time.sleep(random.uniform(mean * 0.5, mean * 1.5))
+
+    def count(key):
+        with lock:
+            stats[key] += 1
+
+    @portal.before_request
+    def require_login():
+        public = ('login', 'captcha_image', 'mock_stats', 'static')
+        if request.endpoint not in public and 'mobile' not in session:
+            if request.path.startswith('/api/'):
+                return jsonify({'status': 'error', 'message': 'Session expired'}), 401
+            return redirect(url_for('login'))
+
+    @portal.route('/')
+    def index():
+        return redirect(url_for('dashboard'))
+
+    @portal.route('/login', methods=['GET', 'POST'])
+    def login():
+        error = None
+        if request.method == 'POST':
+            if request.form.get('captcha', '').strip() == session.get('captcha'):
+                session['mobile'] = request.form.get('mobile', '')
+                count('logins')
+                return redirect(url_for('dashboard'))
+            error = 'Invalid Captcha'
+        delay(mock('page_latency'))
+        session['captcha'] = mock('captcha') or ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=5))
+        return render_template_string(LOGIN_PAGE, error=error, nonce=random.random())
+
+    @portal.route('/captcha.svg')
+    def captcha_image():
+        return Response(CAPTCHA_SVG.format(code=session.get('captcha', '')), mimetype='image/svg+xml',
+                        headers={'Cache-Control': 'no-store'})
+
+    @portal.route('/dashboard')
+    def dashboard():
+        delay(mock('page_latency'))
+        return render_template_string(DASHBOARD_PAGE, mobile=session['mobile'])
+
+    @portal.route('/loan-application')
+    def loan_application():
+        delay(mock('page_latency'))
+        return render_template_string(LOAN_PAGE)
+
+    @portal.route('/api/fetch-record')
+    def fetch_record():
+        delay(mock('latency'))
+        count('fetches')
+        aadhaar = request.args.get('aadhaar', '')
+        # Deterministic per number, so a retried record gets the same answer
+        if not aadhaar.isdigit() or int(aadhaar) % 1000 < mock('no_record_rate') * 1000:
+            count('not_found')
+            return jsonify({'status': 'not_found', 'message': 'No Records Found'})
+        with lock:
+            section = sections.get(aadhaar) if mock('keep_progress') else None
+        return jsonify({'status': 'ok', 'accounts': [f"{aadhaar[-4:]}00{n}" for n in range(1, mock('accounts') + 1)],
+                        'section': section})
+
+    @portal.route('/api/step/<name>', methods=['POST'])
+    def form_step(name):
+        delay(mock('latency'))
+        if name not in FORM_STEPS:
+            return jsonify({'status': 'error', 'message': f'Unknown step {name}'}), 404
+        if random.random() < mock('fail_rate'):
+            count('failures')
+            return jsonify({'status': 'error', 'message': 'Server error, please try again'}), 500
+        aadhaar = request.args.get('aadhaar', '')
+        with lock:
+            if name in SAVED_SECTIONS:
+                sections[aadhaar] = SAVED_SECTIONS[name]
+            if name == 'confirm':
+                sections.pop(aadhaar, None)
+                submitted.add(aadhaar)
+                stats['submitted'] = len(submitted)
+        popup = None
+        if name != 'confirm' and random.random() < mock('popup_rate'):
+            count('popups')
+            popup = 'Please verify the details before continuing'
+        return jsonify({'status': 'ok', 'popup': popup})
+
+    @portal.route('/mock/stats')
+    def mock_stats():
+        with lock:
+            return jsonify({**stats, 'config': portal.config['MOCK']})
+
+    return portal
+
+def serve(config=None, host='127.0.0.1', port=5050):
+    """Run the mock portal on a background thread; returns the server so callers can shut it down"""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, create_app(config), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local mock of the FasalRin portal")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency', type=float, default=DEFAULT_CONFIG['latency'])
+    parser.add_argument('--page-latency', type=float, default=DEFAULT_CONFIG['page_latency'])
+    parser.add_argument('--fail-rate', type=float, default=DEFAULT_CONFIG['fail_rate'])
+    parser.add_argument('--no-record-rate', type=float, default=DEFAULT_CONFIG['no_record_rate'])
+    parser.add_argument('--popup-rate', type=float, default=DEFAULT_CONFIG['popup_rate'])
+    parser.add_argument('--captcha', help="Fixed CAPTCHA answer instead of a random one")
+    parser.add_argument('--forget-progress', action='store_true',
+                        help="Always reopen applications at the start, as if the portal lost their progress")
+    args = parser.parse_args()
+    config = {key: value for key, value in vars(args).items() if key not in ('host', 'port', 'forget_progress')}
+    config['keep_progress'] = not args.forget_progress
+    print(f"DEBUG: Mock portal on http://{args.host}:{args.port} with {config}")  # Debug
+    create_app(config).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,63 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+class RetryQueue:
+    """Records waiting for another attempt, handed out once their backoff has elapsed.
+
+    Workers drain the main queue first and only then call pop(), which blocks until
+    the earliest record is due. Records are released in due order, ties in the order
+    they were deferred.
+    """
+
+    def __init__(self, base_delay=30, max_delay=300):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def backoff(self, attempts):
+        """Exponential delay before the next attempt: base, 2x base, 4x base... capped at max_delay"""
+        return min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+
+    def push(self, record, attempts):
+        """Defer a record; returns the delay in seconds before it is retried"""
+        delay = self.backoff(attempts)
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), record))
+            self.condition.notify_all()
+        return delay
+
+    def pop(self):
+        """Wait for the next due record; None once nothing is left to retry"""
+        with self.condition:
+            while self.heap:
+                due, _, record = self.heap[0]
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    heapq.heappop(self.heap)
+                    return record
+                # An earlier record pushed meanwhile wakes us up through notify_all
+                self.condition.wait(remaining)
+            return None
+
+    async def pop_async(self, poll=1.0):
+        """pop() for the asyncio engine; sleeps in slices of at most poll seconds so earlier
+        records pushed meanwhile are picked up"""
+        while True:
+            with self.condition:
+                if not self.heap:
+                    return None
+                due, _, record = self.heap[0]
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    heapq.heappop(self.heap)
+                    return record
+            await asyncio.sleep(min(remaining, poll))
+
+    def __len__(self):
+        with self.condition:
+            return len(self.heap)
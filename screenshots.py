@@ -0,0 +1,143 @@
+import io
+import os
+import queue
+import random
+import threading
+from collections import OrderedDict
+import job_store
+
+try:
+    from PIL import Image  # Optional, only needed for WebP output
+except ImportError:
+    Image = None
+
+CAPTURE_POLICIES = ('errors', 'sampled', 'always')
+
+class ScreenshotWriter:
+    """Captures screenshots on the worker thread and writes them to disk on a background thread.
+
+    The capture policy decides which shots are taken at all: 'errors' keeps only error
+    shots, 'sampled' adds a random share of debug shots and 'always' keeps everything.
+    Written files are indexed per job and record, and the oldest files are evicted once
+    the folder grows past quota_bytes.
+    """
+
+    def __init__(self, folder, db_path, policy='errors', sample_rate=0.1, image_format='jpeg',
+                 quality=60, quota_bytes=500 * 1024 * 1024, queue_size=100):
+        if policy not in CAPTURE_POLICIES:
+            raise ValueError(f"Unknown screenshot policy '{policy}', expected one of {CAPTURE_POLICIES}")
+        if image_format == 'webp' and Image is None:
+            print("WARNING: Pillow is not installed, saving screenshots as JPEG instead of WebP")
+            image_format = 'jpeg'
+        self.folder = folder
+        self.db_path = db_path
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.image_format = image_format
+        self.quality = quality
+        self.quota_bytes = quota_bytes
+        self.bytes_written = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.files = OrderedDict((path, size) for _, path, size in self.scan_folder())  # path -> size, oldest first
+        self.disk_usage = sum(self.files.values())
+        threading.Thread(target=self.run, daemon=True).start()
+
+    @property
+    def extension(self):
+        return 'jpg' if self.image_format == 'jpeg' else self.image_format
+
+    def scan_folder(self):
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return sorted(files)
+
+    def should_capture(self, kind):
+        if kind == 'error' or self.policy == 'always':
+            return True
+        return self.policy == 'sampled' and random.random() < self.sample_rate
+
+    def capture(self, page, name, kind='error', full_page=False, job_id=None, position=None, aadhaar=None):
+        """Grab a screenshot and queue it for writing; returns the target path or None if skipped"""
+        if not self.should_capture(kind):
+            return None
+        data = page.screenshot(**self.screenshot_options(full_page))
+        return self.enqueue(name, data, kind, job_id, position, aadhaar)
+
+    async def capture_async(self, page, name, kind='error', full_page=False, job_id=None, position=None, aadhaar=None):
+        """capture() for pages of playwright.async_api"""
+        if not self.should_capture(kind):
+            return None
+        data = await page.screenshot(**self.screenshot_options(full_page))
+        return self.enqueue(name, data, kind, job_id, position, aadhaar)
+
+    def screenshot_options(self, full_page):
+        # JPEG is encoded by the browser itself; PNG is captured losslessly for WebP conversion
+        if self.image_format == 'jpeg':
+            return {'type': 'jpeg', 'quality': self.quality, 'full_page': full_page}
+        return {'type': 'png', 'full_page': full_page}
+
+    def enqueue(self, name, data, kind, job_id, position, aadhaar):
+        path = os.path.join(self.folder, f"{name}.{self.extension}")
+        try:
+            self.queue.put_nowait((path, data, kind, job_id, position, aadhaar))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            print(f"WARNING: Screenshot queue full, dropped {name}")
+            return None
+        return path
+
+    def run(self):
+        while True:
+            path, data, kind, job_id, position, aadhaar = self.queue.get()
+            try:
+                self.write(path, data, kind, job_id, position, aadhaar)
+            except Exception as e:
+                print(f"ERROR: Failed to write screenshot {path}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def write(self, path, data, kind, job_id, position, aadhaar):
+        if self.image_format == 'webp':
+            buffer = io.BytesIO()
+            Image.open(io.BytesIO(data)).save(buffer, format='WEBP', quality=self.quality)
+            data = buffer.getvalue()
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            self.bytes_written += len(data)
+            # A name written again (e.g. a record retried) replaces its file, so its old size no longer counts
+            self.disk_usage += len(data) - self.files.pop(path, 0)
+            self.files[path] = len(data)
+        job_store.add_screenshot(self.db_path, job_id, position, aadhaar, kind, path, len(data))
+        self.enforce_quota(keep=path)
+
+    def enforce_quota(self, keep=None):
+        """Delete the oldest screenshots until the folder fits in the disk quota, never the keep path"""
+        evicted = []
+        with self.lock:
+            while self.disk_usage > self.quota_bytes and self.files:
+                path, size = self.files.popitem(last=False)
+                if path == keep:
+                    # Newest entry, so it is the only one left: over quota on its own but kept
+                    self.files[path] = size
+                    break
+                self.disk_usage -= size
+                evicted.append(path)
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if evicted:
+            job_store.remove_screenshots(self.db_path, evicted)
+
+    def stats(self):
+        with self.lock:
+            return {'bytes_written': self.bytes_written, 'disk_usage': self.disk_usage,
+                    'files': len(self.files), 'dropped': self.dropped, 'queued': self.queue.qsize()}
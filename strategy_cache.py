@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+class StrategyCache:
+    """Remembers which strategy worked for each named step and tries it first next time.
+
+    A strategy that fails demote_after times in a row is moved to the back of the order
+    until it succeeds again. Hit/miss counts and the moving average time of successful
+    runs are kept per step and saved to a JSON file so they survive restarts.
+    """
+
+    def __init__(self, path, demote_after=3, smoothing=0.3):
+        self.path = path
+        self.demote_after = demote_after
+        self.smoothing = smoothing  # Weight of the newest time in the moving average
+        self.lock = threading.Lock()
+        self.steps = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"ERROR: Could not load strategy cache {self.path}: {str(e)}")
+            return {}
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.steps, f, indent=2)
+
+    def stats_for(self, step, name):
+        step_stats = self.steps.setdefault(step, {'preferred': None, 'strategies': {}})
+        return step_stats['strategies'].setdefault(name, {'hits': 0, 'misses': 0, 'consecutive_failures': 0,
+                                                         'mean_seconds': None})
+
+    def order(self, step, names):
+        """Strategy names in the order to try them: preferred first, demoted last, otherwise as given"""
+        with self.lock:
+            preferred = self.steps.get(step, {}).get('preferred')
+            def key(name):
+                demoted = self.stats_for(step, name)['consecutive_failures'] >= self.demote_after
+                return (demoted, name != preferred, names.index(name))
+            return sorted(names, key=key)
+
+    def order_by_speed(self, step, names):
+        """Strategy names fastest first by their average successful time; untimed ones go first so
+        each gets measured, demoted ones last"""
+        with self.lock:
+            def key(name):
+                stats = self.stats_for(step, name)
+                mean_seconds = stats.get('mean_seconds')
+                return (stats['consecutive_failures'] >= self.demote_after, mean_seconds is not None,
+                        mean_seconds or 0, names.index(name))
+            return sorted(names, key=key)
+
+    def record(self, step, name, success, seconds=None):
+        with self.lock:
+            stats = self.stats_for(step, name)
+            if success:
+                stats['hits'] += 1
+                stats['consecutive_failures'] = 0
+                self.steps[step]['preferred'] = name
+                if seconds is not None:
+                    mean_seconds = stats.get('mean_seconds')
+                    stats['mean_seconds'] = round(seconds if mean_seconds is None else
+                                                  mean_seconds + self.smoothing * (seconds - mean_seconds), 3)
+            else:
+                stats['misses'] += 1
+                stats['consecutive_failures'] += 1
+            self.save()
+
+    def stats(self):
+        with self.lock:
+            return json.loads(json.dumps(self.steps))
+
+class LearnedValues:
+    """Values learned while running, e.g. the URL a link led to, saved to a JSON file of their own"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.values = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"ERROR: Could not load learned values {self.path}: {str(e)}")
+            return {}
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.values, f, indent=2)
+
+    def get(self, key):
+        with self.lock:
+            return self.values.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            if self.values.get(key) != value:
+                self.values[key] = value
+                self.save()
+
+    def forget(self, key):
+        with self.lock:
+            if self.values.pop(key, None) is not None:
+                self.save()
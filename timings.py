@@ -0,0 +1,162 @@
+import asyncio
+import contextvars
+import html
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+class TimingRecorder:
+    """Collects wall time per named step, split into portal, sleep and Playwright overhead.
+
+    Steps are timed with span(); while a span is open, measure('portal') and
+    add('sleep', ...) attribute time to it and to every enclosing span of the same
+    thread or asyncio task. Whatever is left of the wall time is counted as overhead: Playwright
+    calls, including their own auto-waiting, and our Python code.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = contextvars.ContextVar('timing_spans', default=())  # Open spans, innermost last
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def span(self, name):
+        totals = {'portal': 0.0, 'sleep': 0.0}
+        token = self.spans.set(self.spans.get() + (totals,))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - started
+            self.spans.reset(token)
+            sample = {'wall': wall, 'portal': totals['portal'], 'sleep': totals['sleep'],
+                      'overhead': max(0.0, wall - totals['portal'] - totals['sleep'])}
+            with self.lock:
+                self.samples[name].append(sample)
+
+    def timed(self, name=None):
+        """Decorator that times every call of a function as a span named after it"""
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name or func.__name__):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, kind, seconds):
+        for totals in self.spans.get():
+            totals[kind] += seconds
+
+    @contextmanager
+    def measure(self, kind):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(kind, time.perf_counter() - started)
+
+    def sleep(self, seconds):
+        """time.sleep that is counted as sleep time"""
+        time.sleep(seconds)
+        self.add('sleep', seconds)
+
+    async def sleep_async(self, seconds):
+        """asyncio.sleep that is counted as sleep time"""
+        await asyncio.sleep(seconds)
+        self.add('sleep', seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """Per-step count, wall time percentiles and the mean portal/sleep/overhead split, slowest total first"""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+        steps = []
+        for name, values in samples.items():
+            wall = np.array([sample['wall'] for sample in values])
+            step = {'step': name, 'count': len(values), 'total': round(float(wall.sum()), 3)}
+            for percentile, value in zip(PERCENTILES, np.percentile(wall, PERCENTILES)):
+                step[f'p{percentile}'] = round(float(value), 3)
+            for kind in ('portal', 'sleep', 'overhead'):
+                step[f'{kind}_mean'] = round(sum(sample[kind] for sample in values) / len(values), 3)
+            steps.append(step)
+        return sorted(steps, key=lambda step: step['total'], reverse=True)
+
+    def write_report(self, json_path, html_path, metadata=None):
+        """Save the summary as JSON and as a standalone HTML page; returns both paths"""
+        report = {'metadata': metadata or {}, 'steps': self.summary()}
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(html_path, 'w') as f:
+            f.write(render_html(report))
+        return json_path, html_path
+
+def render_html(report):
+    """Table of percentiles with a bar per step: length is total time relative to the costliest
+    step, colours split it into portal, sleep and overhead"""
+    steps = report['steps']
+    max_total = max((step['total'] for step in steps), default=0) or 1
+    rows = []
+    for step in steps:
+        mean = (step['portal_mean'] + step['sleep_mean'] + step['overhead_mean']) or 1
+        width = 100 * step['total'] / max_total
+        bars = ''.join(
+            f'<span class="{kind}" style="width:{100 * step[kind + "_mean"] / mean:.1f}%"></span>'
+            for kind in ('portal', 'sleep', 'overhead'))
+        rows.append(
+            f"<tr><td>{html.escape(step['step'])}</td><td>{step['count']}</td>"
+            f"<td>{step['p50']:.2f}</td><td>{step['p95']:.2f}</td><td>{step['p99']:.2f}</td>"
+            f"<td>{step['portal_mean']:.2f}</td><td>{step['sleep_mean']:.2f}</td><td>{step['overhead_mean']:.2f}</td>"
+            f"<td>{step['total']:.1f}</td>"
+            f'<td class="bar"><div style="width:{width:.1f}%">{bars}</div></td></tr>')
+    metadata = ''.join(f"<li>{html.escape(str(key))}: {html.escape(str(value))}</li>"
+                       for key, value in report['metadata'].items())
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Step timing report</title>
+<style>
+    body {{ font-family: Arial, sans-serif; margin: 20px; }}
+    table {{ border-collapse: collapse; width: 100%; }}
+    th, td {{ border: 1px solid #ddd; padding: 6px; text-align: right; }}
+    td:first-child {{ text-align: left; }}
+    .bar {{ width: 30%; }}
+    .bar div {{ display: flex; height: 14px; }}
+    .portal {{ background: #4e79a7; }}
+    .sleep {{ background: #f28e2b; }}
+    .overhead {{ background: #bab0ac; }}
+</style>
+</head>
+<body>
+<h2>Step timing report</h2>
+<ul>{metadata}</ul>
+<p>Seconds per step. Spans nest, so 'record' and slow_action steps include the helpers they call.
+Bars show total time against the costliest step:
+<span style="color:#4e79a7">portal</span>, <span style="color:#f28e2b">sleep</span>,
+<span style="color:#8a817c">Playwright overhead</span>.</p>
+<table>
+<tr><th>Step</th><th>Count</th><th>p50</th><th>p95</th><th>p99</th>
+<th>Portal (mean)</th><th>Sleep (mean)</th><th>Overhead (mean)</th><th>Total</th><th>Total time</th></tr>
+{''.join(rows)}
+</table>
+</body>
+</html>
+"""